@@ -1,101 +1,278 @@
 from flask import (
-    Flask, request, render_template, send_file, url_for,
-    redirect, send_from_directory, abort, make_response
+    Blueprint, Flask, current_app, request, render_template, send_file, url_for,
+    redirect, abort, make_response, jsonify, g, session,
+    Response, stream_with_context
 )
+from jinja2 import FileSystemBytecodeCache
 from flask_login import (
     LoginManager, login_user, login_required,
     logout_user, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import safe_join
 from werkzeug.exceptions import RequestEntityTooLarge
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-from openai import OpenAI
-from sqlalchemy import text
-import pdfkit
+from sqlalchemy import text, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import make_transient_to_detached
+from concurrent.futures import ThreadPoolExecutor
 import os
 import csv
+import hashlib
 import io
+import json
+import threading
+import time
 from datetime import datetime, timedelta
 
-from models import db, User, Report
-
-# === APP CONFIG ===
-app = Flask(__name__)
-app.config.update(
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_PORT=587,
-    MAIL_USE_TLS=True,
-    MAIL_USERNAME=os.environ.get("EMAIL_USER"),
-    MAIL_PASSWORD=(os.environ.get("EMAIL_PASS") or os.environ.get("EMAIL_PASSWORD")),
-    MAIL_DEFAULT_SENDER=(os.environ.get("MAIL_DEFAULT_SENDER") or os.environ.get("EMAIL_USER")),
-    SECRET_KEY=os.environ.get("SECRET_KEY", "mysecret"),
-    SQLALCHEMY_DATABASE_URI="sqlite:///users.db",
-)
+from models import db, User, Report, ReportJob, ensure_columns, ensure_indexes
+import dbconfig
+import assets
+import batch
+from cache import DiskCache
+import breaker
+import jobs
+import outbox
+import digest
+import ingest
+import llm
+import metrics
+import pdf
+import progress
+import rollups
+import sales_history
+import storage
+import summarize
+
+# Застосунок збирає create_app(): імпорт модуля не відкриває з'єднань з БД і не створює
+# OpenAI-клієнта — усе це ліниво при першому використанні в конкретному процесі,
+# тож воркери gunicorn стартують швидко, а після fork не ділять з'єднань з майстром.
 
 # Ліміт розміру аплоада (за замовчуванням 10 МБ, змінити через MAX_UPLOAD_MB)
 MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "10"))
-app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Файли звітів: хеш-адресовані шардовані директорії, HTML у gzip, прибирання — storage.sweep
+REPORT_CACHE_SECONDS = int(os.getenv("REPORT_CACHE_SECONDS", "86400"))
+
+# Скомпільовані шаблони Jinja на диску: воркери не компілюють їх заново після кожного рестарту.
+# Порожнє значення вимикає
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR", os.path.join("cache", "jinja"))
+
+# Генерація звітів через чергу (jobs.py + worker.py); 0 — по-старому, в межах запиту
+ASYNC_REPORTS = os.getenv("ASYNC_REPORTS", "1") == "1"
 
 # === MAIL CHECK ===
 MAIL_ENABLED = all((
-    app.config.get("MAIL_USERNAME"),
-    app.config.get("MAIL_PASSWORD"),
-    app.config.get("MAIL_DEFAULT_SENDER"),
+    os.environ.get("EMAIL_USER"),
+    os.environ.get("EMAIL_PASS") or os.environ.get("EMAIL_PASSWORD"),
+    os.environ.get("MAIL_DEFAULT_SENDER") or os.environ.get("EMAIL_USER"),
 ))
 AUTO_VERIFY_IF_NO_MAIL = os.getenv("AUTO_VERIFY_IF_NO_MAIL", "1") == "1"
-if MAIL_ENABLED:
-    app.logger.warning("[MAIL DIAG] USER:True PASS:True SENDER:True")
-else:
-    app.logger.warning("[MAIL DIAG] Mail is NOT fully configured. Email sending DISABLED.")
 
-# === INIT ===
-mail = Mail(app)
-db.init_app(app)
+# === Розширення (прив'язуються до застосунку в create_app) ===
+mail = Mail()
 
 login_manager = LoginManager()
-login_manager.login_view = 'login'
-login_manager.init_app(app)
+login_manager.login_view = 'main.login'
 
-with app.app_context():
-    db.create_all()
+bp = Blueprint("main", __name__)
 
-# === OpenAI v1 client (safe logging) ===
-raw_key = os.getenv("OPENAI_API_KEY", "")
-masked = (raw_key[:7] + "..." + raw_key[-4:]) if raw_key and len(raw_key) > 11 else ("MISSING" if not raw_key else raw_key[:7] + "...")
-app.logger.info(f"[OpenAI] API key loaded? {'YES' if raw_key else 'NO'} ({masked})")
-client = OpenAI(api_key=raw_key)
+# Короткоживучий спільний (між воркерами) кеш похідного стану, напр. кількості звітів
+state_cache = DiskCache(
+    path=os.getenv("STATE_CACHE_PATH", os.path.join("cache", "state.db")),
+    max_bytes=int(os.getenv("STATE_CACHE_MAX_MB", "20")) * 1024 * 1024,
+    ttl_seconds=float(os.getenv("STATE_CACHE_TTL_SECONDS", "300")),
+)
+
+# === Схема БД: створюється до fork (prepare_schema), у процесі лише перевіряється ===
+_schema_lock = threading.Lock()
+# create_all/ensure_indexes мають checkfirst, але між перевіркою і CREATE сусідній процес
+# може встигнути першим ("already exists"); кожна наступна спроба пропускає вже створене
+_SCHEMA_ATTEMPTS = 5
+
+def ensure_schema():
+    """create_all + індекси, яких бракує; викликати в app context. Повторні виклики — no-op."""
+    app = current_app._get_current_object()
+    if app.extensions.get("restgenius_schema"):
+        return
+    with _schema_lock:
+        if app.extensions.get("restgenius_schema"):
+            return
+        for attempt in range(1, _SCHEMA_ATTEMPTS + 1):
+            try:
+                db.create_all()
+                ensure_columns()
+                ensure_indexes()
+                break
+            except OperationalError:
+                db.session.rollback()
+                if attempt == _SCHEMA_ATTEMPTS:
+                    raise
+                current_app.logger.info("[DB] schema race with another process; retry attempt=%s", attempt)
+                time.sleep(0.1 * attempt)
+        app.extensions["restgenius_schema"] = True
+
+def prepare_schema():
+    """Створює схему один раз у батьківському процесі (майстер gunicorn, worker.py) до fork/spawn.
+
+    Застосунок тимчасовий: його з'єднання закриваються, нащадки відкривають власні.
+    """
+    app = create_app()
+    with app.app_context():
+        ensure_schema()
+        db.engine.dispose()
+
+@bp.before_app_request
+def _ensure_schema_before_request():
+    ensure_schema()
+
+# === Кеш користувача і квот (спільний між воркерами, інвалідується явно) ===
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+_USER_CACHE_FIELDS = ("id", "email", "is_verified", "is_pro", "free_reports_used", "free_reports_reset")
+
+def _user_cache_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+def _dump_user_state(user: User, last_report) -> str:
+    state = {name: getattr(user, name) for name in _USER_CACHE_FIELDS}
+    state["free_reports_reset"] = user.free_reports_reset.isoformat() if user.free_reports_reset else None
+    state["last_report"] = None if last_report is None else {
+        "id": last_report.id,
+        "filename": last_report.filename,
+        "created_at": last_report.created_at.isoformat() if last_report.created_at else None,
+        "label": last_report.label,
+    }
+    return json.dumps(state)
+
+def _user_from_state(state: dict) -> User:
+    """Відновлює User з кешу як persistent-об'єкт сесії — без SELECT; зміни полів далі йдуть UPDATE."""
+    fields = {name: state[name] for name in _USER_CACHE_FIELDS}
+    if fields["free_reports_reset"]:
+        fields["free_reports_reset"] = datetime.fromisoformat(fields["free_reports_reset"])
+    user = User(**fields)
+    make_transient_to_detached(user)
+    db.session.add(user)
+    return user
+
+def _last_report_from_state(state: dict):
+    data = state.get("last_report")
+    if not data:
+        return None
+    created_at = datetime.fromisoformat(data["created_at"]) if data["created_at"] else None
+    # Лише для відображення: у сесію не додаємо
+    return Report(id=data["id"], filename=data["filename"], created_at=created_at, label=data.get("label"))
+
+def invalidate_user(user_id: int):
+    """Викликати після коміту змін is_pro / is_verified / лімітів або нового звіту."""
+    state_cache.delete(_user_cache_key(user_id))
+    state_cache.delete(f"report_count:{user_id}")
+
+def _report_committed(user_id: int):
+    """Після коміту звіту: скидає кеш стану і дораховує зведення трендів за змінені дні."""
+    invalidate_user(user_id)
+    changed = db.session.info.pop("rg_sales_changed", None)
+    if not changed or changed[0] != user_id:
+        return
+    try:
+        with metrics.stage("rollup_update"):
+            rollups.refresh(*changed)
+    except Exception:
+        # Зведення похідні від SalesRecord: /api/trends перебудує їх, звіт від цього не страждає
+        current_app.logger.exception("[ROLLUP] refresh failed user_id=%s", user_id)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    key = _user_cache_key(user_id)
+    cached = state_cache.get(key)
+    if cached is not None:
+        state = json.loads(cached)
+        g.rg_last_report = _last_report_from_state(state)
+        return _user_from_state(state)
+
+    # Промах: користувач і його останній звіт — одним запитом
+    latest_report_id = (
+        select(Report.id)
+        .where(Report.user_id == User.id)
+        .order_by(Report.created_at.desc(), Report.id.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    row = db.session.execute(
+        select(User, Report).outerjoin(Report, Report.id == latest_report_id).where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    user, last_report = row
+    state_cache.set(key, _dump_user_state(user, last_report), ttl_seconds=USER_CACHE_TTL)
+    g.rg_last_report = last_report
+    return user
 
 # === Helpers ===
+def _limits_reset_due(user: User, now: datetime = None) -> bool:
+    now = now or datetime.utcnow()
+    return not user.free_reports_reset or (now - user.free_reports_reset) > timedelta(days=14)
+
+def free_reports_used(user: User) -> int:
+    """Використані FREE-звіти з урахуванням 14-денного ресету — без запису в БД."""
+    return 0 if _limits_reset_due(user) else (user.free_reports_used or 0)
+
 def check_and_reset_limits(user: User):
-    """Скидає лічильники безкоштовних звітів кожні 14 днів."""
+    """Скидає лічильники безкоштовних звітів кожні 14 днів.
+
+    Не комітить: зміна йде в БД разом із рештою записів запиту (один коміт на запит).
+    """
     now = datetime.utcnow()
-    if not user.free_reports_reset or (now - user.free_reports_reset) > timedelta(days=14):
+    if _limits_reset_due(user, now):
         user.free_reports_used = 0
         user.free_reports_reset = now
-        db.session.commit()
-        app.logger.info("[LIMIT] reset user_id=%s", user.id)
+        current_app.logger.info("[LIMIT] reset user_id=%s", user.id)
+
+def _report_count(user_id: int) -> int:
+    """Кількість звітів користувача з кешу; COUNT(*) лише при промаху."""
+    key = f"report_count:{user_id}"
+    cached = state_cache.get(key)
+    if cached is not None:
+        return int(cached)
+    total = Report.query.filter_by(user_id=user_id).count()
+    state_cache.set(key, str(total))
+    return total
 
 def _allowed_csv(filename: str) -> bool:
     return filename.lower().endswith(".csv")
 
 def _toast_redirect(message_cookie: str = "rg_error"):
     """Редірект на дашборд з коротким toast-прапорцем у кукі."""
-    resp = redirect(url_for("dashboard"))
+    resp = redirect(url_for("main.dashboard"))
     resp.set_cookie(message_cookie, "1", max_age=300, samesite="Lax")
     return resp
 
+def _static_page(template: str):
+    """Сторінка, що не залежить від користувача (index, login, register): рендер раз на процес,
+    далі — готовий HTML з ETag, повторний візит отримує 304 без тіла.
+
+    Flash-повідомлення роблять сторінку персональною — тоді звичайний рендер без кешу.
+    """
+    if session.get("_flashes"):
+        return render_template(template)
+    pages = current_app.extensions.setdefault("restgenius_pages", {})
+    page = None if current_app.debug else pages.get(template)
+    if page is None:
+        html = render_template(template)
+        page = pages[template] = (html, hashlib.sha256(html.encode("utf-8")).hexdigest()[:32])
+    response = make_response(page[0])
+    response.set_etag(page[1])
+    # Перевіряти щоразу: після деплою сторінка посилається на нові відбитки статики
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 # === ROUTES ===
-@app.route("/")
+@bp.route("/")
 def index():
-    return render_template("index.html")
+    return _static_page("index.html")
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
@@ -108,46 +285,37 @@ def register():
             return "User already exists"
 
         hashed_pw = generate_password_hash(password, method="pbkdf2:sha256")
-        new_user = User(email=email, password=hashed_pw, is_verified=False)
+        # Без пошти (dev) одразу верифікуємо — один коміт замість двох
+        auto_verify = not MAIL_ENABLED and AUTO_VERIFY_IF_NO_MAIL
+        new_user = User(email=email, password=hashed_pw, is_verified=auto_verify)
         db.session.add(new_user)
-        db.session.commit()
 
         if MAIL_ENABLED:
-            s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+            s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
             token = s.dumps(email, salt="email-confirm")
-            link = url_for('confirm_email', token=token, _external=True)
+            link = url_for('main.confirm_email', token=token, _external=True)
             ttl_hours = int(int(os.getenv("CONFIRM_MAX_AGE_SECONDS", "172800")) / 3600)
 
-            msg = Message(
-                "Confirm your email",
-                sender=app.config["MAIL_DEFAULT_SENDER"],
-                recipients=[email],
-            )
-            msg.html = f"""
+            html = f"""
             <h3>Welcome to RestGenius!</h3>
             <p>Click the button below to verify your email:</p>
             <a href="{link}" style="padding: 10px 20px; background: #1a73e8; color: white; text-decoration: none; border-radius: 6px;">✅ Confirm Email</a>
             <p style="color:#475569; font-size:13px; margin-top:8px;">Link is valid for up to {ttl_hours} hours.</p>
             """
-            try:
-                mail.send(msg)
-                return "✅ Registration successful. Please check your email to confirm."
-            except Exception:
-                app.logger.exception("[MAIL] send failed")
-                return "We couldn't send the confirmation email right now. Please try again later.", 200
-        else:
-            if AUTO_VERIFY_IF_NO_MAIL:
-                new_user.is_verified = True
-                db.session.commit()
-                return "✅ Registration successful (dev mode). Email auto-verified. You can log in now."
-            else:
-                return "✅ Registration successful. Email verification is disabled.", 200
+            # Лист іде в outbox тим самим комітом, що й користувач; SMTP — справа sender-а
+            outbox.enqueue(email, "Confirm your email", html)
+            db.session.commit()
+            return "✅ Registration successful. Please check your email to confirm."
+        db.session.commit()
+        if auto_verify:
+            return "✅ Registration successful (dev mode). Email auto-verified. You can log in now."
+        return "✅ Registration successful. Email verification is disabled.", 200
 
-    return render_template("register.html")
+    return _static_page("register.html")
 
-@app.route("/confirm/<token>")
+@bp.route("/confirm/<token>")
 def confirm_email(token):
-    s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
     max_age = int(os.getenv("CONFIRM_MAX_AGE_SECONDS", "172800"))  # 48 год за замовчуванням
     try:
         email = s.loads(token, salt="email-confirm", max_age=max_age)
@@ -163,9 +331,10 @@ def confirm_email(token):
         return "✅ Email already confirmed. You can log in."
     user.is_verified = True
     db.session.commit()
+    invalidate_user(user.id)
     return "✅ Email confirmed! You can now log in."
 
-@app.route("/resend-confirmation", methods=["POST"])
+@bp.route("/resend-confirmation", methods=["POST"])
 @login_required
 def resend_confirmation():
     # Уже підтверджений?
@@ -177,34 +346,32 @@ def resend_confirmation():
         if AUTO_VERIFY_IF_NO_MAIL:
             current_user.is_verified = True
             db.session.commit()
-            app.logger.warning("[MAIL] disabled; auto-verified user_id=%s", current_user.id)
+            invalidate_user(current_user.id)
+            current_app.logger.warning("[MAIL] disabled; auto-verified user_id=%s", current_user.id)
             return _toast_redirect("rg_auto_verified")
         return _toast_redirect("rg_confirm_err")
 
     try:
-        s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+        s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         token = s.dumps(current_user.email, salt="email-confirm")
-        link = url_for('confirm_email', token=token, _external=True)
+        link = url_for('main.confirm_email', token=token, _external=True)
         ttl_hours = int(int(os.getenv("CONFIRM_MAX_AGE_SECONDS", "172800")) / 3600)
 
-        msg = Message(
-            "Confirm your email",
-            sender=app.config["MAIL_DEFAULT_SENDER"],
-            recipients=[current_user.email],
-        )
-        msg.html = f"""
+        html = f"""
         <h3>Confirm your email</h3>
         <p>Click the button below to verify your email:</p>
         <a href="{link}" style="padding:10px 20px; background:#1a73e8; color:#fff; text-decoration:none; border-radius:6px;">✅ Confirm Email</a>
         <p style="color:#475569; font-size:13px; margin-top:8px;">Link is valid for up to {ttl_hours} hours.</p>
         """
-        mail.send(msg)
+        outbox.enqueue(current_user.email, "Confirm your email", html)
+        db.session.commit()
         return _toast_redirect("rg_confirm_sent")
     except Exception as e:
-        app.logger.exception("[MAIL] resend failed user_id=%s err=%s", current_user.id, e)
+        db.session.rollback()
+        current_app.logger.exception("[MAIL] resend enqueue failed user_id=%s err=%s", current_user.id, e)
         return _toast_redirect("rg_confirm_err")
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         email = request.form.get("email", "").strip().lower()
@@ -215,22 +382,22 @@ def login():
         if not user.is_verified:
             return "❗ Please verify your email before logging in."
         login_user(user)
-        return redirect(url_for("dashboard"))
-    return render_template("login.html")
+        return redirect(url_for("main.dashboard"))
+    return _static_page("login.html")
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
     return "Logged out successfully"
 
-@app.errorhandler(RequestEntityTooLarge)
+@bp.app_errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(e):
-    app.logger.warning("[UPLOAD] too_large user_id=%s max_mb=%s", getattr(current_user, "id", None), MAX_UPLOAD_MB)
+    current_app.logger.warning("[UPLOAD] too_large user_id=%s max_mb=%s", getattr(current_user, "id", None), MAX_UPLOAD_MB)
     # 413 → редірект і toast
     return _toast_redirect("rg_err_size")
 
-@app.route("/sample-csv")
+@bp.route("/sample-csv")
 @login_required
 def sample_csv():
     """Віддає приклад CSV для швидкого тесту."""
@@ -250,7 +417,7 @@ def sample_csv():
     return resp
 
 # === DEV Upgrade to PRO ===
-@app.route("/upgrade/dev")
+@bp.route("/upgrade/dev")
 @login_required
 def upgrade_dev():
     token = request.args.get("token", "")
@@ -260,250 +427,839 @@ def upgrade_dev():
 
     current_user.is_pro = True
     db.session.commit()
-    app.logger.info("[UPGRADE] dev_pro user_id=%s", current_user.id)
+    invalidate_user(current_user.id)
+    current_app.logger.info("[UPGRADE] dev_pro user_id=%s", current_user.id)
 
-    resp = redirect(url_for("dashboard"))
+    resp = redirect(url_for("main.dashboard"))
     resp.set_cookie("rg_upgraded", "1", max_age=300, samesite="Lax")
     return resp
 
-@app.route("/analyze", methods=["POST"])
-@login_required
-def analyze():
+class ReportError(Exception):
+    """Очікувана помилка генерації звіту; code — toast-кукі для дашборду (rg_err_*)."""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.code = code
+
+def _report_error_code(e: Exception, user_id) -> str:
+    """Мапить виняток пайплайна на toast-код, логує його і рахує в метриках."""
+    msg = str(e).lower()
+    if isinstance(e, (ReportError, ingest.CsvError, batch.BatchError)):
+        code = e.code
+    elif isinstance(e, llm.CircuitOpen):
+        current_app.logger.warning("[OPENAI] circuit_open user_id=%s", user_id)
+        code = "rg_err_unavailable"
+    elif "401" in msg or "invalid api key" in msg:
+        current_app.logger.error("[OPENAI] auth_error user_id=%s err=%s", user_id, e)
+        code = "rg_err_auth"
+    elif "429" in msg or "rate limit" in msg:
+        current_app.logger.error("[OPENAI] rate_limited user_id=%s err=%s", user_id, e)
+        code = "rg_err_rate"
+    elif "timeout" in msg or "timed out" in msg:
+        current_app.logger.error("[OPENAI] timeout user_id=%s err=%s", user_id, e)
+        code = "rg_err_timeout"
+    else:
+        current_app.logger.exception("[ANALYZE] failed user_id=%s", user_id)
+        code = "rg_error"
+    metrics.REPORT_ERRORS.labels(code).inc()
+    return code
+
+@metrics.stage("prompt_build")
+def _report_prompts(user: User, upload: ingest.CsvUpload):
+    """Промпти секцій звіту (main; для PRO ще roi і campaign) з даних аплоада.
+
+    Повертає (prompts, history_plan); history_plan — порівняння з історією продажів (або None),
+    його передають у _store_report, щоб записати аплоад в історію і запам'ятати період.
+    """
+    if upload.truncated:
+        current_app.logger.info("[CSV] truncated user_id=%s max_rows=%s", user.id, ingest.CSV_MAX_ROWS)
+
+    # Для схеми продажів — компактний дайджест замість тисяч сирих рядків
+    history_plan, focus = None, ""
+    sales_data = digest.build(upload.header, upload.rows) if digest.matches_schema(upload.header) else ""
+    if sales_data and sales_history.SALES_HISTORY_ENABLED:
+        # Якщо частина періоду вже аналізувалась — детально лише нове (в БД тут нічого не пишеться)
+        history_plan = sales_history.plan(user.id, upload.header, upload.rows)
+    if history_plan is not None and history_plan.incremental:
+        data_label = "SALES DIGEST (new period in detail, earlier history as context)"
+        sales_data = history_plan.as_prompt_data()
+        focus = (
+            "Analyze the NEW PERIOD in detail and compare it against the EARLIER HISTORY, "
+            "so the report covers the whole period from the first to the last day. "
+        )
+        current_app.logger.info("[HISTORY] incremental user_id=%s new=%s..%s history=%s..%s", user.id,
+                        history_plan.new_start, history_plan.new_end,
+                        history_plan.history_start, history_plan.history_end)
+    elif sales_data:
+        data_label = "SALES DIGEST (pre-aggregated from the uploaded CSV)"
+    elif not digest.RAW_CSV_FALLBACK:
+        raise ReportError("rg_err_schema")
+    elif summarize.needs_map_reduce(upload):
+        # Сирий CSV, більший за один промпт: підсумок усього файлу через map-reduce
+        sales_data = summarize.map_reduce(llm.get_client(), upload, lane="pro" if user.is_pro else "free")
+        data_label = f"SALES SUMMARY (merged from all {len(upload.rows)} rows of the uploaded CSV)"
+    else:
+        data_label, sales_data = "SALES CSV", upload.as_text()
+
+    # === Промпти з вимогою HTML-фрагментів ===
+    main_prompt = (
+        "You are an expert restaurant consultant. "
+        f"Using the {data_label} below, return a CLEAN HTML FRAGMENT (no <html> or <body>) "
+        "with these sections using <h2>, <p>, and <ul><li>: "
+        "1) Executive Summary, 2) Key Insights, 3) Quick Wins, 4) Next Actions. "
+        f"{focus}Do not use emojis. Keep it concise and scannable. English only.\n\n"
+        f"{data_label}:\n"
+        f"{sales_data}"
+    )
+
+    prompts = {"main": main_prompt}
+    if user.is_pro:
+        prompts["roi"] = (
+            "Return a CLEAN HTML FRAGMENT with <h2>ROI Forecast</h2> followed by a short "
+            "<p>assumptions</p> and a <ul><li>list of numeric estimates</li></ul> "
+            f"based on this {data_label}. No outer <html>/<body>. English.\n\n"
+            f"{sales_data}"
+        )
+        prompts["campaign"] = (
+            "Return a CLEAN HTML FRAGMENT with <h2>Recommended Campaign</h2> and a brief "
+            "<p>why it fits</p> plus a <ul><li>Target</li><li>Offer</li><li>Channel</li><li>3 KPIs</li></ul>. "
+            "No outer <html>/<body>. English.\n\n"
+            f"{sales_data}"
+        )
+    return prompts, history_plan
+
+
+def _render_report_file(html: str) -> str:
+    """HTML звіту → ключ у сховищі: PDF через пул рендерів або HTML fallback, якщо пул
+    переповнений чи wkhtmltopdf недоступний."""
+    pdf_path = storage.temp_path("pdf")
+    try:
+        with metrics.stage("pdf_render"):
+            pdf.renderer.render(html, pdf_path)
+        with metrics.stage("file_write"):
+            return storage.put_file(pdf_path, "pdf")
+    except Exception as pdf_err:
+        if isinstance(pdf_err, pdf.PdfUnavailable):
+            current_app.logger.warning("[PDF] unavailable; fallback to HTML. err=%s", pdf_err)
+        else:
+            current_app.logger.exception("[PDFKIT] failed; fallback to HTML. Hint: ensure wkhtmltopdf is installed on host. err=%s", pdf_err)
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+        with metrics.stage("file_write"):
+            return storage.put_html(html)
+
+
+def _store_report(user: User, sections: dict, section_errors: dict, history_plan=None) -> Report:
+    """Секції → HTML/PDF у сховищі звітів → Report у сесії (без коміту)."""
+    # Без основної секції звіту немає — помилку мапить викликач (_report_error_code)
+    if "main" in section_errors:
+        raise section_errors["main"]
+    result_html = sections["main"]
+
+    # Додаткові секції деградують до заглушки, а не валять увесь звіт
+    for name, err in section_errors.items():
+        current_app.logger.warning("[OPENAI] section_failed user_id=%s section=%s err=%s", user.id, name, err)
+
+    roi_html, campaign_html = "", ""
+    if user.is_pro:
+        roi_html = sections.get("roi") or llm.unavailable_section("ROI Forecast")
+        campaign_html = sections.get("campaign") or llm.unavailable_section("Recommended Campaign")
+
+    # Рендеримо HTML звіту
+    with metrics.stage("template_render"):
+        html = render_template(
+            "report.html",
+            content=result_html,
+            is_pro=user.is_pro,
+            roi_forecast=roi_html,
+            top_campaign=campaign_html
+        )
+
+    stored_name = _render_report_file(html)
+
+    # Історію продажів пишемо лише тепер, перед комітом викликача: write-lock SQLite не
+    # тримається весь час OpenAI і PDF. Наступний аплоад отримає цей звіт як контекст.
+    if history_plan is not None:
+        sales_history.apply(user.id, history_plan)
+        sales_history.save_snapshot(user.id, history_plan.period, result_html)
+        # Межі змінених днів для rollups.refresh після коміту (див. _report_committed)
+        db.session.info["rg_sales_changed"] = (user.id, history_plan.new_start, history_plan.new_end)
+
+    # Зберігаємо запис про звіт
+    new_report = Report(
+        user_id=user.id,
+        filename=stored_name,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(new_report)
+
+    # Інкремент ліміту для FREE
+    if not user.is_pro:
+        user.free_reports_used = (user.free_reports_used or 0) + 1
+
+    # Коміт робить викликач: разом зі статусом задачі черги або одразу в sync-режимі
+    db.session.flush()
+    current_app.logger.info("[REPORT] generated user_id=%s file=%s", user.id, stored_name)
+    return new_report
+
+
+_SECTION_TITLES = {"roi": "ROI Forecast", "campaign": "Recommended Campaign"}
+
+def _stream_sections(prompts: dict, lane: str, publish):
+    """llm.stream_sections з подіями delta/section для /analyze/stream → (sections, errors).
+
+    publish — progress.ProgressWriter задачі або функція (event, data) з методом delta.
+    """
+    sections, section_errors = {}, {}
+    for kind, name, payload in llm.stream_sections(llm.get_client(), prompts, lane=lane):
+        if kind == "delta":
+            publish.delta(name, payload)
+        elif kind == "done":
+            sections[name] = payload
+            publish("section", {"section": name, "html": payload})
+        else:
+            section_errors[name] = payload
+            # Без основної секції звіту не буде — решту викликів stream_sections обірве сам
+            if name == "main":
+                break
+            publish("section", {"section": name, "html": llm.unavailable_section(_SECTION_TITLES[name])})
+    return sections, section_errors
+
+
+def generate_report(user: User, upload: ingest.CsvUpload, progress=None) -> Report:
+    """Пайплайн звіту: CSV → промпти → OpenAI → HTML/PDF → Report у сесії (без коміту).
+
+    progress — ProgressWriter задачі: тоді секції йдуть потоково і видні в /analyze/stream.
+    """
+    prompts, history_plan = _report_prompts(user, upload)
+    lane = "pro" if user.is_pro else "free"
+    if progress is None:
+        # PRO-секції йдуть паралельно; час ≈ найповільніший виклик, а не сума
+        sections, section_errors = llm.run_sections(llm.get_client(), prompts, lane=lane)
+    else:
+        sections, section_errors = _stream_sections(prompts, lane, progress)
+        if "main" not in section_errors:
+            progress("status", {"stage": "pdf"})
+    return _store_report(user, sections, section_errors, history_plan)
+
+
+def generate_batch(user: User, locations: list) -> Report:
+    """Пакет закладів (batch.py) → звіт по кожному, порівняльний звіт і zip з усіма ними.
+
+    Усі файли — рядки Report у сесії (без коміту); повертає Report архіву. FREE-ліміт
+    рахує кожен проаналізований заклад як окремий звіт; пропущені файли в ліміт не йдуть.
+    """
+    with metrics.stage("csv_parse"):
+        summaries = batch.summarize_locations(locations)
+    valid = [s for s in summaries if s.error is None]
+    for s in summaries:
+        if s.error is not None:
+            current_app.logger.warning("[BATCH] location_skipped user_id=%s location=%s err=%s",
+                                       user.id, s.name, s.error)
+    if not valid:
+        raise ReportError(summaries[0].error)
+    # Остаточна перевірка ліміту — тут, до викликів OpenAI: лише тепер відомо, скільки закладів валідні
+    if not user.is_pro and (user.free_reports_used or 0) + len(valid) > 3:
+        raise ReportError("rg_err_limit")
+
+    comparison, sections, section_errors = batch.run_prompts(
+        llm.get_client(), valid, lane="pro" if user.is_pro else "free"
+    )
+    # Без порівняння пакет втрачає сенс — помилку мапить викликач (_report_error_code)
+    if isinstance(comparison, Exception):
+        raise comparison
+    for name, err in section_errors.items():
+        current_app.logger.warning("[OPENAI] location_failed user_id=%s location=%s err=%s", user.id, name, err)
+
+    with metrics.stage("template_render"):
+        documents = [("00 Comparison", render_template(
+            "report.html", content=batch.comparison_table(summaries) + comparison,
+            is_pro=user.is_pro, location=f"{len(valid)} locations compared",
+        ))]
+        documents += [(f"{i:02d} {s.name}", render_template(
+            "report.html", content=sections.get(s.name) or llm.unavailable_section(f"{s.name}: Analysis"),
+            is_pro=user.is_pro, location=s.name,
+        )) for i, s in enumerate(valid, start=1)]
+
+    # PDF рендеряться паралельно, але не більше, ніж воркерів у пулі wkhtmltopdf
+    app = current_app._get_current_object()
+
+    def render(html):
+        with app.app_context():
+            return _render_report_file(html)
+
+    with ThreadPoolExecutor(max_workers=pdf.PDF_WORKERS, thread_name_prefix="batch-pdf") as executor:
+        stored = list(executor.map(render, [html for _, html in documents]))
+
+    entries = []
+    for (title, _), key in zip(documents, stored):
+        ext = "pdf" if key.endswith(".pdf") else "html"
+        entries.append((f"{title}.{ext}", storage.locate(key).read_decoded()))
+    archive_path = storage.temp_path("zip")
+    with metrics.stage("file_write"):
+        batch.write_archive(archive_path, entries)
+        archive_name = storage.put_file(archive_path, "zip")
+
+    # Архів найстаріший, порівняльний — найновіший: на дашборді «останнім звітом» стане порівняння.
+    # Порядок задають різні created_at (крок 1 мкс), а не id вставки
+    now = datetime.utcnow()
+    labels = [f"Batch ({len(valid)} locations)"] + [s.name for s in reversed(valid)] + ["Comparison"]
+    keys = [archive_name] + list(reversed(stored))
+    rows = [Report(user_id=user.id, filename=key, label=label, created_at=now + timedelta(microseconds=i))
+            for i, (key, label) in enumerate(zip(keys, labels))]
+    db.session.add_all(rows)
+    archive = rows[0]
+
+    if not user.is_pro:
+        user.free_reports_used = (user.free_reports_used or 0) + len(valid)
+
+    db.session.flush()
+    current_app.logger.info("[BATCH] generated user_id=%s locations=%s skipped=%s archive=%s",
+                            user.id, len(valid), len(summaries) - len(valid), archive_name)
+    return archive
+
+
+def process_report_job(job: ReportJob):
+    """Виконує задачу черги у воркері (див. jobs.run_worker / worker.py).
+
+    Хід задачі публікується в progress.channel: його читає /analyze/stream.
+    """
+    publish = progress.channel.writer(job.id)
+    publish("status", {"stage": "running"})
+    user = db.session.get(User, job.user_id)
+
+    error = None
+    # Ліміт FREE міг вичерпатись, поки задача чекала в черзі
+    check_and_reset_limits(user)
+    if not user.is_pro and (user.free_reports_used or 0) >= 3:
+        error = "rg_err_limit"
+    else:
+        try:
+            if jobs.is_batch(job):
+                # Ліміт на валідні заклади перевіряє generate_batch
+                report = generate_batch(user, batch.read_spool(job.upload_path))
+            else:
+                with metrics.stage("csv_parse"), open(job.upload_path, "rb") as f:
+                    upload = ingest.read_upload(f)
+                report = generate_report(user, upload, progress=publish if STREAM_REPORTS else None)
+        except Exception as e:
+            db.session.rollback()
+            error = _report_error_code(e, user.id)
+
+    if error:
+        jobs.finish(job, error=error)
+        publish("error", {"code": error})
+        return
+
+    # Report, ліміт і статус задачі — одним комітом
+    with metrics.stage("db_commit"):
+        jobs.finish(job, report=report)
+    _report_committed(user.id)
+    # Після коміту: читач одразу може завантажити звіт
+    publish("done", {"report": report.filename})
+
+def _over_free_limit(user: User, new_reports: int = 1) -> bool:
+    """Чи перевищать new_reports ліміт FREE з урахуванням черги (пакет — звіт на кожен заклад).
+
+    Пакет рахується всіма файлами — верхня межа, як у _accept_batch. Остаточно ліміт перевіряє
+    воркер (process_report_job, для пакета — generate_batch); тут — щоб не ставити зайвих задач.
+    """
+    if user.is_pro:
+        return False
+    return (user.free_reports_used or 0) + jobs.pending_reports(user.id) + new_reports > 3
+
+def _wants_json() -> bool:
+    return request.accept_mimetypes.best == "application/json"
+
+def _accept_upload(can_queue: bool = False):
+    """Спільні перевірки /analyze і /analyze/stream → (upload, None) або (None, toast-код).
+
+    can_queue — звіт піде в чергу: при відкритому breaker-і воркери просто зачекають.
+    """
     # Перевірка верифікації → toast і редірект (щоб не губитись на 403)
     if not current_user.is_verified:
-        return _toast_redirect("rg_confirm_needed")
+        return None, "rg_confirm_needed"
 
     # Скидання/перевірка лімітів
     check_and_reset_limits(current_user)
 
     # Ліміт для FREE (3 звіти / 14 днів) — редірект з toast
     if not current_user.is_pro and (current_user.free_reports_used or 0) >= 3:
-        return _toast_redirect("rg_err_limit")
+        return None, "rg_err_limit"
 
-    if 'file' not in request.files:
-        return _toast_redirect("rg_err_no_file")
+    # Розбір multipart (Werkzeug спулить файл) відбувається при першому зверненні до request.files
+    with metrics.stage("upload_read"):
+        files = request.files
+    if 'file' not in files:
+        return None, "rg_err_no_file"
 
-    file = request.files['file']
+    file = files['file']
     if not file or file.filename == '':
-        return _toast_redirect("rg_err_no_file")
+        return None, "rg_err_no_file"
     if not _allowed_csv(file.filename):
-        return _toast_redirect("rg_err_type")
+        return None, "rg_err_type"
+
+    if not llm.OPENAI_API_KEY:
+        current_app.logger.error("[OPENAI] missing_api_key user_id=%s", current_user.id)
+        return None, "rg_err_auth"
 
-    if not raw_key:
-        app.logger.error("[OPENAI] missing_api_key user_id=%s", current_user.id)
-        return _toast_redirect("rg_err_auth")
+    # OpenAI лежить: відмовляємо одразу, а не після повного таймауту
+    if not (can_queue and ASYNC_REPORTS) and llm.breaker.is_open():
+        metrics.REPORT_ERRORS.labels("rg_err_unavailable").inc()
+        return None, "rg_err_unavailable"
 
+    # Потокове читання з лімітом рядків: зламаний файл відхиляємо ще до черги
     try:
-        # Прочитали CSV як bytes і декодували UTF-8 (із BOM), інакше показали тост encoding
-        raw_bytes = file.read()
-        if not raw_bytes:
-            return _toast_redirect("rg_err_empty")
-        try:
-            text = raw_bytes.decode("utf-8-sig")
-        except UnicodeDecodeError:
-            return _toast_redirect("rg_err_encoding")
-
-        stream = io.StringIO(text, newline=None)
-        rows = list(csv.reader(stream))
-        if not rows:
-            return _toast_redirect("rg_err_empty")
-
-        # (опційно) обмежити розмір для безпеки
-        rows = rows[:5000]
-
-        sales_data = "\n".join([", ".join(row) for row in rows])
-
-        # === Промпти з вимогою HTML-фрагментів ===
-        main_prompt = (
-            "You are an expert restaurant consultant. "
-            "Using the SALES CSV below, return a CLEAN HTML FRAGMENT (no <html> or <body>) "
-            "with these sections using <h2>, <p>, and <ul><li>: "
-            "1) Executive Summary, 2) Key Insights, 3) Quick Wins, 4) Next Actions. "
-            "Do not use emojis. Keep it concise and scannable. English only.\n\n"
-            "SALES CSV:\n"
-            f"{sales_data}"
-        )
+        with metrics.stage("csv_parse"):
+            upload = ingest.read_upload(file.stream)
+    except ingest.CsvError as e:
+        current_app.logger.warning("[CSV] rejected user_id=%s err=%s", current_user.id, e)
+        return None, e.code
+
+    # Файли не за схемою date,item,category,qty,price — лише з opt-in RAW_CSV_FALLBACK
+    if not digest.matches_schema(upload.header) and not digest.RAW_CSV_FALLBACK:
+        current_app.logger.warning("[CSV] schema_mismatch user_id=%s header=%s", current_user.id, upload.header)
+        return None, "rg_err_schema"
+    return upload, None
+
+@bp.route("/analyze", methods=["POST"])
+@login_required
+def analyze():
+    upload, error_code = _accept_upload(can_queue=True)
+    if error_code:
+        return _toast_redirect(error_code)
+
+    if ASYNC_REPORTS:
+        pending = jobs.pending_count(current_user.id)
+        if pending >= jobs.JOB_MAX_PENDING_PER_USER:
+            return _toast_redirect("rg_err_busy")
+        # Задачі в черзі теж рахуються в ліміт FREE, інакше його обходять паралельними аплоадами
+        if _over_free_limit(current_user):
+            return _toast_redirect("rg_err_limit")
+
+        job = jobs.enqueue(current_user.id, upload)
+        invalidate_user(current_user.id)  # коміт міг включати ресет лімітів
+        current_app.logger.info("[JOB] queued job_id=%s user_id=%s", job.id, current_user.id)
+        if _wants_json():
+            return jsonify(job_id=job.id, status_url=url_for("main.job_status", job_id=job.id)), 202
+        return redirect(url_for("main.job_page", job_id=job.id))
+
+    # Синхронний режим (ASYNC_REPORTS=0): весь пайплайн у межах HTTP-запиту
+    try:
+        report = generate_report(current_user, upload)
+        with metrics.stage("db_commit"):
+            db.session.commit()
+        _report_committed(current_user.id)
+    except Exception as e:
+        db.session.rollback()
+        return _toast_redirect(_report_error_code(e, current_user.id))
 
-        chat_completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": main_prompt}],
-            temperature=0.2,
-        )
-        result_html = chat_completion.choices[0].message.content.strip()
-
-        roi_html, campaign_html = "", ""
-        if current_user.is_pro:
-            roi_prompt = (
-                "Return a CLEAN HTML FRAGMENT with <h2>ROI Forecast</h2> followed by a short "
-                "<p>assumptions</p> and a <ul><li>list of numeric estimates</li></ul> "
-                "based on this SALES CSV. No outer <html>/<body>. English.\n\n"
-                f"{sales_data}"
-            )
-            campaign_prompt = (
-                "Return a CLEAN HTML FRAGMENT with <h2>Recommended Campaign</h2> and a brief "
-                "<p>why it fits</p> plus a <ul><li>Target</li><li>Offer</li><li>Channel</li><li>3 KPIs</li></ul>. "
-                "No outer <html>/<body>. English.\n\n"
-                f"{sales_data}"
-            )
-
-            roi_html = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": roi_prompt}],
-                temperature=0.2,
-            ).choices[0].message.content.strip()
-
-            campaign_html = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": campaign_prompt}],
-                temperature=0.2,
-            ).choices[0].message.content.strip()
-
-        # Рендеримо HTML звіту
-        html = render_template(
-            "report.html",
-            content=result_html,
-            is_pro=current_user.is_pro,
-            roi_forecast=roi_html,
-            top_campaign=campaign_html
-        )
+    # Віддаємо файл + ставимо кукі для toast на дашборді
+    response = _send_report(report, as_attachment=True)
+    response.set_cookie("rg_generated", "1", max_age=300, samesite="Lax")
+    return response
+
+def _accept_batch(can_queue: bool = False):
+    """Перевірки /analyze/batch → (locations, None) або (None, toast-код); див. _accept_upload."""
+    if not current_user.is_verified:
+        return None, "rg_confirm_needed"
+
+    check_and_reset_limits(current_user)
+    if not current_user.is_pro and (current_user.free_reports_used or 0) >= 3:
+        return None, "rg_err_limit"
+
+    # Кілька CSV в полі `files` (або один файл у `file`), будь-які з них можуть бути zip
+    with metrics.stage("upload_read"):
+        files = request.files.getlist("files") + request.files.getlist("file")
+    try:
+        locations = batch.read_files(files)
+    except batch.BatchError as e:
+        current_app.logger.warning("[BATCH] rejected user_id=%s err=%s", current_user.id, e)
+        return None, e.code
+
+    # Кожен заклад — окремий звіт у FREE-ліміті. Тут рахуються всі файли, а не лише валідні:
+    # валідність відома тільки після розбору CSV, тож перевірка навмисно суворіша за списання
+    # (generate_batch списує і перевіряє лише проаналізовані заклади)
+    if not current_user.is_pro and (current_user.free_reports_used or 0) + len(locations) > 3:
+        return None, "rg_err_limit"
+
+    if not llm.OPENAI_API_KEY:
+        current_app.logger.error("[OPENAI] missing_api_key user_id=%s", current_user.id)
+        return None, "rg_err_auth"
+
+    if not (can_queue and ASYNC_REPORTS) and llm.breaker.is_open():
+        metrics.REPORT_ERRORS.labels("rg_err_unavailable").inc()
+        return None, "rg_err_unavailable"
+    return locations, None
+
+@bp.route("/analyze/batch", methods=["POST"])
+@login_required
+def analyze_batch():
+    """Кілька закладів за раз: звіт по кожному + порівняльний, усе одним zip-архівом."""
+    locations, error_code = _accept_batch(can_queue=True)
+    if error_code:
+        return _toast_redirect(error_code)
+
+    if ASYNC_REPORTS:
+        pending = jobs.pending_count(current_user.id)
+        if pending >= jobs.JOB_MAX_PENDING_PER_USER:
+            return _toast_redirect("rg_err_busy")
+        if _over_free_limit(current_user, len(locations)):
+            return _toast_redirect("rg_err_limit")
+
+        job = jobs.enqueue_batch(current_user.id, locations)
+        invalidate_user(current_user.id)
+        current_app.logger.info("[JOB] queued batch job_id=%s user_id=%s locations=%s",
+                                job.id, current_user.id, len(locations))
+        if _wants_json():
+            return jsonify(job_id=job.id, status_url=url_for("main.job_status", job_id=job.id)), 202
+        return redirect(url_for("main.job_page", job_id=job.id))
+
+    try:
+        report = generate_batch(current_user, locations)
+        with metrics.stage("db_commit"):
+            db.session.commit()
+        _report_committed(current_user.id)
+    except Exception as e:
+        db.session.rollback()
+        return _toast_redirect(_report_error_code(e, current_user.id))
+
+    response = _send_report(report, as_attachment=True)
+    response.set_cookie("rg_generated", "1", max_age=300, samesite="Lax")
+    return response
+
+# === Потоковий звіт (SSE): секції йдуть у браузер по мірі генерації ===
+STREAM_REPORTS = os.getenv("STREAM_REPORTS", "1") == "1"
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@bp.route("/analyze/stream", methods=["POST"])
+@login_required
+def analyze_stream():
+    """Той самий звіт, що й /analyze, але як text/event-stream.
 
-        # Генеруємо PDF (або HTML fallback) з опціями
-        reports_dir = "reports"
-        os.makedirs(reports_dir, exist_ok=True)
-        filename_base = f"report_{datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')}"
-        pdf_path = os.path.join(reports_dir, f"{filename_base}.pdf")
-
-        options = {
-            "encoding": "UTF-8",
-            "page-size": "A4",
-            "margin-top": "10mm",
-            "margin-right": "10mm",
-            "margin-bottom": "12mm",
-            "margin-left": "10mm",
-            "quiet": None,
-            # опційно: нумерація сторінок (wkhtmltopdf)
-            "footer-right": "[page]/[toPage]",
-            "footer-font-size": "9",
-            "footer-spacing": "4",
-        }
+    Події: delta {section, text} — шматок HTML секції; section {section, html} — секція готова;
+    status {stage} — queued (з position) / running / pdf, або detached (з job_url) — стрім
+    закінчився раніше за задачу; done {download_url, preview_url}; error {code} — toast-код.
 
+    З ASYNC_REPORTS звіт іде через чергу, як /analyze: OpenAI і PDF — у воркері, а відповідь
+    лише читає його progress.channel. Без черги весь пайплайн — у межах запиту.
+    """
+    if not STREAM_REPORTS:
+        abort(404)
+    if ASYNC_REPORTS:
+        return _stream_queued_report()
+    upload, error_code = _accept_upload()
+    if not error_code:
         try:
-            pdfkit.from_string(html, pdf_path, options=options)
-            file_to_send = os.path.abspath(pdf_path)
-            stored_name = f"{filename_base}.pdf"
-        except Exception as pdf_err:
-            app.logger.exception("[PDFKIT] failed; fallback to HTML. Hint: ensure wkhtmltopdf is installed on host. err=%s", pdf_err)
-            html_fallback = os.path.join(reports_dir, f"{filename_base}.html")
-            with open(html_fallback, "w", encoding="utf-8") as f:
-                f.write(html)
-            file_to_send = os.path.abspath(html_fallback)
-            stored_name = f"{filename_base}.html"
-
-        # Зберігаємо запис про звіт
-        new_report = Report(
-            user_id=current_user.id,
-            filename=stored_name,
-            created_at=datetime.utcnow()
-        )
-        db.session.add(new_report)
+            prompts, history_plan = _report_prompts(current_user, upload)
+        except Exception as e:
+            db.session.rollback()
+            error_code = _report_error_code(e, current_user.id)
+    if error_code:
+        return jsonify(error=error_code), 400
+
+    user = current_user._get_current_object()
+
+    @stream_with_context
+    def events():
+        sections, section_errors = {}, {}
+        for kind, name, payload in llm.stream_sections(llm.get_client(), prompts, lane="pro" if user.is_pro else "free"):
+            if kind == "delta":
+                yield _sse("delta", {"section": name, "text": payload})
+            elif kind == "done":
+                sections[name] = payload
+                yield _sse("section", {"section": name, "html": payload})
+            else:
+                section_errors[name] = payload
+                if name == "main":
+                    db.session.rollback()
+                    yield _sse("error", {"code": _report_error_code(payload, user.id)})
+                    return
+                yield _sse("section", {"section": name, "html": llm.unavailable_section(_SECTION_TITLES[name])})
+
+        yield _sse("status", {"stage": "pdf"})
+        try:
+            report = _store_report(user, sections, section_errors, history_plan)
+            with metrics.stage("db_commit"):
+                db.session.commit()
+            _report_committed(user.id)
+        except Exception as e:
+            db.session.rollback()
+            yield _sse("error", {"code": _report_error_code(e, user.id)})
+            return
+        yield _sse("done", {
+            "download_url": url_for("main.download_report", filename=report.filename),
+            "preview_url": url_for("main.preview_report", filename=report.filename),
+        })
+
+    # X-Accel-Buffering: nginx інакше буферизує відповідь і вбиває весь сенс стрімінгу
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Скільки /analyze/stream чекає на задачу черги; далі клієнт іде на сторінку задачі
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "600"))
+# Задача вже завершена в БД, а події done/error у каналі немає (напр. прибрана за TTL)
+_STREAM_FINISH_GRACE_SECONDS = 5.0
+
+def _job_snapshot(job_id: int):
+    """(status, error, filename звіту, позиція в черзі) одним коротким читанням, без тримання сесії."""
+    row = db.session.execute(
+        select(ReportJob.status, ReportJob.error, Report.filename)
+        .outerjoin(Report, Report.id == ReportJob.report_id)
+        .where(ReportJob.id == job_id)
+    ).first()
+    position = None
+    if row is not None and row.status == "queued":
+        position = ReportJob.query.filter(ReportJob.status == "queued", ReportJob.id < job_id).count() + 1
+    db.session.close()
+    return row, position
+
+def _stream_queued_report():
+    """/analyze/stream з чергою: ставить задачу і транслює її події з progress.channel."""
+    upload, error_code = _accept_upload(can_queue=True)
+    if not error_code:
+        pending = jobs.pending_count(current_user.id)
+        if pending >= jobs.JOB_MAX_PENDING_PER_USER:
+            error_code = "rg_err_busy"
+        elif _over_free_limit(current_user):
+            error_code = "rg_err_limit"
+    if error_code:
+        return jsonify(error=error_code), 400
+
+    job = jobs.enqueue(current_user.id, upload)
+    invalidate_user(current_user.id)
+    job_id = job.id
+    current_app.logger.info("[JOB] queued job_id=%s user_id=%s stream=1", job_id, current_user.id)
+    job_url = url_for("main.job_page", job_id=job_id)
+    # Стрім лише читає канал і зрідка статус задачі — з'єднання з БД між читаннями не тримаємо
+    db.session.close()
+
+    def done_event(filename):
+        return _sse("done", {
+            "download_url": url_for("main.download_report", filename=filename),
+            "preview_url": url_for("main.preview_report", filename=filename),
+        })
+
+    @stream_with_context
+    def events():
+        after, position, checked_at, finished_at = 0, None, 0.0, None
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while True:
+            for seq, event, data in progress.channel.read(job_id, after):
+                after = seq
+                if event == "done":
+                    yield done_event(data["report"])
+                    return
+                yield _sse(event, data)
+                if event == "error":
+                    return
+
+            now = time.monotonic()
+            if now - checked_at >= 2:
+                checked_at = now
+                row, queued_at = _job_snapshot(job_id)
+                if row is None:
+                    yield _sse("error", {"code": "rg_error"})
+                    return
+                if queued_at is not None and queued_at != position:
+                    position = queued_at
+                    yield _sse("status", {"stage": "queued", "position": position})
+                if row.status in ("done", "failed"):
+                    finished_at = finished_at or now
+                    if now - finished_at >= _STREAM_FINISH_GRACE_SECONDS:
+                        if row.status == "done" and row.filename:
+                            yield done_event(row.filename)
+                        else:
+                            yield _sse("error", {"code": row.error or "rg_error"})
+                        return
+            if now >= deadline:
+                yield _sse("status", {"stage": "detached", "job_url": job_url})
+                return
+            time.sleep(0.2)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# === Черга звітів: статус і результат ===
+def _get_user_job(job_id: int) -> ReportJob:
+    job = ReportJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        abort(404)
+    return job
 
-        # Інкремент ліміту для FREE
-        if not current_user.is_pro:
-            current_user.free_reports_used = (current_user.free_reports_used or 0) + 1
+@bp.route("/jobs/<int:job_id>")
+@login_required
+def job_page(job_id):
+    """Сторінка очікування: опитує job_status і забирає звіт, щойно він готовий."""
+    job = _get_user_job(job_id)
+    return render_template("job_status.html", job=job)
 
-        db.session.commit()
-        app.logger.info("[REPORT] generated user_id=%s file=%s", current_user.id, stored_name)
+@bp.route("/jobs/<int:job_id>/status")
+@login_required
+def job_status(job_id):
+    job = _get_user_job(job_id)
+    payload = {
+        "id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.status == "queued":
+        payload["position"] = ReportJob.query.filter(
+            ReportJob.status == "queued", ReportJob.id < job.id
+        ).count() + 1
+    if job.status == "done" and job.report:
+        payload["report"] = job.report.filename
+        payload["download_url"] = url_for("main.job_report", job_id=job.id)
+    return jsonify(payload)
+
+@bp.route("/jobs/<int:job_id>/report")
+@login_required
+def job_report(job_id):
+    job = _get_user_job(job_id)
+    if job.status != "done" or not job.report:
+        abort(404)
+    resp = redirect(url_for("main.download_report", filename=job.report.filename))
+    resp.set_cookie("rg_generated", "1", max_age=300, samesite="Lax")
+    return resp
 
-        # Віддаємо файл + ставимо кукі для toast на дашборді
-        response = send_file(file_to_send, as_attachment=True)
-        response.set_cookie("rg_generated", "1", max_age=300, samesite="Lax")
-        return response
+def _encode_cursor(report: Report) -> str:
+    return f"{report.created_at.isoformat()},{report.id}"
 
-    except Exception as e:
-        msg = str(e).lower()
-        if "401" in msg or "invalid api key" in msg:
-            app.logger.error("[OPENAI] auth_error user_id=%s err=%s", current_user.id, e)
-            return _toast_redirect("rg_err_auth")
-        if "429" in msg or "rate limit" in msg:
-            app.logger.error("[OPENAI] rate_limited user_id=%s err=%s", current_user.id, e)
-            return _toast_redirect("rg_err_rate")
-        if "timeout" in msg:
-            app.logger.error("[OPENAI] timeout user_id=%s err=%s", current_user.id, e)
-            return _toast_redirect("rg_err_timeout")
-
-        app.logger.exception("[ANALYZE] failed user_id=%s", current_user.id)
-        return _toast_redirect("rg_error")
-
-@app.route('/report-history')
+def _decode_cursor(cursor: str):
+    try:
+        created, report_id = cursor.rsplit(",", 1)
+        return datetime.fromisoformat(created), int(report_id)
+    except (ValueError, AttributeError):
+        abort(400)
+
+@bp.route('/report-history')
 @login_required
 def report_history():
-    # Пагінація: 20/стор.
-    page = max(1, int(request.args.get("page", 1)))
+    # Keyset-пагінація по (created_at, id): вартість сторінки не росте з її номером
     per_page = 20
-    q = Report.query.filter_by(user_id=current_user.id)
-    total = q.count()
-    reports = q.order_by(Report.created_at.desc())\
-               .offset((page - 1) * per_page)\
-               .limit(per_page).all()
+    page = max(1, request.args.get("page", 1, type=int))  # лише для відображення
+    before, after = request.args.get("before"), request.args.get("after")
 
-    has_prev = page > 1
-    has_next = (page * per_page) < total
+    q = Report.query.filter_by(user_id=current_user.id)
+    if after:
+        created, report_id = _decode_cursor(after)
+        q = q.filter(db.or_(
+            Report.created_at > created,
+            db.and_(Report.created_at == created, Report.id > report_id),
+        )).order_by(Report.created_at.asc(), Report.id.asc())
+    else:
+        if before:
+            created, report_id = _decode_cursor(before)
+            q = q.filter(db.or_(
+                Report.created_at < created,
+                db.and_(Report.created_at == created, Report.id < report_id),
+            ))
+        else:
+            page = 1
+        q = q.order_by(Report.created_at.desc(), Report.id.desc())
+
+    # +1 рядок, щоб знати, чи є наступна сторінка, без COUNT
+    reports = q.limit(per_page + 1).all()
+    more = len(reports) > per_page
+    reports = reports[:per_page]
+    if after:
+        reports.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = bool(before), more
+
+    total = _report_count(current_user.id)
     return render_template(
         'report_history.html',
         reports=reports, page=page, per_page=per_page, total=total,
-        has_prev=has_prev, has_next=has_next
+        has_prev=has_prev, has_next=has_next,
+        prev_cursor=_encode_cursor(reports[0]) if reports else None,
+        next_cursor=_encode_cursor(reports[-1]) if reports else None,
     )
 
-@app.route("/download-report/<path:filename>")
+def _send_report(report: Report, as_attachment: bool):
+    """Файл звіту з ETag/Last-Modified (умовні GET → 304) і Range.
+
+    Хеш-адресований вміст не змінюється: ETag — хеш, кеш браузера без перепитування.
+    HTML у gzip іде як є з Content-Encoding, якщо клієнт його приймає, інакше розпаковується.
+    """
+    stored = storage.locate(report.filename)
+    if stored is None:
+        abort(404)
+    ext = report.display_name.rsplit(".", 1)[-1]
+    mimetype = {"pdf": "application/pdf", "zip": "application/zip"}.get(ext, "text/html")
+    # Архів пакетного звіту (generate_batch) браузер не покаже — лише завантаження
+    as_attachment = as_attachment or ext == "zip"
+    options = dict(mimetype=mimetype, as_attachment=as_attachment, download_name=report.display_name,
+                   last_modified=report.created_at, conditional=True)
+
+    if stored.gzipped and "gzip" in request.accept_encodings:
+        response = send_file(stored.path, etag=f"{stored.etag}-gz", **options)
+        response.headers["Content-Encoding"] = "gzip"
+    elif stored.gzipped:
+        response = send_file(io.BytesIO(stored.read_decoded()), etag=stored.etag, **options)
+    else:
+        response = send_file(stored.path, etag=stored.etag or True, **options)
+    if stored.gzipped:
+        response.vary.add("Accept-Encoding")
+
+    # Звіт приватний: проміжні кеші його не зберігають
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    if stored.immutable:
+        response.cache_control.max_age = REPORT_CACHE_SECONDS
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@bp.route("/download-report/<path:filename>")
 @login_required
 def download_report(filename):
     # Перевіряємо, що файл належить користувачу
     report = Report.query.filter_by(user_id=current_user.id, filename=filename).first()
     if not report:
         abort(404)
+    return _send_report(report, as_attachment=True)
 
-    # Перевірка шляху
-    reports_dir = os.path.abspath("reports")
-    safe_path = safe_join(reports_dir, filename)
-    if not safe_path or not os.path.isfile(safe_path):
-        abort(404)
-
-    return send_from_directory(reports_dir, filename, as_attachment=True)
-
-@app.route("/preview-report/<path:filename>")
+@bp.route("/preview-report/<path:filename>")
 @login_required
 def preview_report(filename):
     """Віддає звіт inline для вбудованого перегляду (iframe)."""
     report = Report.query.filter_by(user_id=current_user.id, filename=filename).first()
     if not report:
         abort(404)
+    return _send_report(report, as_attachment=False)
 
-    reports_dir = os.path.abspath("reports")
-    safe_path = safe_join(reports_dir, filename)
-    if not safe_path or not os.path.isfile(safe_path):
-        abort(404)
-
-    return send_from_directory(reports_dir, filename, as_attachment=False)
-
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
 def dashboard():
-    check_and_reset_limits(current_user)
+    # Лише читання: ресет лімітів рахуємо на льоту, записує його /analyze
     is_pro = bool(current_user.is_pro)
-    remaining_reports = "Unlimited" if is_pro else max(0, 3 - (current_user.free_reports_used or 0))
+    remaining_reports = "Unlimited" if is_pro else max(0, 3 - free_reports_used(current_user))
 
     # countdown до наступного ресету
     reset_days = reset_hours = next_reset_iso = None
     if not is_pro:
-        anchor = current_user.free_reports_reset or datetime.utcnow()
+        anchor = current_user.free_reports_reset
+        if _limits_reset_due(current_user):
+            anchor = datetime.utcnow()
         next_reset = anchor + timedelta(days=14)
         delta = max(timedelta(0), next_reset - datetime.utcnow())
         reset_days = delta.days
         reset_hours = (delta.seconds // 3600)
         next_reset_iso = next_reset.isoformat()
 
-    last_report = Report.query.filter_by(user_id=current_user.id)\
-        .order_by(Report.created_at.desc()).first()
+    # Останній звіт приходить разом із користувачем (load_user / кеш стану) — без окремого запиту
+    if "rg_last_report" in g:
+        last_report = g.rg_last_report
+    else:
+        last_report = Report.query.filter_by(user_id=current_user.id)\
+            .order_by(Report.created_at.desc(), Report.id.desc()).first()
     dev_token = os.getenv("DEV_UPGRADE_TOKEN", "")
 
     return render_template(
@@ -516,10 +1272,74 @@ def dashboard():
         next_reset_iso=next_reset_iso,
         last_report=last_report,
         max_upload_mb=MAX_UPLOAD_MB,
+        csv_max_rows=ingest.CSV_MAX_ROWS,
+        batch_max_locations=batch.BATCH_MAX_LOCATIONS,
+        stream_reports=STREAM_REPORTS,
+        show_trends=sales_history.SALES_HISTORY_ENABLED,
         dev_token=dev_token
     )
 
-@app.route("/healthz")
+@bp.route("/api/trends")
+@login_required
+def api_trends():
+    """Тренди виторгу й кількості з готових зведень (rollups.py) — без генерації звіту.
+
+    ?granularity=day|week, опційно ?from=YYYY-MM-DD&to=YYYY-MM-DD; без меж — останні 90 днів / 26 тижнів.
+    """
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ("day", "week"):
+        abort(400)
+    try:
+        start = ingest.parse_date(request.args["from"]) if request.args.get("from") else None
+        end = ingest.parse_date(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        abort(400)
+
+    data = rollups.trends(current_user.id, granularity, start, end)
+    if data is None and sales_history.SALES_HISTORY_ENABLED:
+        # Історія є, а файлу зведень ще немає (перший запит після оновлення або очищений кеш)
+        with metrics.stage("rollup_update"):
+            rollups.refresh(current_user.id)
+        data = rollups.trends(current_user.id, granularity, start, end)
+    if data is None:
+        return jsonify(granularity=granularity, points=[], categories=[])
+    response = jsonify(data)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+# === Метрики (Prometheus) ===
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@bp.before_app_request
+def _metrics_start():
+    g.rg_started = time.perf_counter()
+    g.rg_endpoint = request.endpoint or "none"
+    metrics.IN_PROGRESS.labels(g.rg_endpoint).inc()
+
+@bp.after_app_request
+def _metrics_observe(response):
+    if "rg_started" in g:
+        metrics.REQUEST_SECONDS.labels(g.rg_endpoint, request.method, response.status_code).observe(
+            time.perf_counter() - g.rg_started
+        )
+    return response
+
+@bp.teardown_app_request
+def _metrics_finish(_exc):
+    if "rg_endpoint" in g:
+        metrics.IN_PROGRESS.labels(g.rg_endpoint).dec()
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    # Опційний токен: METRICS_TOKEN=... → Authorization: Bearer ... або ?token=...
+    if METRICS_TOKEN:
+        supplied = request.args.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if supplied != METRICS_TOKEN:
+            abort(403)
+    body, content_type = metrics.exposition()
+    return Response(body, mimetype=content_type.split(";")[0], content_type=content_type)
+
+@bp.route("/healthz")
 def healthz():
     try:
         db.session.execute(text("SELECT 1"))
@@ -527,20 +1347,108 @@ def healthz():
     except Exception as e:
         return f"db error: {e}", 500
 
-@app.route("/healthz/openai")
+@bp.route("/healthz/cache")
+def healthz_cache():
+    """Лічильники кешу відповідей OpenAI (спільні для всіх воркерів)."""
+    try:
+        return jsonify(enabled=llm.LLM_CACHE_ENABLED, **llm.response_cache.stats()), 200
+    except Exception as e:
+        return f"cache error: {e}", 500
+
+@bp.route("/healthz/limiter")
+def healthz_limiter():
+    """Заповненість відер RPM/TPM і глибина черги по смугах — для планування ємності."""
+    try:
+        return jsonify(enabled=llm.OPENAI_LIMITER_ENABLED, **llm.limiter.stats()), 200
+    except Exception as e:
+        return f"limiter error: {e}", 500
+
+@bp.route("/healthz/openai")
 def healthz_openai():
+    """Стан OpenAI з кешу (breaker.py): без платного completion на кожну пробу балансувальника.
+
+    Кеш старший за OPENAI_PROBE_TTL оновлює один процес (lease) дешевим GET /models.
+    503 — ланцюг відкритий (виклики відхиляються) або остання проба невдала.
+    """
     try:
-        client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": "ping"}],
-            max_tokens=1,
-            temperature=0
-        )
-        return "ok", 200
+        llm.breaker.probe(llm.get_client(), llm.OPENAI_MODEL)
+        health = llm.breaker.health()
     except Exception as e:
-        app.logger.exception("OpenAI health failed")
-        return f"openai error: {e}", 500
+        current_app.logger.exception("[BREAKER] health read failed")
+        return f"breaker error: {e}", 500
+    healthy = health["accepting"] and health["probe"]["ok"] is not False
+    return jsonify(ok=healthy, **health), 200 if healthy else 503
+
+# === Фабрика застосунку ===
+def create_app(config: dict = None) -> Flask:
+    """Збирає застосунок: конфіг, розширення, маршрути. Дешево: без БД і мережі.
+
+    config — перевизначення поверх змінних середовища (напр. для тестів).
+    """
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER=os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+        MAIL_PORT=int(os.getenv("MAIL_PORT", "587")),
+        MAIL_USE_TLS=os.getenv("MAIL_USE_TLS", "1") == "1",
+        MAIL_USERNAME=os.environ.get("EMAIL_USER"),
+        MAIL_PASSWORD=(os.environ.get("EMAIL_PASS") or os.environ.get("EMAIL_PASSWORD")),
+        MAIL_DEFAULT_SENDER=(os.environ.get("MAIL_DEFAULT_SENDER") or os.environ.get("EMAIL_USER")),
+        SECRET_KEY=os.environ.get("SECRET_KEY", "mysecret"),
+        SQLALCHEMY_DATABASE_URI=dbconfig.database_uri(),
+        MAX_CONTENT_LENGTH=MAX_UPLOAD_MB * 1024 * 1024,
+    )
+    if config:
+        app.config.update(config)
+    # Опції пулу — під остаточний URI (з урахуванням перевизначень), якщо викликач не дав власних
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", dbconfig.engine_options(app.config["SQLALCHEMY_DATABASE_URI"]))
+
+    if MAIL_ENABLED:
+        app.logger.warning("[MAIL DIAG] USER:True PASS:True SENDER:True")
+    else:
+        app.logger.warning("[MAIL DIAG] Mail is NOT fully configured. Email sending DISABLED.")
+    key = llm.OPENAI_API_KEY
+    masked = (key[:7] + "..." + key[-4:]) if key and len(key) > 11 else ("MISSING" if not key else key[:7] + "...")
+    app.logger.info(f"[OpenAI] API key loaded? {'YES' if key else 'NO'} ({masked})")
+
+    if JINJA_CACHE_DIR:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+    assets.init_app(app)
+
+    # Flask-SQLAlchemy лише описує engine; з'єднання відкриваються при першому запиті в процесі
+    db.init_app(app)
+    mail.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # `gunicorn app:app` і `from app import app` (worker.py) отримують застосунок за замовчуванням,
+    # а простий імпорт модуля (тести, утиліти) його не створює
+    global _default_app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _default_app_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app
 
 if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        ensure_schema()
+    # Локально чергу обробляє вбудований воркер; у проді — окремий процес `python worker.py`
+    if ASYNC_REPORTS and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        jobs.start_thread_worker(app, process_report_job, paused=llm.breaker.is_open)
+    # Outbox листів — так само: тут потік, у проді — процес у worker.py
+    if MAIL_ENABLED and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        outbox.start_thread_sender(app, mail)
+    # Прибирання старих звітів і файлів-сиріт
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        storage.start_thread_sweeper(app, on_removed=invalidate_user)
+        breaker.start_thread_prober(app, llm.breaker, llm.get_client(), llm.OPENAI_MODEL)
     # debug=True не бажано в проді, але лишаємо для локального запуску
     app.run(debug=True)
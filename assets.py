@@ -0,0 +1,171 @@
+"""Статика з відбитками вмісту, попередньо стиснутими варіантами і довгим кешуванням.
+
+`python assets.py build` (або хук on_starting у gunicorn.conf.py) копіює static/** у STATIC_DIST_DIR
+як `name.<hash>.ext`, поруч кладе `.gz` і, якщо встановлено пакет brotli, `.br`, а наприкінці —
+manifest.json {шлях у static/: шлях у dist/}. Шаблони беруть URL через asset_url('css/app.css'):
+зібраний файл віддається з /static/dist/ з Cache-Control immutable на рік — новий вміст означає
+нове ім'я. Без збірки asset_url повертає звичайний /static/... з перевіркою за ETag, як раніше.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+
+from flask import abort, current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # необов'язкова залежність: без неї лише gzip
+    brotli = None
+
+# Шляхи — від кореня застосунку (тут же app.py і його static/), а не від cwd процесу:
+# gunicorn і worker.py можуть стартувати з іншої директорії
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(_ROOT, "static")
+STATIC_DIST_DIR = os.path.join(_ROOT, os.getenv("STATIC_DIST_DIR", os.path.join("static", "dist")))
+STATIC_CACHE_SECONDS = int(os.getenv("STATIC_CACHE_SECONDS", str(365 * 24 * 3600)))
+# Що стискати заздалегідь; зображення і шрифти вже стиснуті
+_COMPRESSIBLE = (".css", ".js", ".svg", ".html", ".json", ".txt", ".map")
+# Менші файли стискати немає сенсу: заголовки відповіді більші за виграш
+_MIN_COMPRESS_BYTES = 256
+
+_MANIFEST = "manifest.json"
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_manifest = None
+_manifest_mtime = None
+_manifest_lock = threading.Lock()
+
+
+def _fingerprint(rel: str, data: bytes) -> str:
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(src: str = STATIC_DIR, dest: str = STATIC_DIST_DIR) -> dict:
+    """Збирає dist/ і manifest.json → маніфест. Ідемпотентно: наявні відбитки не перезаписуються.
+
+    Старі відбитки лишаються (сторінки, відкриті до деплою, ще посилаються на них);
+    manifest.json пишеться останнім, тож процеси не побачать посилань на незібрані файли.
+    """
+    dest_abs = os.path.abspath(dest)
+    manifest = {}
+    for dirpath, dirs, names in os.walk(src):
+        # dist/ всередині static/ — результат, а не джерело
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(dirpath, d)) != dest_abs)
+        for name in sorted(names):
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, src).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            hashed = _fingerprint(rel, data)
+            manifest[rel] = hashed
+            out = os.path.join(dest, *hashed.split("/"))
+            if os.path.isfile(out):
+                continue
+            # Спершу стиснуті варіанти: наявний оригінал означає, що файл зібрано повністю
+            if rel.endswith(_COMPRESSIBLE) and len(data) >= _MIN_COMPRESS_BYTES:
+                gz = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(gz) < len(data):
+                    _write_atomic(out + ".gz", gz)
+                if brotli is not None:
+                    br = brotli.compress(data, quality=11)
+                    if len(br) < len(data):
+                        _write_atomic(out + ".br", br)
+            _write_atomic(out, data)
+    _write_atomic(os.path.join(dest, _MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    return manifest
+
+
+def _load_manifest(reload: bool = False) -> dict:
+    """Маніфест поточної збірки ({} без збірки). Читається раз на процес; reload — перечитати при зміні."""
+    global _manifest, _manifest_mtime
+    if _manifest is not None and not reload:
+        return _manifest
+    path = os.path.join(STATIC_DIST_DIR, _MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    with _manifest_lock:
+        if _manifest is None or mtime != _manifest_mtime:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _manifest = json.load(f)
+            except (OSError, ValueError):
+                _manifest = {}
+            _manifest_mtime = mtime
+    return _manifest
+
+
+def asset_url(filename: str) -> str:
+    """URL статичного файлу: відбиток зі збірки, якщо є, інакше звичайний /static/."""
+    # У debug статику правлять на ходу: маніфест перечитується після `python assets.py build`
+    hashed = _load_manifest(reload=current_app.debug).get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return url_for("dist_static", filename=hashed)
+
+
+def _serve_dist(filename):
+    """Файл зі збірки: найкращий заздалегідь стиснутий варіант, який приймає клієнт, без стиснення на льоту."""
+    # Маніфест і .gz/.br напряму не віддаються: варіант обирається за Accept-Encoding
+    if filename.endswith((".gz", ".br", ".tmp")) or filename == _MANIFEST:
+        abort(404)
+    path = safe_join(os.path.abspath(STATIC_DIST_DIR), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    variants = [(name, path + ext) for name, ext in _ENCODINGS if os.path.isfile(path + ext)]
+    encoding = None
+    for name, variant in variants:
+        if request.accept_encodings[name]:
+            encoding, path = name, variant
+            break
+    # Відбиток у імені вже гарантує незмінність; ETag лише для умовних GET після очищення кешу
+    etag = filename.rsplit("/", 1)[-1] + (f"-{encoding}" if encoding else "")
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=STATIC_CACHE_SECONDS)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if variants:
+        response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_app(app):
+    """Маршрут /static/dist/ і глобал asset_url для шаблонів."""
+    app.add_url_rule(f"{app.static_url_path.rstrip('/')}/dist/<path:filename>", endpoint="dist_static",
+                     view_func=_serve_dist)
+    app.jinja_env.globals["asset_url"] = asset_url
+
+
+def clean(dest: str = STATIC_DIST_DIR):
+    shutil.rmtree(dest, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    if command == "build":
+        result = build()
+        print(f"[ASSETS] built {len(result)} file(s) into {STATIC_DIST_DIR} (brotli: {'yes' if brotli else 'no'})")
+    elif command == "clean":
+        clean()
+        print(f"[ASSETS] removed {STATIC_DIST_DIR}")
+    else:
+        sys.exit("usage: python assets.py [build|clean]")
@@ -0,0 +1,314 @@
+"""Пакетний аналіз кількох закладів мережі: багато CSV (або zip) → звіт по кожному і порівняльний.
+
+Кожен файл — окремий заклад (назва — ім'я файлу без .csv). Розбір і агрегація CSV (ingest +
+digest) — CPU-робота, тож вона йде в пул процесів BATCH_PARSE_WORKERS, а не в потоки воркера,
+де її гальмував би GIL. Далі промпти закладів і порівняльний промпт ідуть через llm.run_sections (спільний пул
+і стеля OPENAI_MAX_CONCURRENCY процесу) хвилями по BATCH_LLM_CONCURRENCY; порівняльному промпту
+потрібні лише дайджести, а не відповіді по закладах, тож він іде в першій хвилі.
+
+Пакет приймає лише файли за схемою date,item,category,qty,price; інші заклади пропускаються
+з приміткою в порівняльному звіті. Історію продажів (sales_history) пакет не оновлює: вона
+ведеться для одного закладу на користувача, а дні різних закладів перезаписали б одне одного.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from markupsafe import escape
+
+import digest
+import ingest
+import llm
+
+log = logging.getLogger("restgenius.batch")
+
+BATCH_MAX_LOCATIONS = int(os.getenv("BATCH_MAX_LOCATIONS", "20"))
+# Стеля розпакованого вмісту zip: захист від архівів-бомб
+BATCH_MAX_UNZIPPED_MB = float(os.getenv("BATCH_MAX_UNZIPPED_MB", "200"))
+BATCH_PARSE_WORKERS = int(os.getenv("BATCH_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    """Пакет не прийнято; code — toast-кукі для дашборду."""
+
+    def __init__(self, code: str, detail: str = ""):
+        super().__init__(f"{code}: {detail}" if detail else code)
+        self.code = code
+
+
+class LocationSummary:
+    """Підсумок одного закладу з пулу процесів (лише прості поля — передається через pickle)."""
+
+    def __init__(self, name: str, error: str = None, rows: int = 0, skipped: int = 0, truncated: bool = False,
+                 revenue: float = 0.0, qty: float = 0.0, first_day=None, last_day=None, days: int = 0,
+                 top_category: str = None, top_item: str = None, digest_text: str = "", brief: str = ""):
+        self.name = name
+        self.error = error
+        self.rows = rows
+        self.skipped = skipped
+        self.truncated = truncated
+        self.revenue = revenue
+        self.qty = qty
+        self.first_day = first_day
+        self.last_day = last_day
+        self.days = days
+        self.top_category = top_category
+        self.top_item = top_item
+        self.digest_text = digest_text
+        self.brief = brief
+
+    @property
+    def avg_daily_revenue(self) -> float:
+        return self.revenue / self.days if self.days else 0.0
+
+
+# === Прийом файлів ===
+def _location_name(filename: str, taken: set) -> str:
+    base = os.path.basename(filename.replace("\\", "/"))
+    name = base[:-4] if base.lower().endswith(".csv") else base
+    name = " ".join(name.replace("_", " ").split()) or "Location"
+    unique, n = name, 2
+    while unique.lower() in taken:
+        unique, n = f"{name} ({n})", n + 1
+    taken.add(unique.lower())
+    return unique
+
+
+def read_zip(stream, locations: list, taken: set, budget: list):
+    """Додає CSV-файли архіву в locations; budget — [залишок байтів розпакованого вмісту]."""
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise BatchError("rg_err_batch", f"bad zip: {e}")
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            # Службові файли macOS і приховані файли — не заклади
+            if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                continue
+            if not name.lower().endswith(".csv"):
+                continue
+            if len(locations) >= BATCH_MAX_LOCATIONS:
+                raise BatchError("rg_err_batch", f"more than {BATCH_MAX_LOCATIONS} locations")
+            # Розмір із заголовка zip може брехати — читаємо не більше залишку бюджету
+            with archive.open(info) as f:
+                data = f.read(budget[0] + 1)
+            if len(data) > budget[0]:
+                raise BatchError("rg_err_batch", f"archive expands beyond {BATCH_MAX_UNZIPPED_MB:.0f} MB")
+            budget[0] -= len(data)
+            locations.append((_location_name(name, taken), data))
+
+
+def read_files(files) -> list:
+    """Файли форми (FileStorage: .csv або .zip) → [(назва закладу, байти CSV)] у порядку аплоаду.
+
+    Кидає BatchError з кодом rg_err_no_file / rg_err_type / rg_err_batch.
+    """
+    locations, taken = [], set()
+    budget = [int(BATCH_MAX_UNZIPPED_MB * 1024 * 1024)]
+    for file in files:
+        if not file or not file.filename:
+            continue
+        lower = file.filename.lower()
+        if lower.endswith(".zip"):
+            read_zip(file.stream, locations, taken, budget)
+        elif lower.endswith(".csv"):
+            if len(locations) >= BATCH_MAX_LOCATIONS:
+                raise BatchError("rg_err_batch", f"more than {BATCH_MAX_LOCATIONS} locations")
+            locations.append((_location_name(file.filename, taken), file.read()))
+        else:
+            raise BatchError("rg_err_type", file.filename)
+    if not locations:
+        raise BatchError("rg_err_no_file")
+    return locations
+
+
+def write_spool(locations: list, path: str):
+    """Зберігає пакет у спул черги одним zip-файлом (назви закладів — імена файлів)."""
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        for name, data in locations:
+            archive.writestr(f"{name}.csv", data)
+
+
+def spool_size(path: str) -> int:
+    """Кількість закладів у спулі черги — з каталогу zip, без розпакування."""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for name in archive.namelist() if name.lower().endswith(".csv")) or 1
+    except (OSError, zipfile.BadZipFile):
+        # Спул уже прибрано (задача завершується) або він зламаний — воркер звітує помилкою
+        return 1
+
+
+def read_spool(path: str) -> list:
+    with open(path, "rb") as f:
+        locations, taken = [], set()
+        read_zip(f, locations, taken, [int(BATCH_MAX_UNZIPPED_MB * 1024 * 1024)])
+    return locations
+
+
+# === Розбір і агрегація в пулі процесів ===
+def summarize_location(name: str, data: bytes) -> LocationSummary:
+    """CSV одного закладу → LocationSummary; помилки файлу повертаються в error, а не кидаються."""
+    try:
+        upload = ingest.read_upload(io.BytesIO(data))
+    except ingest.CsvError as e:
+        return LocationSummary(name, error=e.code)
+    if not digest.matches_schema(upload.header):
+        return LocationSummary(name, error="rg_err_schema")
+    agg = digest.SalesAggregator(upload.header).extend(upload.rows)
+    if not agg.rows:
+        return LocationSummary(name, error="rg_err_empty")
+    days = sorted(agg.by_day)
+    return LocationSummary(
+        name,
+        rows=agg.rows,
+        skipped=upload.skipped + agg.skipped,
+        truncated=upload.truncated,
+        revenue=agg.revenue,
+        qty=agg.qty,
+        first_day=days[0],
+        last_day=days[-1],
+        days=len(days),
+        top_category=max(agg.by_category.items(), key=lambda kv: kv[1][0])[0],
+        top_item=max(agg.by_item.items(), key=lambda kv: kv[1][0])[0],
+        digest_text=agg.render(),
+        brief=agg.render_brief(),
+    )
+
+
+def _get_pool():
+    # spawn: дочірні процеси не успадковують потоків і з'єднань воркера (див. worker.py)
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=BATCH_PARSE_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def summarize_locations(locations: list) -> list:
+    """Підсумки всіх закладів у порядку аплоаду; один заклад розбирається без пулу."""
+    if len(locations) == 1 or BATCH_PARSE_WORKERS <= 1:
+        return [summarize_location(name, data) for name, data in locations]
+    global _pool
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(summarize_location, name, data) for name, data in locations]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        # Дочірній процес упав (OOM-killer тощо): наступний пакет отримає новий пул, цей — розбір тут
+        log.exception("[BATCH] parse pool broken; parsing in-process")
+        with _pool_lock:
+            _pool = None
+        return [summarize_location(name, data) for name, data in locations]
+
+
+# === Промпти і виклики OpenAI ===
+def location_prompt(summary: LocationSummary) -> str:
+    return (
+        "You are an expert restaurant consultant. "
+        f"Using the SALES DIGEST of the location \"{summary.name}\" below, return a CLEAN HTML FRAGMENT "
+        "(no <html> or <body>) with these sections using <h2>, <p>, and <ul><li>: "
+        "1) Executive Summary, 2) Key Insights, 3) Quick Wins, 4) Next Actions. "
+        "Do not use emojis. Keep it concise and scannable. English only.\n\n"
+        f"SALES DIGEST:\n{summary.digest_text}"
+    )
+
+
+def comparison_prompt(summaries: list) -> str:
+    table = "\n".join(
+        f"- {s.name}: period {s.first_day.isoformat()} to {s.last_day.isoformat()} ({s.days} days), "
+        f"revenue {s.revenue:.2f}, avg daily revenue {s.avg_daily_revenue:.2f}, qty {s.qty:.0f}, "
+        f"avg price per unit {s.revenue / s.qty if s.qty else 0:.2f}, top category {s.top_category}, "
+        f"top item {s.top_item}"
+        for s in summaries
+    )
+    briefs = "\n\n".join(f"LOCATION {s.name}:\n{s.brief}" for s in summaries)
+    return (
+        "You are an expert consultant for restaurant groups. "
+        f"Compare the {len(summaries)} locations below and return a CLEAN HTML FRAGMENT "
+        "(no <html> or <body>) with these sections using <h2>, <p>, and <ul><li>: "
+        "1) Group Overview, 2) Location Ranking, 3) Where Locations Differ, "
+        "4) Practices to Share Across Locations, 5) Next Actions per Location. "
+        "Do not use emojis. Keep it concise and scannable. English only.\n\n"
+        f"LOCATION TOTALS:\n{table}\n\n"
+        f"LOCATION DIGESTS:\n{briefs}"
+    )
+
+
+def run_prompts(client, summaries: list, timeout: float = llm.SECTION_TIMEOUT, lane: str = "free"):
+    """Порівняльний промпт і промпти закладів хвилями по BATCH_LLM_CONCURRENCY через llm.run_sections.
+
+    Повертає (comparison, sections, errors): comparison — HTML або виняток, sections — назва →
+    HTML, errors — назва → виняток. Збій одного закладу не зупиняє решту.
+    """
+    # Порівняльний — першим: він головний у пакеті. Ключ None не перетнеться з назвою закладу
+    prompts = {None: comparison_prompt(summaries)}
+    prompts.update((s.name, location_prompt(s)) for s in summaries)
+    names = list(prompts)
+    wave_size = max(1, BATCH_LLM_CONCURRENCY)
+
+    sections, errors = {}, {}
+    for start in range(0, len(names), wave_size):
+        wave = {name: prompts[name] for name in names[start:start + wave_size]}
+        done, failed = llm.run_sections(client, wave, timeout=timeout, lane=lane)
+        sections.update(done)
+        errors.update(failed)
+    comparison = sections.pop(None) if None in sections else errors.pop(None)
+    return comparison, sections, errors
+
+
+# === HTML і архів ===
+def comparison_table(summaries: list) -> str:
+    """HTML-таблиця підсумків закладів (рахується з даних, без моделі) і примітки про пропущені."""
+    valid = sorted((s for s in summaries if s.error is None), key=lambda s: -s.revenue)
+    total = sum(s.revenue for s in valid)
+    rows = "".join(
+        "<tr>"
+        f"<td>{escape(s.name)}</td>"
+        f"<td>{s.first_day.isoformat()} – {s.last_day.isoformat()}</td>"
+        f"<td style=\"text-align:right\">{s.revenue:,.2f}</td>"
+        f"<td style=\"text-align:right\">{100 * s.revenue / total if total else 0:.1f}%</td>"
+        f"<td style=\"text-align:right\">{s.avg_daily_revenue:,.2f}</td>"
+        f"<td style=\"text-align:right\">{s.qty:,.0f}</td>"
+        f"<td>{escape(s.top_category)}</td>"
+        "</tr>"
+        for s in valid
+    )
+    html = (
+        "<h2>Locations at a Glance</h2>"
+        "<table style=\"width:100%; border-collapse:collapse; font-size:13px;\" cellpadding=\"4\">"
+        "<tr style=\"text-align:left; border-bottom:1px solid #e5e7eb;\">"
+        "<th>Location</th><th>Period</th><th style=\"text-align:right\">Revenue</th>"
+        "<th style=\"text-align:right\">Share</th><th style=\"text-align:right\">Avg / day</th>"
+        "<th style=\"text-align:right\">Qty</th><th>Top category</th></tr>"
+        f"{rows}</table>"
+    )
+    skipped = [s for s in summaries if s.error is not None]
+    if skipped:
+        html += "<p class=\"muted\">Not included (file could not be analyzed): " + ", ".join(
+            f"{escape(s.name)} ({escape(s.error.removeprefix('rg_err_'))})" for s in skipped
+        ) + ".</p>"
+    return html
+
+
+def write_archive(path: str, entries: list):
+    """entries — [(ім'я в архіві, байти)]; PDF уже стиснутий, тож кладеться без deflate."""
+    with zipfile.ZipFile(path, "w") as archive:
+        for arcname, data in entries:
+            # Назви закладів — з імен файлів користувача: без символів, заборонених у Windows
+            arcname = "".join("_" if c in '\\/:*?"<>|' or ord(c) < 32 else c for c in arcname)
+            compress = zipfile.ZIP_STORED if arcname.endswith(".pdf") else zipfile.ZIP_DEFLATED
+            archive.writestr(arcname, data, compress_type=compress)
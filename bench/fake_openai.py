@@ -0,0 +1,124 @@
+"""Локальна заглушка OpenAI-сумісного API для бенчмарків (bench/run.py).
+
+Відповідає на POST /v1/chat/completions (звичайний і stream=True) з налаштовуваною затримкою
+і часткою відповідей 429. Запуск окремо:
+    python bench/fake_openai.py --port 8765 --latency 1.5 --jitter 0.5 --rate-429 0.05
+і OPENAI_BASE_URL=http://127.0.0.1:8765/v1 для застосунку.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECTION_HTML = (
+    "<h2>Executive Summary</h2><p>Revenue is concentrated in a few items; weekends outperform weekdays.</p>"
+    "<h2>Key Insights</h2><ul><li>Top item drives 18% of revenue.</li><li>Beverages attach to 40% of orders.</li></ul>"
+    "<h2>Quick Wins</h2><ul><li>Bundle the top item with a drink.</li><li>Promote slow weekday lunches.</li></ul>"
+    "<h2>Next Actions</h2><ul><li>Run a 2-week lunch combo test.</li></ul>"
+)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+
+    def hit(self, throttled: bool):
+        with self.lock:
+            self.requests += 1
+            self.throttled += throttled
+
+
+def make_handler(latency: float, jitter: float, rate_429: float, stats: Stats):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            # /stats — скільки запитів прийшло і скільки отримали 429 (для результатів бенчмарку)
+            self._json(200, {"requests": stats.requests, "throttled": stats.throttled})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            prompt = body.get("messages", [{}])[-1].get("content", "")
+            throttled = random.random() < rate_429
+            stats.hit(throttled)
+            if throttled:
+                return self._json(429, {"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                                  {"Retry-After": "1"})
+
+            time.sleep(max(0.0, random.gauss(latency, jitter)) if jitter else latency)
+            usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(SECTION_HTML) // 4,
+                     "total_tokens": (len(prompt) + len(SECTION_HTML)) // 4}
+            if body.get("stream"):
+                return self._stream(body, usage)
+            self._json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": SECTION_HTML}}],
+                "usage": usage,
+            })
+
+        def _stream(self, body: dict, usage: dict):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": body.get("model", "fake")}
+            for i in range(0, len(SECTION_HTML), 40):
+                chunk = dict(base, choices=[{"index": 0, "finish_reason": None,
+                                             "delta": {"content": SECTION_HTML[i:i + 40]}}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(0.01)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+    return Handler
+
+
+def serve(port: int, latency: float, jitter: float = 0.0, rate_429: float = 0.0):
+    """Запускає сервер у фоновому потоці; повертає (server, stats)."""
+    stats = Stats()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, jitter, rate_429, stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-openai").start()
+    return server, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="середня затримка відповіді, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="стандартне відхилення затримки, сек")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="частка запитів, що отримують 429")
+    args = parser.parse_args()
+    server, _ = serve(args.port, args.latency, args.jitter, args.rate_429)
+    print(f"fake OpenAI on http://127.0.0.1:{args.port}/v1 latency={args.latency}s 429={args.rate_429:.0%}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Навантажувальний бенчмарк RestGenius під gunicorn з локальними заглушками OpenAI і PDF.
+
+Піднімає застосунок у тимчасовій директорії (власні БД, reports/, cache/), fake OpenAI
+(bench/fake_openai.py) і заглушку wkhtmltopdf (bench/wkhtmltopdf), реєструє віртуальних
+користувачів і по черзі навантажує /analyze, /dashboard, /report-history і /download-report
+із заданою паралельністю. Для кожного маршруту пише p50/p95/p99, пропускну здатність і
+пікову RSS процесів застосунку в bench/results/*.json.
+
+    python bench/run.py --workers 4 --concurrency 8 --requests 40 --latency 1.5 --rate-429 0.05
+    python bench/run.py --mode async --report-workers 2
+    python bench/run.py --compare bench/results/<older>.json   # дельти відносно попереднього прогону
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_openai  # noqa: E402
+
+ROUTES = ("/analyze", "/dashboard", "/report-history", "/download-report")
+DEV_TOKEN = "bench"
+
+
+# === Процеси ===
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int) -> list:
+    """Усі нащадки pid за /proc (Linux); на інших ОС — порожньо."""
+    parents = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # поле comm може містити пробіли — ppid шукаємо після останньої ')'
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry))
+    found, stack = [], [pid]
+    while stack:
+        kids = parents.get(stack.pop(), [])
+        found += kids
+        stack += kids
+    return found
+
+
+def rss_mb(root_pids) -> float:
+    """Сумарна RSS дерев процесів (МБ)."""
+    total_kb = 0
+    for root in root_pids:
+        for pid in [root] + _children(root):
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total_kb += int(line.split()[1])
+                            break
+            except OSError:
+                continue
+    return round(total_kb / 1024, 1)
+
+
+class RssSampler:
+    """Фонове опитування RSS; peak() — максимум з останнього reset()."""
+
+    def __init__(self, pids, interval: float = 0.1):
+        self.pids = pids
+        self.interval = interval
+        self._peak = 0.0
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, daemon=True, name="rss-sampler").start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, rss_mb(self.pids))
+
+    def reset(self):
+        self._peak = rss_mb(self.pids)
+
+    def peak(self) -> float:
+        return max(self._peak, rss_mb(self.pids))
+
+    def stop(self):
+        self._stop.set()
+
+
+def start_app(args, workdir: str, openai_port: int) -> tuple:
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench-0000000000000000",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        DEV_UPGRADE_TOKEN=DEV_TOKEN,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        ASYNC_REPORTS="1" if args.mode == "async" else "0",
+        LLM_CACHE_ENABLED="1" if args.llm_cache else "0",
+        AUTO_VERIFY_IF_NO_MAIL="1",
+        EMAIL_USER="", EMAIL_PASS="", EMAIL_PASSWORD="",
+        BENCH_PDF_DELAY=str(args.pdf_delay),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "metrics"),
+        PYTHONPATH=REPO_DIR,
+    )
+    if args.pdf == "stub":
+        env["WKHTMLTOPDF_PATH"] = os.path.join(BENCH_DIR, "wkhtmltopdf")
+
+    port = free_port()
+    log = open(os.path.join(workdir, "app.log"), "w")
+    procs = [subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "-c", os.path.join(REPO_DIR, "gunicorn.conf.py"),
+         "-b", f"127.0.0.1:{port}",
+         "-w", str(args.workers), "--threads", str(args.threads), "--timeout", "180"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )]
+    if args.mode == "async":
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, "worker.py")],
+            cwd=workdir, env=dict(env, REPORT_WORKERS=str(args.report_workers), OUTBOX_SENDER="0"),
+            stdout=log, stderr=subprocess.STDOUT,
+        ))
+
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base + "/healthz", timeout=2)
+            return base, procs
+        except (urllib.error.URLError, OSError):
+            if procs[0].poll() is not None:
+                break
+            time.sleep(0.3)
+    stop_app(procs)
+    raise SystemExit(f"app did not start; see {os.path.join(workdir, 'app.log')}")
+
+
+def stop_app(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# === HTTP-клієнт віртуального користувача ===
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class VirtualUser:
+    def __init__(self, base: str, index: int):
+        self.base = base
+        self.email = f"bench{index}-{uuid.uuid4().hex[:6]}@example.com"
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+        self.reports = []
+
+    def request(self, path: str, data: bytes = None, headers: dict = None, timeout: float = 300):
+        """→ (status, body, headers); редіректи не виконуються."""
+        req = urllib.request.Request(self.base + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(req, timeout=timeout) as resp:
+                return resp.status, resp.read(), resp.headers
+        except urllib.error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+    def form(self, path: str, fields: dict):
+        return self.request(path, urllib.parse.urlencode(fields).encode("utf-8"),
+                            {"Content-Type": "application/x-www-form-urlencoded"})
+
+    def setup(self):
+        self.form("/register", {"email": self.email, "password": "bench"})
+        self.form("/login", {"email": self.email, "password": "bench"})
+        # PRO: без ліміту 3 звіти / 14 днів
+        self.request(f"/upgrade/dev?token={DEV_TOKEN}")
+
+    def upload(self, csv_bytes: bytes):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"sales.csv\"\r\n"
+            "Content-Type: text/csv\r\n\r\n"
+        ).encode("utf-8") + csv_bytes + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        return self.request("/analyze", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+
+def sample_csv(rows: int, seed: int) -> bytes:
+    """Синтетичні продажі за схемою sample-csv; seed робить кожен аплоад унікальним."""
+    rnd = random.Random(seed)
+    menu = [("Pizza", "Food", 9.9), ("Burger", "Food", 8.5), ("Salad", "Food", 6.0),
+            ("Cola", "Beverage", 2.0), ("Coffee", "Beverage", 2.5), ("Cake", "Dessert", 4.5)]
+    start = datetime(2025, 1, 1)
+    lines = ["date,item,category,qty,price"]
+    for i in range(rows):
+        item, category, price = rnd.choice(menu)
+        day = (start + timedelta(days=i * 90 // max(rows, 1))).strftime("%Y-%m-%d")
+        lines.append(f"{day},{item},{category},{rnd.randint(1, 20)},{price:.2f}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+# === Сценарії маршрутів ===
+def do_analyze(user: VirtualUser, args, seed: int) -> int:
+    status, _, headers = user.upload(sample_csv(args.csv_rows, seed))
+    if args.mode == "sync":
+        # Успіх — файл звіту (200); помилка — редірект з toast-кукі
+        return status
+    location = headers.get("Location", "") if status == 302 else ""
+    if "/jobs/" not in location:
+        return status
+    job_path = urllib.parse.urlparse(location).path
+    while True:
+        code, body, _ = user.request(job_path + "/status", headers={"Accept": "application/json"})
+        job = json.loads(body) if code == 200 else {}
+        if job.get("status") == "done":
+            return 200
+        if code != 200 or job.get("status") == "failed":
+            return 500
+        time.sleep(0.25)
+
+
+def do_download(user: VirtualUser, args, seed: int) -> int:
+    if not user.reports:
+        return 404
+    return user.request("/download-report/" + urllib.parse.quote(user.reports[seed % len(user.reports)]))[0]
+
+
+SCENARIOS = {
+    "/analyze": do_analyze,
+    "/dashboard": lambda user, args, seed: user.request("/dashboard")[0],
+    "/report-history": lambda user, args, seed: user.request("/report-history")[0],
+    "/download-report": do_download,
+}
+
+
+def percentile(sorted_values, pct: float):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[rank] * 1000, 1)
+
+
+def run_route(route: str, users, args, sampler: RssSampler) -> dict:
+    scenario = SCENARIOS[route]
+    total = args.analyze_requests if route == "/analyze" else args.requests
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+
+    def one(i):
+        user = users[i % len(users)]
+        started = time.perf_counter()
+        try:
+            status = scenario(user, args, seed=i)
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+    sampler.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ok = len(latencies)
+    return {
+        "requests": total,
+        "ok": ok,
+        "errors": total - ok,
+        "status_counts": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(1000 * sum(latencies) / ok, 1) if ok else None,
+        "max_ms": round(1000 * latencies[-1], 1) if ok else None,
+        "throughput_rps": round(ok / wall, 2) if wall else None,
+        "wall_s": round(wall, 2),
+        "peak_rss_mb": sampler.peak(),
+    }
+
+
+def collect_reports(users):
+    """Імена звітів кожного користувача з /report-history (для /download-report)."""
+    for user in users:
+        _, body, _ = user.request("/report-history")
+        user.reports = sorted(set(re.findall(r'/download-report/([^"\'?#]+)', body.decode("utf-8", "replace"))))
+        user.reports = [urllib.parse.unquote(name) for name in user.reports]
+
+
+def stage_summary(base: str) -> dict:
+    """Середній час етапів пайплайна з /metrics застосунку (сума/кількість гістограм)."""
+    try:
+        text = urllib.request.urlopen(base + "/metrics", timeout=10).read().decode("utf-8")
+    except (urllib.error.URLError, OSError):
+        return {}
+    totals = {}
+    for name, stage, value in re.findall(r'^restgenius_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$', text, re.M):
+        totals.setdefault(stage, {})[name] = float(value)
+    return {
+        stage: {"count": int(v.get("count", 0)),
+                "mean_ms": round(1000 * v["sum"] / v["count"], 1) if v.get("count") else None}
+        for stage, v in sorted(totals.items())
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or "unknown"
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def compare(current: dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} (rev {baseline['meta'].get('revision')}):")
+    for route, now in current["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"):
+            if now.get(key) is not None and before.get(key):
+                deltas.append(f"{key} {100 * (now[key] - before[key]) / before[key]:+.1f}%")
+        print(f"  {route:18} " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RestGenius load benchmark")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn -w")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn --threads")
+    parser.add_argument("--mode", choices=("sync", "async"), default="sync",
+                        help="ASYNC_REPORTS: sync — звіт у межах запиту, async — черга + worker.py")
+    parser.add_argument("--report-workers", type=int, default=2, help="REPORT_WORKERS для --mode async")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="запитів на легкі маршрути")
+    parser.add_argument("--analyze-requests", type=int, default=24)
+    parser.add_argument("--csv-rows", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=1.0, help="затримка fake OpenAI, сек")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="частка відповідей 429")
+    parser.add_argument("--pdf", choices=("stub", "real"), default="stub",
+                        help="stub — bench/wkhtmltopdf, real — wkhtmltopdf з PATH/WKHTMLTOPDF_PATH")
+    parser.add_argument("--pdf-delay", type=float, default=0.5, help="час рендеру заглушки, сек")
+    parser.add_argument("--llm-cache", action="store_true", help="не вимикати кеш відповідей OpenAI")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--compare", help="попередній results/*.json для порівняння")
+    parser.add_argument("--keep", action="store_true", help="не видаляти тимчасову директорію")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="restgenius-bench-")
+    openai_port = free_port()
+    openai_server, openai_stats = fake_openai.serve(openai_port, args.latency, args.jitter, args.rate_429)
+    base, procs = start_app(args, workdir, openai_port)
+    sampler = RssSampler([p.pid for p in procs])
+    try:
+        users = [VirtualUser(base, i) for i in range(args.users)]
+        for user in users:
+            user.setup()
+
+        results = {}
+        for route in [r for r in args.routes.split(",") if r]:
+            if route == "/download-report":
+                collect_reports(users)
+            results[route] = run_route(route, users, args, sampler)
+            r = results[route]
+            print(f"{route:18} ok={r['ok']}/{r['requests']} p50={r['p50_ms']}ms p95={r['p95_ms']}ms "
+                  f"p99={r['p99_ms']}ms {r['throughput_rps']} rps peak_rss={r['peak_rss_mb']}MB")
+        stages = stage_summary(base)
+    finally:
+        sampler.stop()
+        stop_app(procs)
+        openai_server.shutdown()
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "keep")},
+        },
+        "openai": {"requests": openai_stats.requests, "throttled": openai_stats.throttled},
+        "routes": results,
+        "stages": stages,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{datetime.utcnow():%Y%m%d-%H%M%S}-{output['meta']['revision']}-{args.mode}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nresults: {path}")
+    if args.compare:
+        compare(output, args.compare)
+
+    if args.keep:
+        print(f"workdir: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
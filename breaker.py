@@ -0,0 +1,259 @@
+"""Circuit breaker і кешований health-probe OpenAI, спільні для всіх процесів.
+
+Стан зберігається в SQLite-файлі (як лімітер у ratelimit.py), тож gunicorn-воркери і
+worker.py бачать одне й те саме. OPENAI_BREAKER_FAILURES транзитних збоїв поспіль (таймаут,
+з'єднання, 5xx) відкривають ланцюг: виклики падають одразу з CircuitOpen замість очікування
+повного таймауту. Через OPENAI_BREAKER_COOLDOWN секунд пропускається один пробний виклик
+(half-open): успіх закриває ланцюг, збій — знову відкриває.
+
+Probe — безкоштовний GET /models/<model> замість платного completion; успішна проба дозволяє
+пробний виклик, не чекаючи кінця cooldown. Результат кешується на OPENAI_PROBE_TTL секунд:
+/healthz/openai читає кеш, а пробу робить лише той процес, що взяв lease (фоновий prober
+у worker.py або перший запит після TTL).
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from cache import SqliteStore
+
+log = logging.getLogger("restgenius.breaker")
+
+BREAKER_ENABLED = os.getenv("OPENAI_BREAKER_ENABLED", "1") == "1"
+BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+PROBE_TTL = float(os.getenv("OPENAI_PROBE_TTL", "30"))
+PROBE_TIMEOUT = float(os.getenv("OPENAI_PROBE_TIMEOUT", "5"))
+
+# Повторні спроби транзитних помилок: повний джитер у [0, min(cap, base * 2^n)]
+RETRIES = int(os.getenv("OPENAI_RETRIES", "2"))
+RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "0.5"))
+RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "8"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS circuit (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    failures INTEGER NOT NULL,
+    opened_at REAL NOT NULL,
+    trial_until REAL NOT NULL,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS probe (
+    name TEXT PRIMARY KEY,
+    ok INTEGER,
+    checked_at REAL NOT NULL,
+    lease_until REAL NOT NULL,
+    latency REAL,
+    error TEXT
+);
+"""
+
+_NAME = "openai"
+
+
+class CircuitOpen(RuntimeError):
+    """Ланцюг відкритий: OpenAI вважаємо недоступним, виклик не відправлявся (toast rg_err_unavailable)."""
+
+
+def is_transient(e: Exception) -> bool:
+    """Помилка, яку варто повторити: таймаут, з'єднання, 5xx або 429 від OpenAI (крім вичерпаної квоти)."""
+    import openai
+
+    if isinstance(e, (openai.APIConnectionError, openai.InternalServerError, TimeoutError)):
+        return True
+    return isinstance(e, openai.RateLimitError) and getattr(e, "code", None) != "insufficient_quota"
+
+
+def _counts_as_outage(e: Exception) -> bool:
+    # 429 — це тиск на ліміти, а не недоступність: з ним працює лімітер, а не breaker
+    import openai
+
+    return is_transient(e) and not isinstance(e, openai.RateLimitError)
+
+
+def backoff(attempt: int) -> float:
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+class CircuitBreaker(SqliteStore):
+    schema = _SCHEMA
+
+    def __init__(self, path: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        super().__init__(path)
+        self.failures = failures
+        self.cooldown = cooldown
+
+    def _row(self, conn):
+        row = conn.execute(
+            "SELECT state, failures, opened_at, trial_until, last_error FROM circuit WHERE name = ?", (_NAME,)
+        ).fetchone()
+        return row or ("closed", 0, 0.0, 0.0, None)
+
+    def _save(self, conn, state, failures, opened_at, trial_until, last_error):
+        conn.execute(
+            "INSERT OR REPLACE INTO circuit (name, state, failures, opened_at, trial_until, last_error) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (_NAME, state, failures, opened_at, trial_until, last_error),
+        )
+
+    def is_open(self) -> bool:
+        """Відкритий і пробний виклик ще не дозволений — для швидкої відмови до початку роботи."""
+        if not BREAKER_ENABLED:
+            return False
+        state, _failures, opened_at, trial_until, _err = self._row(self._conn())
+        now = time.time()
+        if state == "open":
+            return now < opened_at + self.cooldown
+        return state == "half_open" and now < trial_until
+
+    def allow(self, trial_seconds: float = 60.0):
+        """Перед кожним викликом OpenAI; кидає CircuitOpen, якщо виклик відправляти не можна."""
+        if not BREAKER_ENABLED:
+            return
+        conn = self._conn()
+        # Закритий ланцюг — лише читання, без запису на кожен виклик
+        if self._row(conn)[0] == "closed":
+            return
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, failures, opened_at, trial_until, last_error = self._row(conn)
+            if state == "closed":
+                conn.commit()
+                return
+            if (state == "open" and now < opened_at + self.cooldown) or (state == "half_open" and now < trial_until):
+                conn.commit()
+                raise CircuitOpen(f"openai unavailable: circuit open ({last_error})")
+            # Цей виклик — пробний; решта чекає його результату до trial_until
+            self._save(conn, "half_open", failures, opened_at, now + trial_seconds, last_error)
+            conn.commit()
+        except CircuitOpen:
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        log.warning("[BREAKER] half-open: trial call allowed")
+
+    def record(self, error: Exception = None):
+        """Результат виклику: None — успіх, інакше виняток (рахуються лише збої недоступності)."""
+        if not BREAKER_ENABLED:
+            return
+        conn = self._conn()
+        state, failures, *_ = self._row(conn)
+        if error is None:
+            if state != "closed" or failures:
+                with conn:
+                    self._save(conn, "closed", 0, 0.0, 0.0, None)
+                if state != "closed":
+                    log.warning("[BREAKER] closed: openai recovered")
+            return
+        if not _counts_as_outage(error):
+            return
+
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, failures, opened_at, _trial, _err = self._row(conn)
+            failures += 1
+            message = f"{type(error).__name__}: {error}"[:200]
+            if state == "half_open" or failures >= self.failures:
+                if state != "open":
+                    log.error("[BREAKER] open: failures=%s err=%s", failures, message)
+                self._save(conn, "open", failures, now, 0.0, message)
+            else:
+                self._save(conn, state, failures, opened_at, 0.0, message)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # === Health probe ===
+    def _take_probe_lease(self, ttl: float) -> bool:
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO probe (name, ok, checked_at, lease_until) VALUES (?, NULL, 0, 0)", (_NAME,)
+            )
+            cur = conn.execute(
+                "UPDATE probe SET lease_until = ? WHERE name = ? AND checked_at < ? AND lease_until < ?",
+                (now + PROBE_TIMEOUT + 1, _NAME, now - ttl, now),
+            )
+        return cur.rowcount == 1
+
+    def probe(self, client, model: str, ttl: float = PROBE_TTL, force: bool = False):
+        """Перевіряє OpenAI, якщо кеш старший за ttl і lease наш; результат іде і в breaker."""
+        if not force and not self._take_probe_lease(ttl):
+            return
+        started = time.perf_counter()
+        error = None
+        try:
+            client.with_options(timeout=PROBE_TIMEOUT, max_retries=0).models.retrieve(model)
+        except Exception as e:
+            error = e
+        latency = time.perf_counter() - started
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO probe (name, ok, checked_at, lease_until, latency, error) "
+                "VALUES (?, ?, ?, 0, ?, ?)",
+                (_NAME, int(error is None), time.time(), latency,
+                 None if error is None else f"{type(error).__name__}: {error}"[:200]),
+            )
+        if error is not None:
+            log.warning("[BREAKER] probe failed err=%s", error)
+            self.record(error)
+        else:
+            self._expire_cooldown()
+
+    def _expire_cooldown(self):
+        # Проба пройшла: наступний виклик — пробний одразу, без очікування кінця cooldown.
+        # Закриває ланцюг лише справжній completion (GET /models може жити, коли completions ні)
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE circuit SET opened_at = 0 WHERE name = ? AND state = 'open'", (_NAME,))
+
+    def health(self) -> dict:
+        conn = self._conn()
+        state, failures, opened_at, _trial, last_error = self._row(conn)
+        row = conn.execute("SELECT ok, checked_at, latency, error FROM probe WHERE name = ?", (_NAME,)).fetchone()
+        ok, checked_at, latency, probe_error = row or (None, 0.0, None, None)
+        now = time.time()
+        return {
+            "enabled": BREAKER_ENABLED,
+            "circuit": state,
+            "consecutive_failures": failures,
+            "open_for": round(max(0.0, opened_at + self.cooldown - now), 1) if state == "open" else 0,
+            "accepting": not self.is_open(),
+            "last_error": last_error,
+            "probe": {
+                "ok": None if ok is None else bool(ok),
+                "age": round(now - checked_at, 1) if checked_at else None,
+                "latency_ms": round(latency * 1000) if latency is not None else None,
+                "error": probe_error,
+            },
+        }
+
+
+def run_prober(app, breaker: CircuitBreaker, client, model: str, stop_event=None):
+    """Фоновий prober: тримає кеш здоров'я свіжим, щоб /healthz/openai не чекав на OpenAI."""
+    stop_event = stop_event or threading.Event()
+    app.logger.info("[BREAKER] prober started pid=%s ttl=%s", os.getpid(), PROBE_TTL)
+    while not stop_event.is_set():
+        try:
+            # Трохи раніше за TTL: читачі майже завжди бачать свіжий результат
+            breaker.probe(client, model, ttl=PROBE_TTL * 0.8)
+        except Exception:
+            app.logger.exception("[BREAKER] probe loop error")
+        stop_event.wait(PROBE_TTL / 4 * random.uniform(0.8, 1.2))
+
+
+def start_thread_prober(app, breaker: CircuitBreaker, client, model: str) -> threading.Event:
+    """Вбудований prober у потоці — для локального `python app.py`."""
+    stop_event = threading.Event()
+    threading.Thread(target=run_prober, args=(app, breaker, client, model, stop_event), daemon=True,
+                     name="openai-prober").start()
+    return stop_event
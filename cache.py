@@ -0,0 +1,121 @@
+"""Дисковий key-value кеш на SQLite, спільний для всіх процесів gunicorn/worker.py.
+
+TTL на запис, LRU-витіснення за сумарним розміром і лічильники hit/miss у самій базі,
+щоб статистика була спільною для всіх воркерів.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class SqliteStore:
+    """Базовий клас для стану в окремому SQLite-файлі, спільному між процесами."""
+
+    schema = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        # Окреме з'єднання на потік і процес: після fork старе з'єднання не використовуємо
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+
+class DiskCache(SqliteStore):
+    schema = _SCHEMA
+
+    def __init__(self, path: str, max_bytes: int, ttl_seconds: float):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+    def _incr(self, conn, name: str, by: int = 1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, by),
+        )
+
+    def get(self, key: str):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._incr(conn, "misses")
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._incr(conn, "hits")
+        return row[0]
+
+    def set(self, key: str, value, ttl_seconds: float = None):
+        conn = self._conn()
+        now = time.time()
+        size = len(value.encode("utf-8")) if isinstance(value, str) else len(value)
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now),
+            )
+            self._evict(conn, now)
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn, now: float):
+        expired = conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,)).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        evicted = 0
+        if total > self.max_bytes:
+            # Найдавніше використані — першими, поки не влізли в ліміт
+            for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                evicted += 1
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        if expired or evicted:
+            self._incr(conn, "evictions", expired + evicted)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,64 @@
+"""Профіль рушія БД: URI з оточення, пул з'єднань і PRAGMA для SQLite.
+
+За замовчуванням — локальний sqlite:///users.db у WAL-режимі (читачі не блокують запис звітів),
+з busy_timeout замість миттєвого "database is locked". DATABASE_URL дозволяє перейти на
+серверну БД (Postgres/MySQL) з налаштованим пулом.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.engine import Engine
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///users.db")
+
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") == "1"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+def database_uri() -> str:
+    # Heroku/Render віддають postgres://, SQLAlchemy 2 приймає лише postgresql://
+    if DATABASE_URL.startswith("postgres://"):
+        return "postgresql://" + DATABASE_URL[len("postgres://"):]
+    return DATABASE_URL
+
+
+def _sqlite_in_memory(url) -> bool:
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
+def engine_options(uri: str) -> dict:
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"timeout": DB_BUSY_TIMEOUT_MS / 1000, "check_same_thread": False}}
+        # In-memory SQLite тримає одне з'єднання на потік (SingletonThreadPool): аргументів QueuePool не приймає
+        if not _sqlite_in_memory(url):
+            options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+        return options
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    if SQLITE_WAL:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # У WAL synchronous=NORMAL безпечний і знімає fsync з кожного коміту
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
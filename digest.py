@@ -0,0 +1,166 @@
+"""Попередня агрегація продажів для промпту замість сирих рядків CSV.
+
+Для схеми date,item,category,qty,price (як у /sample-csv) рахуємо за один прохід виторг і
+кількість по товарах, категоріях і днях, топ/аутсайдерів, тренд і дні-аномалії, і віддаємо
+моделі компактний текстовий дайджест. Файли іншої схеми — лише як opt-in fallback сирим CSV.
+"""
+import os
+import statistics
+from collections import defaultdict
+
+from ingest import parse_date, parse_number
+
+SALES_COLUMNS = ("date", "item", "category", "qty", "price")
+COLUMN_ALIASES = {"quantity": "qty", "day": "date", "unit_price": "price", "product": "item"}
+
+# Файли не за схемою: 1 — шлемо сирі рядки в промпт (як раніше), 0 — відхиляємо з toast
+RAW_CSV_FALLBACK = os.getenv("RAW_CSV_FALLBACK", "0") == "1"
+
+TOP_N = 10
+BOTTOM_N = 5
+OUTLIER_Z = 2.0
+
+
+def column_index(header) -> dict:
+    """Назва колонки схеми → індекс у заголовку (з урахуванням синонімів)."""
+    index = {}
+    for i, name in enumerate(header):
+        name = COLUMN_ALIASES.get(name, name)
+        if name in SALES_COLUMNS and name not in index:
+            index[name] = i
+    return index
+
+
+def matches_schema(header) -> bool:
+    return len(column_index(header)) == len(SALES_COLUMNS)
+
+
+class SalesAggregator:
+    """Однопрохідні агрегати по рядках схеми продажів (пам'ять ∝ товарам і дням, не рядкам)."""
+
+    def __init__(self, header):
+        self.idx = column_index(header)
+        self.rows = 0
+        self.skipped = 0
+        self.revenue = 0.0
+        self.qty = 0.0
+        self.by_item = defaultdict(lambda: [0.0, 0.0])       # item → [revenue, qty]
+        self.by_category = defaultdict(lambda: [0.0, 0.0])   # category → [revenue, qty]
+        self.by_day = defaultdict(lambda: [0.0, 0.0])        # date → [revenue, qty]
+        self.item_category = {}
+
+    def add(self, row):
+        i = self.idx
+        try:
+            day = parse_date(row[i["date"]])
+            qty = parse_number(row[i["qty"]])
+            price = parse_number(row[i["price"]])
+        except (ValueError, IndexError):
+            self.skipped += 1
+            return
+        item = row[i["item"]] or "(unknown)"
+        category = row[i["category"]] or "(uncategorized)"
+        self.add_total(day, item, category, qty, qty * price)
+
+    def add_total(self, day, item, category, qty, revenue):
+        """Додає вже згорнутий підсумок (день, товар) — напр. зі збереженої історії продажів."""
+        self.rows += 1
+        self.revenue += revenue
+        self.qty += qty
+        for bucket, key in ((self.by_item, item), (self.by_category, category), (self.by_day, day)):
+            bucket[key][0] += revenue
+            bucket[key][1] += qty
+        self.item_category.setdefault(item, category)
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+        return self
+
+    def render(self) -> str:
+        """Компактний текстовий дайджест для промпту."""
+        if not self.rows:
+            return ""
+        days = sorted(self.by_day)
+        lines = [
+            f"Period: {days[0].isoformat()} to {days[-1].isoformat()} ({len(days)} trading days, {self.rows} rows)",
+            f"Total revenue: {self.revenue:.2f}; total quantity: {self.qty:.0f}; "
+            f"average price per unit: {self.revenue / self.qty if self.qty else 0:.2f}",
+            f"Distinct items: {len(self.by_item)}; categories: {len(self.by_category)}",
+            "",
+            "Revenue by category (revenue, qty, share):",
+        ]
+        for name, (rev, qty) in sorted(self.by_category.items(), key=lambda kv: -kv[1][0]):
+            lines.append(f"- {name}: {rev:.2f}, {qty:.0f}, {self._share(rev)}")
+
+        ranked = sorted(self.by_item.items(), key=lambda kv: -kv[1][0])
+        lines += ["", f"Top {min(TOP_N, len(ranked))} items by revenue (revenue, qty, avg price, category):"]
+        lines += [self._item_line(name, rev, qty) for name, (rev, qty) in ranked[:TOP_N]]
+        if len(ranked) > TOP_N:
+            lines += ["", f"Bottom {min(BOTTOM_N, len(ranked) - TOP_N)} items by revenue:"]
+            lines += [self._item_line(name, rev, qty) for name, (rev, qty) in ranked[-BOTTOM_N:]]
+
+        lines += ["", "Daily revenue trend:"] + self._trend_lines(days)
+        return "\n".join(lines)
+
+    def render_brief(self, top_n: int = 5) -> str:
+        """Стислий дайджест для контексту: період, підсумки, категорії, топ товарів, тренд."""
+        if not self.rows:
+            return ""
+        days = sorted(self.by_day)
+        lines = [
+            f"Period: {days[0].isoformat()} to {days[-1].isoformat()} ({len(days)} trading days)",
+            f"Total revenue: {self.revenue:.2f}; total quantity: {self.qty:.0f}; "
+            f"avg daily revenue: {self.revenue / len(days):.2f}",
+            "Revenue by category: " + ", ".join(
+                f"{name} {rev:.2f} ({self._share(rev)})"
+                for name, (rev, _) in sorted(self.by_category.items(), key=lambda kv: -kv[1][0])
+            ),
+            f"Top {top_n} items: " + ", ".join(
+                f"{name} {rev:.2f}"
+                for name, (rev, _) in sorted(self.by_item.items(), key=lambda kv: -kv[1][0])[:top_n]
+            ),
+        ]
+        return "\n".join(lines + self._trend_lines(days)[:1])
+
+    def _share(self, revenue: float) -> str:
+        return f"{100 * revenue / self.revenue:.1f}%" if self.revenue else "n/a"
+
+    def _item_line(self, name, revenue, qty) -> str:
+        avg = revenue / qty if qty else 0
+        return f"- {name}: {revenue:.2f}, {qty:.0f}, {avg:.2f}, {self.item_category.get(name)}"
+
+    def _trend_lines(self, days) -> list:
+        daily = [self.by_day[d][0] for d in days]
+        lines = []
+        if len(daily) >= 2:
+            half = len(daily) // 2
+            first, second = statistics.fmean(daily[:half]), statistics.fmean(daily[half:])
+            change = f"{100 * (second - first) / first:+.1f}%" if first else "n/a"
+            lines.append(f"- Avg daily revenue first half {first:.2f} vs second half {second:.2f} ({change})")
+
+        by_weekday = defaultdict(list)
+        for d, rev in zip(days, daily):
+            by_weekday[d.strftime("%A")].append(rev)
+        if len(by_weekday) > 1:
+            ranked = sorted(by_weekday.items(), key=lambda kv: -statistics.fmean(kv[1]))
+            lines.append("- Avg revenue by weekday: " + ", ".join(
+                f"{name} {statistics.fmean(vals):.2f}" for name, vals in ranked
+            ))
+
+        if len(daily) >= 5:
+            mean, stdev = statistics.fmean(daily), statistics.pstdev(daily)
+            outliers = [
+                (d, rev) for d, rev in zip(days, daily)
+                if stdev and abs(rev - mean) / stdev >= OUTLIER_Z
+            ]
+            if outliers:
+                lines.append("- Outlier days (revenue vs mean %.2f): " % mean + ", ".join(
+                    f"{d.isoformat()} {rev:.2f}" for d, rev in outliers[:10]
+                ))
+        return lines or ["- Not enough days for a trend"]
+
+
+def build(header, rows) -> str:
+    """Дайджест для рядків схеми продажів; порожній рядок, якщо валідних рядків немає."""
+    return SalesAggregator(header).extend(rows).render()
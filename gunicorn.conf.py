@@ -0,0 +1,47 @@
+"""Налаштування gunicorn: підхоплюється автоматично з поточної директорії (або `-c gunicorn.conf.py`).
+
+Хуки для схеми БД, метрик у multiprocess-режимі (див. metrics.py), збірки статики (assets.py)
+і фонового прогріву OpenAI-клієнта; решта параметрів — з CLI/ENV.
+"""
+import os
+import shutil
+
+# metrics імпортується в on_starting (після очищення PROMETHEUS_MULTIPROC_DIR), а не в child_exit:
+# той викликається з обробника SIGCHLD і при кількох смертях поспіль застав би напівімпортований модуль
+metrics = None
+
+
+def on_starting(server):
+    global metrics
+    # Файли метрик попереднього запуску спотворили б лічильники; worker.py стартує після gunicorn
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+    import metrics
+
+    # Схема БД — один раз у майстрі, до fork: воркери не змагаються за CREATE TABLE/INDEX
+    from app import prepare_schema
+
+    prepare_schema()
+
+    # Відбитки статики збираються один раз у майстрі, до fork воркерів
+    if os.getenv("ASSETS_BUILD_ON_START", "1") == "1":
+        import assets
+
+        assets.build()
+        server.log.info("[ASSETS] static build ready in %s", assets.STATIC_DIST_DIR)
+
+
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Воркер уже приймає запити; OpenAI-клієнт (імпорт SDK ~0.5 с) догріваємо у фоні,
+    # щоб перший звіт не платив за нього
+    import threading
+
+    import llm
+
+    threading.Thread(target=llm.get_client, daemon=True, name="openai-warmup").start()
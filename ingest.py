@@ -0,0 +1,142 @@
+"""Потокове читання CSV-аплоаду з обмеженням пам'яті.
+
+Байти декодуються інкрементально (TextIOWrapper поверх потоку аплоаду), читання зупиняється
+на ліміті рядків, а заголовок і типізовані колонки перевіряються по ходу — зламаний файл
+відхиляється на перших рядках, а не після повного завантаження в пам'ять.
+"""
+import csv
+import io
+import itertools
+import os
+from datetime import datetime
+
+# Стеля рядків одного аплоаду: файли за схемою згортає digest, решту — summarize (map-reduce)
+CSV_MAX_ROWS = int(os.getenv("CSV_MAX_ROWS", "100000"))
+
+# Скільки зламаних рядків пропускаємо, перш ніж відхилити файл цілком
+CSV_MAX_BAD_ROWS = int(os.getenv("CSV_MAX_BAD_ROWS", "10"))
+CSV_MAX_BAD_RATIO = float(os.getenv("CSV_MAX_BAD_RATIO", "0.05"))
+
+# Колонки, тип яких перевіряємо за назвою в заголовку (решта — довільний текст)
+NUMERIC_COLUMNS = {"qty", "quantity", "price", "revenue", "amount", "total", "sales"}
+DATE_COLUMNS = {"date", "day"}
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y")
+
+
+class CsvError(ValueError):
+    """Файл не пройшов перевірку; code — toast-кукі для дашборду."""
+
+    def __init__(self, code: str, detail: str = ""):
+        super().__init__(f"{code}: {detail}" if detail else code)
+        self.code = code
+
+
+def parse_number(value: str) -> float:
+    """'9.90', '9,90', '$1,234.50', ' 14 ' → float; інакше ValueError."""
+    v = value.strip().replace(" ", "").replace(" ", "").lstrip("$€£₴")
+    if "," in v and "." not in v:
+        v = v.replace(",", ".")
+    else:
+        v = v.replace(",", "")
+    return float(v)
+
+
+def parse_date(value: str):
+    v = value.strip()[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(v, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognized date: {value!r}")
+
+
+class CsvUpload:
+    """Результат інгесту: нормалізований заголовок і до max_rows валідних рядків."""
+
+    def __init__(self, header, rows, truncated=False, skipped=0):
+        self.header = header
+        self.rows = rows
+        self.truncated = truncated
+        self.skipped = skipped
+
+    def as_text(self) -> str:
+        return "\n".join(", ".join(row) for row in [self.header] + self.rows)
+
+
+def _read_header(reader) -> list:
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        header = [cell.strip().lower() for cell in row]
+        # Хвостові порожні колонки (кома в кінці рядка з Excel) — не помилка
+        while header and not header[-1]:
+            header.pop()
+        if len(header) < 2 or not all(header) or len(set(header)) != len(header):
+            raise CsvError("rg_err_csv", f"bad header: {row!r}")
+        return header
+    raise CsvError("rg_err_empty")
+
+
+def _check_row(header, checks, row):
+    """Нормалізує рядок під ширину заголовка; ValueError, якщо рядок зламаний."""
+    cells = [cell.strip() for cell in row]
+    while len(cells) > len(header) and not cells[-1]:
+        cells.pop()
+    if len(cells) > len(header):
+        raise ValueError(f"too many cells: {len(cells)} > {len(header)}")
+    cells += [""] * (len(header) - len(cells))
+    for idx, check in checks:
+        if cells[idx]:
+            check(cells[idx])
+    return cells
+
+
+def read_upload(stream, max_rows: int = CSV_MAX_ROWS) -> CsvUpload:
+    """Читає CSV з бінарного потоку до max_rows рядків, не завантажуючи файл цілком.
+
+    Кидає CsvError з кодом rg_err_empty / rg_err_encoding / rg_err_csv.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        # Роздільник визначаємо за першим рядком: європейські експорти часто з ";"
+        first_line = text.readline()
+        delimiter = ";" if first_line.count(";") > first_line.count(",") else ","
+        reader = csv.reader(itertools.chain([first_line], text), delimiter=delimiter)
+        header = _read_header(reader)
+        checks = [(i, parse_number) for i, name in enumerate(header) if name in NUMERIC_COLUMNS]
+        checks += [(i, parse_date) for i, name in enumerate(header) if name in DATE_COLUMNS]
+
+        rows, skipped, truncated = [], 0, False
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if len(rows) >= max_rows:
+                # Далі не читаємо: решта аплоаду не потрапить у пам'ять
+                truncated = True
+                break
+            try:
+                rows.append(_check_row(header, checks, row))
+            except ValueError:
+                skipped += 1
+                if skipped > max(CSV_MAX_BAD_ROWS, CSV_MAX_BAD_RATIO * len(rows)):
+                    raise CsvError("rg_err_csv", f"too many malformed rows (last: {row!r})")
+    except UnicodeDecodeError:
+        raise CsvError("rg_err_encoding")
+    except csv.Error as e:
+        raise CsvError("rg_err_csv", str(e))
+    finally:
+        # Потік аплоаду закриває Werkzeug, не наш TextIOWrapper
+        text.detach()
+
+    if not rows:
+        raise CsvError("rg_err_empty")
+    return CsvUpload(header, rows, truncated=truncated, skipped=skipped)
+
+
+def write_upload(upload: CsvUpload, path: str):
+    """Зберігає нормалізований CSV (напр. у спул черги)."""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(upload.header)
+        writer.writerows(upload.rows)
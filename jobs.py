@@ -0,0 +1,249 @@
+"""Персистентна черга генерації звітів поверх SQLAlchemy (без зовнішнього брокера).
+
+/analyze кладе CSV (а /analyze/batch — zip закладів) у спул-директорію і створює ReportJob;
+воркери (worker.py) атомарно забирають задачі, шлють heartbeat і повертають у чергу ті,
+чий воркер помер.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, select, func
+from sqlalchemy.orm import aliased
+
+from models import db, ReportJob
+import batch
+import ingest
+
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", "uploads")
+
+# Скільки задач одного користувача виконуються одночасно / можуть чекати в черзі
+JOB_MAX_RUNNING_PER_USER = int(os.getenv("JOB_MAX_RUNNING_PER_USER", "1"))
+JOB_MAX_PENDING_PER_USER = int(os.getenv("JOB_MAX_PENDING_PER_USER", "5"))
+
+# Відновлення після падіння воркера
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+
+PENDING_STATUSES = ("queued", "running")
+
+
+def pending_count(user_id: int) -> int:
+    return ReportJob.query.filter(
+        ReportJob.user_id == user_id, ReportJob.status.in_(PENDING_STATUSES)
+    ).count()
+
+
+def pending_reports(user_id: int) -> int:
+    """Скільки звітів дадуть задачі користувача в черзі: пакетна — по звіту на заклад."""
+    paths = db.session.execute(
+        select(ReportJob.upload_path).where(ReportJob.user_id == user_id, ReportJob.status.in_(PENDING_STATUSES))
+    ).scalars()
+    return sum(batch.spool_size(path) if path.endswith(".zip") else 1 for path in paths)
+
+
+def _spool_path(ext: str) -> str:
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    return os.path.join(JOB_SPOOL_DIR, f"{uuid.uuid4().hex}.{ext}")
+
+
+def _add(user_id: int, upload_path: str) -> ReportJob:
+    job = ReportJob(user_id=user_id, upload_path=upload_path, status="queued")
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def enqueue(user_id: int, upload: ingest.CsvUpload) -> ReportJob:
+    """Зберігає провалідований аплоад у спул і ставить задачу в чергу."""
+    upload_path = _spool_path("csv")
+    ingest.write_upload(upload, upload_path)
+    return _add(user_id, upload_path)
+
+
+def enqueue_batch(user_id: int, locations: list) -> ReportJob:
+    """Пакет закладів (batch.py) — у спул одним zip; розбір CSV уже у воркері."""
+    upload_path = _spool_path("zip")
+    batch.write_spool(locations, upload_path)
+    return _add(user_id, upload_path)
+
+
+def is_batch(job: ReportJob) -> bool:
+    return job.upload_path.endswith(".zip")
+
+
+def claim_next(worker_id: str):
+    """Атомарно забирає найстарішу задачу, не перевищуючи ліміт паралельних задач користувача."""
+    def running_for(user_id_column):
+        running = aliased(ReportJob)
+        return (
+            select(func.count(running.id))
+            .where(running.user_id == user_id_column, running.status == "running")
+            .scalar_subquery()
+        )
+
+    # Найстаріша задача серед усієї черги, чий власник ще не на ліміті: задачі користувачів
+    # на ліміті не затримують новіші задачі інших, хоч би скільки їх було попереду
+    queued = aliased(ReportJob)
+    eligible = (
+        select(queued.id)
+        .where(queued.status == "queued", running_for(queued.user_id) < JOB_MAX_RUNNING_PER_USER)
+        .order_by(queued.id)
+        .limit(1)
+    )
+    while True:
+        job_id = db.session.execute(eligible).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+        now = datetime.utcnow()
+        # Один UPDATE: і перевірка статусу, і ліміт користувача — без гонок між воркерами
+        claimed = db.session.execute(
+            update(ReportJob)
+            .where(
+                ReportJob.id == job_id,
+                ReportJob.status == "queued",
+                running_for(ReportJob.user_id) < JOB_MAX_RUNNING_PER_USER,
+            )
+            .values(
+                status="running",
+                worker_id=worker_id,
+                attempts=ReportJob.attempts + 1,
+                started_at=now,
+                heartbeat_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(ReportJob, job_id)
+        # Задачу щойно забрав інший воркер (або його власник досяг ліміту) — шукаємо наступну
+
+
+def recover_stale() -> int:
+    """Повертає в чергу задачі, чий воркер перестав слати heartbeat; після JOB_MAX_ATTEMPTS — failed."""
+    cutoff = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    stale = (ReportJob.status == "running", ReportJob.heartbeat_at < cutoff)
+
+    exhausted = db.session.execute(
+        select(ReportJob.id, ReportJob.upload_path).where(*stale, ReportJob.attempts >= JOB_MAX_ATTEMPTS)
+    ).all()
+    failed = 0
+    if exhausted:
+        failed = db.session.execute(
+            update(ReportJob)
+            .where(*stale, ReportJob.id.in_([job_id for job_id, _ in exhausted]))
+            .values(status="failed", error="rg_error", finished_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    requeued = db.session.execute(
+        update(ReportJob)
+        .where(*stale)
+        .values(status="queued", worker_id=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+
+    # Задача вже не виконається — спул-файл, як і у finish(), більше не потрібен
+    for _job_id, upload_path in exhausted:
+        try:
+            os.remove(upload_path)
+        except OSError:
+            pass
+    return requeued + failed
+
+
+def finish(job: ReportJob, report=None, error: str = None):
+    job.status = "failed" if error else "done"
+    job.error = error
+    job.report = report
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        os.remove(job.upload_path)
+    except OSError:
+        pass
+
+
+class _Heartbeat(threading.Thread):
+    """Оновлює heartbeat_at задачі, поки вона виконується."""
+
+    def __init__(self, app, job_id: int, worker_id: str):
+        super().__init__(daemon=True, name=f"job-heartbeat-{job_id}")
+        self.app, self.job_id, self.worker_id = app, job_id, worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        update(ReportJob)
+                        .where(ReportJob.id == self.job_id, ReportJob.worker_id == self.worker_id)
+                        .values(heartbeat_at=datetime.utcnow())
+                        .execution_options(synchronize_session=False)
+                    )
+                    db.session.commit()
+            except Exception:
+                self.app.logger.exception("[JOB] heartbeat failed job_id=%s", self.job_id)
+
+
+def run_worker(app, process_job, stop_event=None, worker_id: str = None, paused=None):
+    """Цикл воркера: recover → claim → process_job(job) → heartbeat до завершення.
+
+    process_job(job) повертає Report або кидає виняток; код помилки визначає сам process_job
+    через finish(), тому тут ловимо лише неочікуване. Поки paused() істинне (напр. відкритий
+    breaker OpenAI), нові задачі не беремо — вони чекають у черзі.
+    """
+    stop_event = stop_event or threading.Event()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    app.logger.info("[JOB] worker started id=%s", worker_id)
+
+    next_recover = 0.0
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                if time.monotonic() >= next_recover:
+                    recovered = recover_stale()
+                    if recovered:
+                        app.logger.warning("[JOB] recovered stale jobs count=%s", recovered)
+                    next_recover = time.monotonic() + JOB_STALE_SECONDS / 2
+
+                if paused is not None and paused():
+                    stop_event.wait(JOB_POLL_SECONDS)
+                    continue
+
+                job = claim_next(worker_id)
+                if job is None:
+                    stop_event.wait(JOB_POLL_SECONDS)
+                    continue
+
+                app.logger.info("[JOB] claimed job_id=%s user_id=%s attempt=%s", job.id, job.user_id, job.attempts)
+                heartbeat = _Heartbeat(app, job.id, worker_id)
+                heartbeat.start()
+                try:
+                    process_job(job)
+                except Exception:
+                    app.logger.exception("[JOB] crashed job_id=%s", job.id)
+                    db.session.rollback()
+                    finish(db.session.get(ReportJob, job.id), error="rg_error")
+                finally:
+                    heartbeat.stopped.set()
+        except Exception:
+            app.logger.exception("[JOB] worker loop error id=%s", worker_id)
+            stop_event.wait(JOB_POLL_SECONDS)
+
+
+def start_thread_worker(app, process_job, paused=None) -> threading.Event:
+    """Вбудований воркер у потоці — для локального `python app.py` без окремого worker.py."""
+    stop_event = threading.Event()
+    threading.Thread(
+        target=run_worker, args=(app, process_job, stop_event, None, paused), daemon=True, name="job-worker"
+    ).start()
+    return stop_event
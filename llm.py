@@ -0,0 +1,323 @@
+"""OpenAI-виклики для звітів: спільний обмежений пул потоків і секції з власними таймаутами."""
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import breaker as breaker_mod
+from breaker import CircuitOpen
+from cache import DiskCache
+import metrics
+import ratelimit
+
+log = logging.getLogger("restgenius.llm")
+
+OPENAI_MODEL = "gpt-3.5-turbo"
+OPENAI_TEMPERATURE = 0.2
+
+# Таймаут однієї секції (сек) і стеля паралельних викликів на процес (воркер gunicorn)
+SECTION_TIMEOUT = float(os.getenv("OPENAI_SECTION_TIMEOUT", "60"))
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+
+# Один пул на процес: запити різних користувачів ділять ту саму стелю
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="openai")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """OpenAI-клієнт процесу: створюється при першому виклику, один HTTP-пул на всі потоки.
+
+    Після fork дочірній процес будує власний клієнт, а не успадковує сокети батька.
+    Повтори SDK вимкнені: повтори з джитером і circuit breaker — у _with_retries.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                # Імпорт SDK (~0.5 с) — теж лише тут, а не при старті воркера
+                import httpx
+                from openai import DefaultHttpxClient, OpenAI
+
+                _client = OpenAI(
+                    api_key=OPENAI_API_KEY,
+                    max_retries=0,
+                    http_client=DefaultHttpxClient(limits=httpx.Limits(
+                        max_connections=MAX_CONCURRENCY * 2, max_keepalive_connections=MAX_CONCURRENCY,
+                    )),
+                )
+                _client_pid = os.getpid()
+    return _client
+
+# Кеш відповідей: повторний аплоад того самого файлу не платить за нові completions
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+response_cache = DiskCache(
+    path=os.getenv("LLM_CACHE_PATH", os.path.join("cache", "llm_responses.db")),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024,
+    ttl_seconds=float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600,
+)
+
+
+# Спільний між процесами лімітер RPM/TPM: черга або відмова ще до відправки запиту
+OPENAI_LIMITER_ENABLED = os.getenv("OPENAI_LIMITER_ENABLED", "1") == "1"
+limiter = ratelimit.RateLimiter(os.getenv("OPENAI_LIMITER_PATH", os.path.join("cache", "ratelimit.db")))
+
+# Спільний circuit breaker: коли OpenAI лежить, виклики падають одразу, а не за таймаутом
+breaker = breaker_mod.CircuitBreaker(os.getenv("OPENAI_BREAKER_PATH", os.path.join("cache", "openai_breaker.db")))
+
+
+def cache_key(prompt: str, model: str = OPENAI_MODEL, **params) -> str:
+    """Хеш моделі, параметрів і промпту.
+
+    Промпт детерміновано будується з шаблону і нормалізованих даних (ingest + digest),
+    тож однаковий за змістом CSV дає той самий ключ.
+    """
+    payload = json.dumps({"model": model, "params": params, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _acquire(prompt: str, lane: str, timeout: float) -> int:
+    """Резервує ємність у лімітері; RateLimited летить далі, збій самого лімітера — ні."""
+    if not OPENAI_LIMITER_ENABLED:
+        return 0
+    try:
+        # Половина таймауту секції — на чергу, решта — на сам виклик
+        return limiter.acquire(ratelimit.estimate_tokens(prompt), lane, max_wait=timeout / 2)
+    except ratelimit.RateLimited:
+        raise
+    except Exception:
+        log.exception("[LIMITER] acquire failed; calling OpenAI unthrottled")
+        return 0
+
+
+def _cache_get(key: str):
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        cached = response_cache.get(key)
+        metrics.LLM_CACHE.labels("miss" if cached is None else "hit").inc()
+        return cached
+    except Exception:
+        # Кеш — оптимізація: зламаний файл кешу не має валити звіт
+        log.exception("[LLM CACHE] read failed")
+        return None
+
+
+def _cache_set(key: str, content: str):
+    if LLM_CACHE_ENABLED and content:
+        try:
+            response_cache.set(key, content)
+        except Exception:
+            log.exception("[LLM CACHE] write failed")
+
+
+def _settle(reserved: int, usage):
+    if reserved and usage:
+        _settle_tokens(reserved, usage.total_tokens)
+
+
+def _settle_tokens(reserved: int, tokens: int):
+    try:
+        limiter.settle(reserved, tokens)
+    except Exception:
+        log.exception("[LIMITER] settle failed")
+
+
+class StreamCancelled(RuntimeError):
+    """Споживач stream_sections перестав читати; не збій OpenAI, тож breaker його не рахує."""
+
+
+def _with_retries(call, timeout: float, mode: str, can_retry=None):
+    """call(remaining_timeout) з breaker-ом і повторами транзитних помилок у межах timeout.
+
+    Повтор — після паузи з повним джитером (breaker.backoff) і лише якщо вона вкладається
+    в залишок часу; CircuitOpen, локальний RateLimited і помилки авторизації не повторюються.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        breaker.allow(trial_seconds=timeout)
+        try:
+            result = call(max(1.0, deadline - time.monotonic()))
+        except Exception as e:
+            breaker.record(e)
+            delay = breaker_mod.backoff(attempt)
+            if (attempt >= breaker_mod.RETRIES or not breaker_mod.is_transient(e)
+                    or (can_retry is not None and not can_retry())
+                    or time.monotonic() + delay >= deadline):
+                raise
+            attempt += 1
+            metrics.OPENAI_RETRIES.labels(mode).inc()
+            log.warning("[OPENAI] retry attempt=%s delay=%.2fs err=%s", attempt, delay, e)
+            time.sleep(delay)
+            continue
+        breaker.record()
+        return result
+
+
+def complete(client, prompt: str, timeout: float = SECTION_TIMEOUT, lane: str = "free") -> str:
+    """Один chat completion → очищений текст відповіді (з кешем, якщо увімкнено).
+
+    lane — смуга пріоритету лімітера: "pro" або "free".
+    """
+    key = cache_key(prompt, temperature=OPENAI_TEMPERATURE)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    def call(remaining):
+        started = time.perf_counter()
+        reserved = 0
+        try:
+            reserved = _acquire(prompt, lane, remaining)
+            completion = client.with_options(timeout=remaining).chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=OPENAI_TEMPERATURE,
+            )
+        except Exception as e:
+            metrics.observe_llm_call("complete", lane, time.perf_counter() - started, error=e)
+            # Резерв невдалої спроби повертаємо, інакше повтори під 429 з'їдають спільний TPM
+            if reserved:
+                _settle_tokens(reserved, 0)
+            raise
+        metrics.observe_llm_call("complete", lane, time.perf_counter() - started, completion.usage)
+        return reserved, completion
+
+    reserved, completion = _with_retries(call, timeout, "complete")
+    content = completion.choices[0].message.content.strip()
+    _settle(reserved, completion.usage)
+    _cache_set(key, content)
+    return content
+
+
+def stream_complete(client, prompt: str, on_delta, timeout: float = SECTION_TIMEOUT, lane: str = "free") -> str:
+    """Як complete(), але з stream=True: кожен шматок тексту одразу йде в on_delta(text).
+
+    Відповідь з кешу повертається цілою, без on_delta. Виняток з on_delta обриває потік.
+    """
+    key = cache_key(prompt, temperature=OPENAI_TEMPERATURE)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    parts = []
+
+    def call(remaining):
+        started = time.perf_counter()
+        usage, reserved, received = None, 0, len(parts)
+        try:
+            reserved = _acquire(prompt, lane, remaining)
+            # timeout для потоку — на з'єднання і кожне читання, а не на всю відповідь
+            stream = client.with_options(timeout=remaining).chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=OPENAI_TEMPERATURE,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            try:
+                for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        on_delta(parts[-1])
+            finally:
+                stream.close()
+        except Exception as e:
+            metrics.observe_llm_call("stream", lane, time.perf_counter() - started, usage, error=e)
+            # Як у complete(); спроба, що вже віддала текст, токени справді витратила — резерв лишається
+            if reserved and len(parts) == received:
+                _settle_tokens(reserved, 0)
+            raise
+        metrics.observe_llm_call("stream", lane, time.perf_counter() - started, usage)
+        return reserved, usage
+
+    # Повтор лише до першого шматка: показану частину відповіді він продублював би
+    reserved, usage = _with_retries(call, timeout, "stream", can_retry=lambda: not parts)
+
+    content = "".join(parts).strip()
+    _settle(reserved, usage)
+    _cache_set(key, content)
+    return content
+
+
+def run_sections(client, prompts: dict, timeout: float = SECTION_TIMEOUT, lane: str = "free"):
+    """Запускає незалежні промпти паралельно.
+
+    Повертає (results, errors): name → HTML для успішних секцій і name → виняток для тих,
+    що впали або не вклались у таймаут. Секції одна одну не блокують.
+    """
+    deadline = time.monotonic() + timeout
+    futures = {
+        name: _executor.submit(complete, client, prompt, timeout, lane)
+        for name, prompt in prompts.items()
+    }
+
+    results, errors = {}, {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            errors[name] = TimeoutError(f"openai timeout: section={name} after {timeout:.0f}s")
+        except Exception as e:
+            errors[name] = e
+    return results, errors
+
+
+def stream_sections(client, prompts: dict, timeout: float = SECTION_TIMEOUT, lane: str = "free"):
+    """Потокова версія run_sections: генератор подій у порядку надходження токенів.
+
+    Події: ("delta", name, text), ("done", name, html), ("error", name, exc). Якщо споживач
+    перестав читати (клієнт закрив з'єднання) або вийшов час, незавершені виклики обриваються.
+    """
+    deadline = time.monotonic() + timeout
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    def run(name, prompt):
+        def on_delta(text):
+            if cancelled.is_set():
+                raise StreamCancelled(f"openai stream cancelled: section={name}")
+            events.put(("delta", name, text))
+
+        try:
+            events.put(("done", name, stream_complete(client, prompt, on_delta, timeout, lane)))
+        except Exception as e:
+            events.put(("error", name, e))
+
+    for name, prompt in prompts.items():
+        _executor.submit(run, name, prompt)
+
+    pending = set(prompts)
+    try:
+        while pending:
+            try:
+                kind, name, payload = events.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                for name in sorted(pending):
+                    yield "error", name, TimeoutError(f"openai timeout: section={name} after {timeout:.0f}s")
+                return
+            if kind != "delta":
+                pending.discard(name)
+            yield kind, name, payload
+    finally:
+        cancelled.set()
+
+
+def unavailable_section(title: str) -> str:
+    """HTML-заглушка для необов'язкової секції, що не згенерувалась."""
+    return (
+        f"<h2>{title}</h2>"
+        "<p>This section could not be generated right now. "
+        "Re-upload the file later to get the full report.</p>"
+    )
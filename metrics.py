@@ -0,0 +1,101 @@
+"""Метрики Prometheus: час етапів пайплайна звіту, виклики OpenAI, запити в роботі.
+
+Гістограми етапів (upload_read, csv_parse, prompt_build, template_render, pdf_render,
+file_write, db_commit, rollup_update), час і токени кожного LLM-виклику, класи помилок OpenAI і HTTP-запити
+по ендпоінтах. Віддаються на /metrics.
+
+gunicorn і worker.py — різні процеси, тож для спільних метрик задайте PROMETHEUS_MULTIPROC_DIR
+(порожня директорія, яку очищають перед стартом; див. gunicorn.conf.py) — тоді /metrics
+будь-якого воркера агрегує всі процеси. Без неї кожен процес віддає лише власні лічильники.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Від мілісекунд (кеш, коміт) до хвилин (OpenAI, map-reduce)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "restgenius_stage_seconds", "Duration of report pipeline stages", ["stage"], buckets=STAGE_BUCKETS,
+)
+LLM_CALL_SECONDS = Histogram(
+    "restgenius_llm_call_seconds", "Duration of one OpenAI chat completion (incl. limiter wait)",
+    ["mode", "lane", "outcome"], buckets=STAGE_BUCKETS,
+)
+LLM_TOKENS = Counter("restgenius_llm_tokens_total", "OpenAI tokens by kind", ["kind", "lane"])
+LLM_CACHE = Counter("restgenius_llm_cache_total", "LLM response cache lookups", ["result"])
+OPENAI_ERRORS = Counter("restgenius_openai_errors_total", "OpenAI call failures by error class", ["error"])
+OPENAI_RETRIES = Counter("restgenius_openai_retries_total", "OpenAI calls retried after transient errors", ["mode"])
+REPORT_ERRORS = Counter("restgenius_report_errors_total", "Failed reports by toast code", ["code"])
+
+REQUEST_SECONDS = Histogram(
+    "restgenius_request_seconds", "HTTP request duration", ["endpoint", "method", "status"],
+    buckets=STAGE_BUCKETS,
+)
+IN_PROGRESS = Gauge(
+    "restgenius_requests_in_progress", "HTTP requests in progress", ["endpoint"], multiprocess_mode="livesum",
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Вимірює блок як етап пайплайна: `with metrics.stage("pdf_render"): ...`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def openai_error_class(e: Exception) -> str:
+    """Виняток виклику OpenAI → коротка мітка для лічильника помилок."""
+    import openai
+    import breaker
+    import ratelimit
+
+    if isinstance(e, ratelimit.RateLimited):
+        return "local_rate_limit"
+    if isinstance(e, breaker.CircuitOpen):
+        return "circuit_open"
+    if isinstance(e, openai.RateLimitError):
+        return "rate_limit"
+    if isinstance(e, openai.AuthenticationError):
+        return "auth"
+    if isinstance(e, (openai.APITimeoutError, TimeoutError)):
+        return "timeout"
+    if isinstance(e, openai.APIConnectionError):
+        return "connection"
+    if isinstance(e, openai.APIStatusError):
+        return f"http_{e.status_code // 100}xx"
+    return "other"
+
+
+def observe_llm_call(mode: str, lane: str, seconds: float, usage=None, error: Exception = None):
+    LLM_CALL_SECONDS.labels(mode, lane, "error" if error else "ok").observe(seconds)
+    if error is not None:
+        OPENAI_ERRORS.labels(openai_error_class(error)).inc()
+    if usage is not None:
+        LLM_TOKENS.labels("prompt", lane).inc(usage.prompt_tokens or 0)
+        LLM_TOKENS.labels("completion", lane).inc(usage.completion_tokens or 0)
+
+
+def exposition():
+    """→ (body, content_type) для /metrics."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Прибирає live-gauge мертвого процесу (gunicorn child_exit, перезапуск у worker.py)."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
 
 db = SQLAlchemy()
 
@@ -22,7 +24,115 @@ class User(UserMixin, db.Model):
 
 
 class Report(db.Model):
+    # Індекси під реальні запити: історія/останній звіт (user_id, created_at, id),
+    # завантаження/перегляд (user_id, filename)
+    __table_args__ = (
+        db.Index("ix_report_user_created", "user_id", "created_at", "id"),
+        db.Index("ix_report_user_filename", "user_id", "filename"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Що це за звіт у пакеті закладів: "Batch", "Comparison" або назва закладу; None — звичайний звіт
+    label = db.Column(db.String(255))
+
+    @property
+    def display_name(self) -> str:
+        """Ім'я файлу для користувача; filename — ключ у сховищі (див. storage.py)."""
+        if "/" not in self.filename:
+            return self.filename  # старі звіти з плоскими іменами
+        ext = self.filename.rsplit("/", 1)[-1].split(".", 1)[1].removesuffix(".gz")
+        stamp = (self.created_at or datetime.utcnow()).strftime("%Y-%m-%d_%H-%M-%S")
+        if self.label:
+            # Назви закладів — з імен файлів користувача: без символів, заборонених у Windows
+            label = "".join("_" if c in '\\/:*?"<>|' or ord(c) < 32 else c for c in self.label)
+            return f"report_{stamp}_{label.replace(' ', '_')}.{ext}"
+        return f"report_{stamp}.{ext}"
+
+
+class ReportJob(db.Model):
+    """Задача генерації звіту в персистентній черзі (див. jobs.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+
+    # queued → running → done | failed
+    status = db.Column(db.String(16), nullable=False, default="queued", index=True)
+    upload_path = db.Column(db.String(255), nullable=False)  # CSV у спул-директорії
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker_id = db.Column(db.String(64))
+    error = db.Column(db.String(64))  # код toast-кукі (rg_err_*) для дашборду
+
+    report_id = db.Column(db.Integer, db.ForeignKey('report.id'))
+    report = db.relationship('Report')
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class EmailOutbox(db.Model):
+    """Лист у черзі на відправку (див. outbox.py); комітиться разом із рештою змін запиту."""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html = db.Column(db.Text, nullable=False)
+
+    # pending → sending → sent | failed (після вичерпання спроб)
+    status = db.Column(db.String(16), nullable=False, default="pending", index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+
+class SalesRecord(db.Model):
+    """Продажі користувача, згорнуті до (день, товар); новіший аплоад перезаписує той самий ключ."""
+    __table_args__ = (
+        db.UniqueConstraint("user_id", "day", "item", name="uq_sales_user_day_item"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    item = db.Column(db.String(255), nullable=False)
+    category = db.Column(db.String(255))
+    qty = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SalesSnapshot(db.Model):
+    """Що вже проаналізовано для користувача: період історії і стислий підсумок останнього звіту."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    period_start = db.Column(db.Date)
+    period_end = db.Column(db.Date)
+    summary = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def ensure_columns():
+    """Додає nullable-колонки, яких бракує в уже існуючих таблицях (create_all їх не додає)."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def ensure_indexes():
+    """Створює індекси, яких бракує в уже існуючих таблицях (create_all їх не додає)."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,161 @@
+"""Outbox для листів: ендпоінти лише додають EmailOutbox, відправляє фоновий sender.
+
+Sender тримає SMTP-з'єднання відкритим між пачками (без connect/TLS/login на кожен лист),
+шле листи пачками і повторює невдалі з експоненційним backoff. Для локальних тестів
+MAIL_SERVER/MAIL_PORT/MAIL_USE_TLS можна направити на SMTP-заглушку, напр.
+`python -m aiosmtpd -n -l localhost:1025` з MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0.
+"""
+import os
+import random
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from sqlalchemy import update, select
+
+from models import db, EmailOutbox
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE_SECONDS", "30"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+# Скільки тримати простоюче SMTP-з'єднання, і коли вважати 'sending' завислим після падіння
+OUTBOX_SMTP_IDLE_SECONDS = float(os.getenv("OUTBOX_SMTP_IDLE_SECONDS", "60"))
+OUTBOX_STALE_SECONDS = float(os.getenv("OUTBOX_STALE_SECONDS", "300"))
+
+
+def enqueue(recipient: str, subject: str, html: str) -> EmailOutbox:
+    """Додає лист у сесію; коміт — разом зі змінами запиту."""
+    email = EmailOutbox(recipient=recipient, subject=subject, html=html)
+    db.session.add(email)
+    return email
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_batch(limit: int = OUTBOX_BATCH_SIZE) -> list:
+    """Атомарно забирає до limit листів, яким настав час відправки."""
+    now = datetime.utcnow()
+    # Листи, що застрягли в 'sending' (sender помер посеред пачки) — знову в роботу
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.status == "sending",
+               EmailOutbox.claimed_at < now - timedelta(seconds=OUTBOX_STALE_SECONDS))
+        .values(status="pending")
+        .execution_options(synchronize_session=False)
+    )
+    ids = db.session.execute(
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+    ).scalars().all()
+
+    claimed = []
+    for email_id in ids:
+        rowcount = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id == email_id, EmailOutbox.status == "pending")
+            .values(status="sending", claimed_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if rowcount:
+            claimed.append(email_id)
+    db.session.commit()
+    return [db.session.get(EmailOutbox, email_id) for email_id in claimed]
+
+
+class OutboxSender:
+    """Відправник з одним довгоживучим SMTP-з'єднанням на процес."""
+
+    def __init__(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self._conn = None
+        self._last_used = 0.0
+
+    def _connection(self):
+        if self._conn is not None and time.monotonic() - self._last_used > OUTBOX_SMTP_IDLE_SECONDS:
+            self.close()
+        if self._conn is None:
+            conn = self.mail.connect()
+            conn.__enter__()  # connect + STARTTLS + login — один раз на багато листів
+            self._conn = conn
+            self._last_used = time.monotonic()
+        return self._conn
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.__exit__(None, None, None)
+            except Exception:
+                pass
+
+    def send_batch(self) -> int:
+        """Відправляє одну пачку; повертає кількість відправлених листів."""
+        batch = claim_batch()
+        if not batch:
+            return 0
+
+        sender = self.app.config["MAIL_DEFAULT_SENDER"]
+        sent = 0
+        for email in batch:
+            try:
+                conn = self._connection()
+                conn.send(Message(email.subject, sender=sender, recipients=[email.recipient], html=email.html))
+                self._last_used = time.monotonic()
+                email.status, email.sent_at, email.last_error = "sent", datetime.utcnow(), None
+                sent += 1
+            except Exception as e:
+                # Обірване з'єднання не лікується повтором на ньому ж; відмова сервера
+                # на конкретний лист (4xx/5xx, SMTPException — теж OSError) з'єднання не псує
+                if isinstance(e, smtplib.SMTPServerDisconnected) or not isinstance(e, smtplib.SMTPException):
+                    self.close()
+                email.attempts += 1
+                email.last_error = str(e)[:255]
+                if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    email.status = "failed"
+                    self.app.logger.error("[MAIL] giving up id=%s to=%s err=%s", email.id, email.recipient, e)
+                else:
+                    email.status = "pending"
+                    email.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff_seconds(email.attempts))
+                    self.app.logger.warning("[MAIL] send failed id=%s attempt=%s err=%s", email.id, email.attempts, e)
+            # Статус кожного листа фіксуємо одразу: падіння sender-а не призведе до повторної відправки
+            db.session.commit()
+        self.app.logger.info("[MAIL] batch sent=%s of %s", sent, len(batch))
+        return sent
+
+
+def run_sender(app, mail, stop_event=None):
+    """Цикл sender-а: пачка за пачкою, поки є листи; далі — опитування раз на OUTBOX_POLL_SECONDS."""
+    stop_event = stop_event or threading.Event()
+    sender = OutboxSender(app, mail)
+    app.logger.info("[MAIL] outbox sender started pid=%s", os.getpid())
+    try:
+        while not stop_event.is_set():
+            try:
+                with app.app_context():
+                    if sender.send_batch():
+                        continue
+            except Exception:
+                app.logger.exception("[MAIL] outbox loop error")
+                sender.close()
+            stop_event.wait(OUTBOX_POLL_SECONDS)
+            if sender._conn is not None and time.monotonic() - sender._last_used > OUTBOX_SMTP_IDLE_SECONDS:
+                sender.close()
+    finally:
+        sender.close()
+
+
+def start_thread_sender(app, mail) -> threading.Event:
+    """Вбудований sender у потоці — для локального `python app.py`."""
+    stop_event = threading.Event()
+    threading.Thread(target=run_sender, args=(app, mail, stop_event), daemon=True, name="outbox-sender").start()
+    return stop_event
@@ -0,0 +1,154 @@
+"""Рендер PDF через фіксований пул воркерів із чергою, таймаутами і дедуплікацією.
+
+wkhtmltopdf не має резидентного режиму, тож кожен рендер — окремий процес; пул тримає
+довгоживучі потоки з один раз визначеним шляхом до бінарника (pdfkit інакше запускає `which`
+на кожен звіт), обмежує кількість одночасних wkhtmltopdf і чергу, вбиває рендер за таймаутом
+і не рендерить двічі той самий HTML (звіти з кешу OpenAI дають ідентичний HTML).
+"""
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+
+import pdfkit
+
+log = logging.getLogger("restgenius.pdf")
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_QUEUE_SIZE = int(os.getenv("PDF_QUEUE_SIZE", "8"))
+PDF_TIMEOUT = float(os.getenv("PDF_TIMEOUT_SECONDS", "30"))
+# Скільки викликач чекає результат (черга + рендер), перш ніж піти в HTML fallback
+PDF_WAIT_SECONDS = float(os.getenv("PDF_WAIT_SECONDS", "60"))
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join("cache", "pdf"))
+PDF_CACHE_TTL = float(os.getenv("PDF_CACHE_TTL_HOURS", "24")) * 3600
+
+REPORT_OPTIONS = {
+    "encoding": "UTF-8",
+    "page-size": "A4",
+    "margin-top": "10mm",
+    "margin-right": "10mm",
+    "margin-bottom": "12mm",
+    "margin-left": "10mm",
+    "quiet": None,
+    # опційно: нумерація сторінок (wkhtmltopdf)
+    "footer-right": "[page]/[toPage]",
+    "footer-font-size": "9",
+    "footer-spacing": "4",
+}
+
+
+class PdfUnavailable(RuntimeError):
+    """Пул переповнений або wkhtmltopdf недоступний — викликач віддає HTML fallback."""
+
+
+class PdfRenderer:
+    def __init__(self, workers: int = PDF_WORKERS, queue_size: int = PDF_QUEUE_SIZE,
+                 timeout: float = PDF_TIMEOUT, cache_dir: str = PDF_CACHE_DIR):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._config = None
+        self._next_sweep = 0.0
+
+    def _ensure_started(self):
+        # Потоки не переживають fork (gunicorn --preload) — піднімаємо пул у кожному процесі
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            path = os.getenv("WKHTMLTOPDF_PATH") or shutil.which("wkhtmltopdf")
+            self._config = pdfkit.configuration(wkhtmltopdf=path) if path else None
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._inflight = {}
+            for i in range(self.workers):
+                threading.Thread(target=self._worker, daemon=True, name=f"pdf-render-{i}").start()
+            self._pid = os.getpid()
+            if not path:
+                log.warning("[PDF] wkhtmltopdf not found; reports fall back to HTML")
+
+    def render(self, html: str, out_path: str, options: dict = None, wait: float = PDF_WAIT_SECONDS):
+        """Рендерить html у out_path; кидає PdfUnavailable при переповненні/відсутності рушія."""
+        self._ensure_started()
+        if self._config is None:
+            raise PdfUnavailable("wkhtmltopdf is not installed")
+
+        options = REPORT_OPTIONS if options is None else options
+        key = hashlib.sha256(
+            (json.dumps(options, sort_keys=True) + "\0" + html).encode("utf-8")
+        ).hexdigest()
+        cached = os.path.join(self.cache_dir, f"{key}.pdf")
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                if os.path.isfile(cached):
+                    shutil.copyfile(cached, out_path)
+                    return out_path
+                future = Future()
+                try:
+                    self._queue.put_nowait((key, html, options, cached, future))
+                except queue.Full:
+                    raise PdfUnavailable("pdf render queue is full")
+                self._inflight[key] = future
+
+        try:
+            future.result(timeout=wait)
+        except TimeoutError:
+            raise PdfUnavailable(f"pdf render did not finish in {wait:.0f}s")
+        shutil.copyfile(cached, out_path)
+        return out_path
+
+    def _worker(self):
+        while True:
+            key, html, options, cached, future = self._queue.get()
+            try:
+                self._render(html, options, cached)
+                future.set_result(cached)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+                self._queue.task_done()
+                self._sweep()
+
+    def _render(self, html: str, options: dict, out_path: str):
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        cmd = pdfkit.PDFKit(html, "string", options=options, configuration=self._config).command(tmp_path)
+        started = time.monotonic()
+        try:
+            # subprocess.run сам вбиває wkhtmltopdf, якщо той завис довше за таймаут
+            proc = subprocess.run(cmd, input=html.encode("utf-8"), capture_output=True, timeout=self.timeout)
+            if proc.returncode != 0 or not os.path.isfile(tmp_path):
+                raise RuntimeError(f"wkhtmltopdf exit={proc.returncode}: {proc.stderr.decode('utf-8', 'replace')[-500:]}")
+            os.replace(tmp_path, out_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        log.info("[PDF] rendered in %.2fs", time.monotonic() - started)
+
+    def _sweep(self):
+        """Чистить кеш відрендерених PDF, старших за PDF_CACHE_TTL (не частіше разу на хвилину)."""
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + 60
+        try:
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and now - entry.stat().st_mtime > PDF_CACHE_TTL:
+                    os.remove(entry.path)
+        except OSError:
+            log.exception("[PDF] cache sweep failed")
+
+
+renderer = PdfRenderer()
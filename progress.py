@@ -0,0 +1,84 @@
+"""Канал прогресу задач черги: воркер публікує події звіту, /analyze/stream їх читає.
+
+Окремий SQLite-файл (як лімітер і breaker), а не основна БД: дрібні часті записи дельт
+не конкурують за write-lock з реєстрацією, heartbeat-ами і claim_next. Дельти секцій
+склеюються і пишуться не частіше ніж раз на PROGRESS_FLUSH_SECONDS; події живуть
+PROGRESS_TTL_SECONDS — достатньо, щоб дочитати їх після завершення задачі.
+"""
+import json
+import os
+import time
+
+from cache import SqliteStore
+
+PROGRESS_PATH = os.getenv("PROGRESS_PATH", os.path.join("cache", "progress.db"))
+PROGRESS_FLUSH_SECONDS = float(os.getenv("PROGRESS_FLUSH_SECONDS", "0.25"))
+PROGRESS_TTL_SECONDS = float(os.getenv("PROGRESS_TTL_SECONDS", "900"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_events_job ON events (job_id, seq);
+"""
+
+# Події, після яких задача більше нічого не публікує
+TERMINAL_EVENTS = ("done", "error")
+
+
+class ProgressChannel(SqliteStore):
+    schema = _SCHEMA
+
+    def publish(self, job_id: int, event: str, data: dict):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute(
+                "INSERT INTO events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, event, json.dumps(data), now),
+            )
+            if event in TERMINAL_EVENTS:
+                # Прибирання — раз на задачу, а не на кожну дельту
+                conn.execute("DELETE FROM events WHERE created_at < ?", (now - PROGRESS_TTL_SECONDS,))
+
+    def read(self, job_id: int, after: int = 0) -> list:
+        """Події задачі після seq=after → [(seq, event, data)]."""
+        rows = self._conn().execute(
+            "SELECT seq, event, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, after)
+        ).fetchall()
+        return [(seq, event, json.loads(data)) for seq, event, data in rows]
+
+    def writer(self, job_id: int) -> "ProgressWriter":
+        return ProgressWriter(self, job_id)
+
+
+class ProgressWriter:
+    """Публікатор однієї задачі: дельти буферизує, решту подій пише одразу (після дельт)."""
+
+    def __init__(self, channel: ProgressChannel, job_id: int):
+        self.channel = channel
+        self.job_id = job_id
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+
+    def delta(self, section: str, text: str):
+        self._pending[section] = self._pending.get(section, "") + text
+        if time.monotonic() - self._flushed_at >= PROGRESS_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        for section, text in self._pending.items():
+            self.channel.publish(self.job_id, "delta", {"section": section, "text": text})
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+
+    def __call__(self, event: str, data: dict):
+        self.flush()
+        self.channel.publish(self.job_id, event, data)
+
+
+channel = ProgressChannel(PROGRESS_PATH)
@@ -0,0 +1,191 @@
+"""Спільний для всіх процесів token-bucket перед викликами OpenAI (RPM і TPM).
+
+Перед кожним викликом оцінюємо токени промпту і резервуємо їх у двох відрах у SQLite-файлі;
+якщо ємності немає — чекаємо в черзі своєї смуги (pro/free) або відкидаємо запит ще до
+відправки. PRO має резерв ємності і пріоритет: free-запити поступаються, поки PRO чекає.
+"""
+import os
+import random
+import time
+
+from cache import SqliteStore
+
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "160000"))
+
+# Частка ємності, яку free-смуга не може зайняти (лишається для PRO)
+PRO_RESERVE = float(os.getenv("OPENAI_PRO_RESERVE", "0.2"))
+# Скільки запит чекає в черзі, перш ніж його відкинуть (сек)
+MAX_WAIT = {
+    "pro": float(os.getenv("OPENAI_PRO_MAX_WAIT", "30")),
+    "free": float(os.getenv("OPENAI_FREE_MAX_WAIT", "10")),
+}
+# Очікувана довжина відповіді для оцінки TPM, поки не прийшов фактичний usage
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("OPENAI_EXPECTED_COMPLETION_TOKENS", "700"))
+
+LANES = ("pro", "free")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lane TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class RateLimited(RuntimeError):
+    """Запит відкинуто до відправки; текст містить 'rate limit' для toast rg_err_rate."""
+
+
+def estimate_tokens(prompt: str) -> int:
+    """Груба оцінка без токенізатора: ~4 символи на токен + очікувана відповідь."""
+    return len(prompt) // 4 + EXPECTED_COMPLETION_TOKENS
+
+
+class RateLimiter(SqliteStore):
+    schema = _SCHEMA
+
+    def __init__(self, path: str, rpm: float = OPENAI_RPM, tpm: float = OPENAI_TPM):
+        super().__init__(path)
+        self.capacity = {"rpm": rpm, "tpm": tpm}
+
+    def _incr(self, conn, name: str, by: int = 1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, by),
+        )
+
+    def _levels(self, conn, now: float) -> dict:
+        levels = {}
+        for name, capacity in self.capacity.items():
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            # Поповнення пропорційно часу: capacity за 60 секунд
+            levels[name] = min(capacity, tokens + (now - updated_at) * capacity / 60.0)
+        return levels
+
+    def _save(self, conn, levels: dict, now: float):
+        for name, tokens in levels.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (name, tokens, now),
+            )
+
+    def _try_take(self, lane: str, tokens: int, waiter_id: int):
+        """Одна атомарна спроба. Повертає 0 при успіху або скільки секунд варто почекати."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = self._levels(conn, now)
+            need = {"rpm": 1, "tpm": tokens}
+            floor = 0.0 if lane == "pro" else PRO_RESERVE
+
+            pro_waiting = lane == "free" and conn.execute(
+                "SELECT COUNT(*) FROM waiters WHERE lane = 'pro' AND expires_at > ?", (now,)
+            ).fetchone()[0]
+
+            fits = all(levels[n] - need[n] >= floor * self.capacity[n] for n in need)
+            if fits and not pro_waiting:
+                for n in need:
+                    levels[n] -= need[n]
+                self._save(conn, levels, now)
+                self._incr(conn, f"admitted_{lane}")
+                if waiter_id:
+                    conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                conn.commit()
+                return 0.0, waiter_id
+
+            if not waiter_id:
+                cur = conn.execute(
+                    "INSERT INTO waiters (lane, expires_at) VALUES (?, ?)", (lane, now + MAX_WAIT[lane])
+                )
+                waiter_id = cur.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        # Час до поповнення найдефіцитнішого відра
+        deficits = [
+            (need[n] + floor * self.capacity[n] - levels[n]) * 60.0 / self.capacity[n]
+            for n in need
+        ]
+        return max(0.05, max(deficits)), waiter_id
+
+    def acquire(self, prompt_tokens: int, lane: str = "free", max_wait: float = None):
+        """Резервує 1 запит і prompt_tokens токенів; чекає до max_wait, далі — RateLimited."""
+        lane = lane if lane in LANES else "free"
+        max_wait = MAX_WAIT[lane] if max_wait is None else min(max_wait, MAX_WAIT[lane])
+        # Запит, більший за всю хвилинну ємність, не пройде ніколи — не тримаємо його в черзі
+        tokens = min(prompt_tokens, int(self.capacity["tpm"] * (1 - PRO_RESERVE)))
+        deadline = time.monotonic() + max_wait
+        waiter_id = None
+        try:
+            while True:
+                wait, waiter_id = self._try_take(lane, tokens, waiter_id)
+                if wait == 0.0:
+                    waiter_id = None
+                    return tokens
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._count(f"shed_{lane}")
+                    raise RateLimited(f"openai rate limit: local {lane} queue wait exceeded {max_wait:.0f}s")
+                # Джитер, щоб воркери не прокидались хором
+                time.sleep(min(remaining, wait, 1.0) * random.uniform(0.5, 1.0))
+        finally:
+            if waiter_id:
+                conn = self._conn()
+                with conn:
+                    conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def settle(self, reserved_tokens: int, actual_tokens: int):
+        """Коригує TPM-відро на різницю між оцінкою і фактичним usage відповіді."""
+        delta = reserved_tokens - actual_tokens
+        if not delta:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = self._levels(conn, now)
+            levels["tpm"] = min(self.capacity["tpm"], levels["tpm"] + delta)
+            self._save(conn, levels, now)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _count(self, name: str):
+        conn = self._conn()
+        with conn:
+            self._incr(conn, name)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        now = time.time()
+        levels = self._levels(conn, now)
+        waiting = dict(conn.execute(
+            "SELECT lane, COUNT(*) FROM waiters WHERE expires_at > ? GROUP BY lane", (now,)
+        ).fetchall())
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        return {
+            "rpm_capacity": self.capacity["rpm"],
+            "tpm_capacity": self.capacity["tpm"],
+            "rpm_available": round(levels["rpm"], 1),
+            "tpm_available": round(levels["tpm"]),
+            "queue_depth": {lane: waiting.get(lane, 0) for lane in LANES},
+            "admitted": {lane: counters.get(f"admitted_{lane}", 0) for lane in LANES},
+            "shed": {lane: counters.get(f"shed_{lane}", 0) for lane in LANES},
+        }
@@ -0,0 +1,206 @@
+"""Компактне колонкове сховище продажів користувача з готовими зведеннями для графіків дашборду.
+
+Один файл на користувача (ROLLUP_DIR/<user_id>.rollup): заголовок, далі колонки float64 —
+денні виторг і кількість, тижневі виторг і кількість — і JSON зі зведенням по категоріях.
+Читання — через mmap лише потрібного вікна, без БД, тож /api/trends відповідає за мілісекунди.
+
+Файл похідний від SalesRecord (sales_history.py): після коміту аплоаду refresh() перераховує
+лише змінені дні й тижні, а відсутній або зіпсований файл перебудовується з БД цілком.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+from datetime import date, timedelta
+
+from sqlalchemy import func, select
+
+from models import db, SalesRecord
+
+ROLLUP_DIR = os.getenv("ROLLUP_DIR", os.path.join("cache", "rollups"))
+
+# magic, версія, перший день (ordinal), к-сть днів, перший понеділок (ordinal), к-сть тижнів, довжина JSON
+_HEADER = struct.Struct("<4sHxxiIiII")
+_MAGIC = b"RGRU"
+_VERSION = 1
+_F8 = 8
+
+
+class Rollup:
+    """Зведення одного користувача: колонки як масиви float (у пам'яті або memoryview над mmap)."""
+
+    def __init__(self, first_day: int, daily_revenue, daily_qty, first_monday: int,
+                 weekly_revenue, weekly_qty, categories: dict):
+        self.first_day = first_day
+        self.daily_revenue = daily_revenue
+        self.daily_qty = daily_qty
+        self.first_monday = first_monday
+        self.weekly_revenue = weekly_revenue
+        self.weekly_qty = weekly_qty
+        self.categories = categories
+
+    @property
+    def last_day(self) -> int:
+        return self.first_day + len(self.daily_revenue) - 1
+
+    def series(self, granularity: str, start: date = None, end: date = None) -> list:
+        """Точки [(дата, виторг, кількість)] за день або тиждень у межах [start, end]."""
+        if granularity == "week":
+            base, step, revenue, qty = self.first_monday, 7, self.weekly_revenue, self.weekly_qty
+        else:
+            base, step, revenue, qty = self.first_day, 1, self.daily_revenue, self.daily_qty
+        lo = 0 if start is None else max(0, (start.toordinal() - base) // step)
+        hi = len(revenue) - 1 if end is None else min(len(revenue) - 1, (end.toordinal() - base) // step)
+        return [
+            (date.fromordinal(base + i * step), revenue[i], qty[i])
+            for i in range(lo, hi + 1)
+        ]
+
+
+def _path(user_id: int) -> str:
+    return os.path.join(ROLLUP_DIR, f"{user_id}.rollup")
+
+
+def _monday(ordinal: int) -> int:
+    return ordinal - date.fromordinal(ordinal).weekday()
+
+
+def load(user_id: int):
+    """Rollup над mmap файлу або None, якщо файлу немає чи він іншого формату.
+
+    Колонки — memoryview над відображенням: з диска читаються лише сторінки запитаного вікна.
+    """
+    try:
+        with open(_path(user_id), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+    if len(mapped) < _HEADER.size:
+        return None
+    magic, version, first_day, n_days, first_monday, n_weeks, json_len = _HEADER.unpack_from(mapped, 0)
+    if magic != _MAGIC or version != _VERSION:
+        return None
+
+    view = memoryview(mapped)
+    offset = _HEADER.size
+
+    def column(n):
+        nonlocal offset
+        col = view[offset:offset + n * _F8].cast("d")
+        offset += n * _F8
+        return col
+
+    daily_revenue, daily_qty = column(n_days), column(n_days)
+    weekly_revenue, weekly_qty = column(n_weeks), column(n_weeks)
+    categories = json.loads(bytes(view[offset:offset + json_len]).decode("utf-8"))
+    return Rollup(first_day, daily_revenue, daily_qty, first_monday, weekly_revenue, weekly_qty, categories)
+
+
+def _write(user_id: int, rollup: Rollup):
+    """Атомарно замінює файл: читачі з mmap старої версії дочитують її без змін."""
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    cats = json.dumps(rollup.categories, sort_keys=True).encode("utf-8")
+    path = _path(user_id)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, rollup.first_day, len(rollup.daily_revenue),
+                             rollup.first_monday, len(rollup.weekly_revenue), len(cats)))
+        for col in (rollup.daily_revenue, rollup.daily_qty, rollup.weekly_revenue, rollup.weekly_qty):
+            f.write(struct.pack(f"<{len(col)}d", *col))
+        f.write(cats)
+    os.replace(tmp, path)
+
+
+def _daily_from_db(user_id: int, day_from: date, day_to: date) -> dict:
+    rows = db.session.execute(
+        select(SalesRecord.day, func.sum(SalesRecord.revenue), func.sum(SalesRecord.qty))
+        .where(SalesRecord.user_id == user_id, SalesRecord.day >= day_from, SalesRecord.day <= day_to)
+        .group_by(SalesRecord.day)
+    )
+    return {day.toordinal(): (revenue or 0.0, qty or 0.0) for day, revenue, qty in rows}
+
+
+def _categories_from_db(user_id: int) -> dict:
+    rows = db.session.execute(
+        select(SalesRecord.category, func.sum(SalesRecord.revenue), func.sum(SalesRecord.qty))
+        .where(SalesRecord.user_id == user_id)
+        .group_by(SalesRecord.category)
+    )
+    return {category or "(uncategorized)": [revenue or 0.0, qty or 0.0] for category, revenue, qty in rows}
+
+
+def refresh(user_id: int, day_from: date = None, day_to: date = None):
+    """Перераховує дні [day_from, day_to] і їхні тижні з БД; без меж або без файлу — усе.
+
+    Викликати після коміту SalesRecord. Паралельні оновлення одного користувача серіалізує flock.
+    """
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    with open(_path(user_id) + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _refresh_locked(user_id, day_from, day_to)
+
+
+def _refresh_locked(user_id: int, day_from, day_to):
+    current = load(user_id)
+    bounds = db.session.execute(
+        select(func.min(SalesRecord.day), func.max(SalesRecord.day)).where(SalesRecord.user_id == user_id)
+    ).first()
+    if not bounds or bounds[0] is None:
+        return
+    first, last = bounds[0].toordinal(), bounds[1].toordinal()
+
+    if current is None or day_from is None or day_to is None:
+        day_from, day_to = bounds
+        daily_revenue, daily_qty = [0.0] * (last - first + 1), [0.0] * (last - first + 1)
+    else:
+        # Копія старих колонок, розширена до нових меж історії
+        first = min(first, current.first_day)
+        last = max(last, current.last_day)
+        daily_revenue, daily_qty = [0.0] * (last - first + 1), [0.0] * (last - first + 1)
+        shift = current.first_day - first
+        daily_revenue[shift:shift + len(current.daily_revenue)] = current.daily_revenue.tolist()
+        daily_qty[shift:shift + len(current.daily_qty)] = current.daily_qty.tolist()
+
+    lo, hi = day_from.toordinal(), day_to.toordinal()
+    fresh = _daily_from_db(user_id, day_from, day_to)
+    for ordinal in range(max(lo, first), min(hi, last) + 1):
+        daily_revenue[ordinal - first], daily_qty[ordinal - first] = fresh.get(ordinal, (0.0, 0.0))
+
+    # Тижні — суми денних колонок (ISO-тиждень з понеділка)
+    first_monday = _monday(first)
+    n_weeks = (last - first_monday) // 7 + 1
+    weekly_revenue, weekly_qty = [0.0] * n_weeks, [0.0] * n_weeks
+    for i, (revenue, qty) in enumerate(zip(daily_revenue, daily_qty)):
+        week = (first + i - first_monday) // 7
+        weekly_revenue[week] += revenue
+        weekly_qty[week] += qty
+
+    _write(user_id, Rollup(first, daily_revenue, daily_qty, first_monday, weekly_revenue, weekly_qty,
+                           _categories_from_db(user_id)))
+
+
+def trends(user_id: int, granularity: str = "day", start: date = None, end: date = None):
+    """Дані для графіка або None, якщо історії продажів ще немає."""
+    rollup = load(user_id)
+    if rollup is None:
+        return None
+    if start is None and end is None:
+        # За замовчуванням — останні 90 днів або 26 тижнів історії
+        end = date.fromordinal(rollup.last_day)
+        start = end - timedelta(days=89 if granularity == "day" else 7 * 25)
+    points = rollup.series(granularity, start, end)
+    total_revenue = sum(rev for rev, _ in rollup.categories.values())
+    return {
+        "granularity": granularity,
+        "from": points[0][0].isoformat() if points else None,
+        "to": points[-1][0].isoformat() if points else None,
+        "history": {"from": date.fromordinal(rollup.first_day).isoformat(),
+                    "to": date.fromordinal(rollup.last_day).isoformat()},
+        "points": [{"date": d.isoformat(), "revenue": round(rev, 2), "qty": round(qty, 2)} for d, rev, qty in points],
+        "categories": [
+            {"name": name, "revenue": round(rev, 2), "qty": round(qty, 2),
+             "share": round(rev / total_revenue, 4) if total_revenue else None}
+            for name, (rev, qty) in sorted(rollup.categories.items(), key=lambda kv: -kv[1][0])
+        ],
+    }
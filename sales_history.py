@@ -0,0 +1,187 @@
+"""Історія продажів користувача для інкрементального аналізу повторних аплоадів.
+
+Кожен аплоад за схемою продажів згортається до (день, товар) і порівнюється зі збереженою
+історією (SalesRecord): ключі, яких ще не було або значення яких змінились, — це новий період.
+plan() лише читає: записи в історію (apply) робить _store_report перед самим комітом звіту,
+щоб write-lock SQLite не тримався весь час викликів OpenAI і рендеру PDF.
+Детально моделі віддаємо лише його, а раніші дні — стислими агрегатами з історії разом із
+підсумком попереднього звіту (SalesSnapshot). Звіт покриває весь період, а промпт не росте
+з кожним тижнем експорту, що перекривається з попереднім.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, update
+
+import digest
+from ingest import parse_date, parse_number
+from models import db, SalesRecord, SalesSnapshot
+
+SALES_HISTORY_ENABLED = os.getenv("SALES_HISTORY_ENABLED", "1") == "1"
+# Скільки символів підсумку попереднього звіту несемо в наступний промпт
+SUMMARY_CHARS = int(os.getenv("SALES_HISTORY_SUMMARY_CHARS", "1500"))
+
+# Відносна похибка, в межах якої збережене значення вважаємо тим самим (округлення в експорті)
+_TOLERANCE = 1e-6
+
+
+class HistoryPlan:
+    """Результат злиття аплоаду з історією: що аналізувати детально і що дати як контекст."""
+
+    def __init__(self, new_start, new_end, new_digest, history_start=None, history_end=None,
+                 history_brief="", previous_summary="", totals=None):
+        self.new_start = new_start
+        self.new_end = new_end
+        self.new_digest = new_digest
+        self.history_start = history_start
+        self.history_end = history_end
+        self.history_brief = history_brief
+        self.previous_summary = previous_summary
+        # Підсумки аплоаду для apply(): в історію вони потрапляють лише разом зі звітом
+        self.totals = totals or {}
+
+    @property
+    def incremental(self) -> bool:
+        return bool(self.history_brief)
+
+    @property
+    def period(self) -> tuple:
+        """Весь період, який покриває звіт."""
+        return (self.history_start or self.new_start), self.new_end
+
+    def as_prompt_data(self) -> str:
+        parts = [f"NEW PERIOD {self.new_start} to {self.new_end} (analyze in detail):\n{self.new_digest}"]
+        if self.incremental:
+            parts.append(
+                f"EARLIER HISTORY {self.history_start} to {self.history_end} "
+                f"(already analyzed; use as baseline for comparison):\n{self.history_brief}"
+            )
+        if self.previous_summary:
+            parts.append(f"PREVIOUS REPORT SUMMARY:\n{self.previous_summary}")
+        return "\n\n".join(parts)
+
+
+def daily_totals(header, rows) -> dict:
+    """Рядки аплоаду → {(день, товар): [категорія, кількість, виторг]}; зламані рядки пропускаються."""
+    idx = digest.column_index(header)
+    totals = {}
+    for row in rows:
+        try:
+            day = parse_date(row[idx["date"]])
+            qty = parse_number(row[idx["qty"]])
+            price = parse_number(row[idx["price"]])
+        except (ValueError, IndexError):
+            continue
+        item = row[idx["item"]] or "(unknown)"
+        entry = totals.setdefault((day, item[:255]), [row[idx["category"]] or "(uncategorized)", 0.0, 0.0])
+        entry[1] += qty
+        entry[2] += qty * price
+    return totals
+
+
+def _same(a: float, b: float) -> bool:
+    return abs(a - b) <= _TOLERANCE * max(1.0, abs(a), abs(b))
+
+
+def _diff(user_id: int, totals: dict):
+    """Порівнює підсумки аплоаду з історією → (inserts, updates, дні з новими або зміненими даними)."""
+    if not totals:
+        return [], [], set()
+    days = [day for day, _ in totals]
+    existing = {
+        (rec.day, rec.item): rec
+        for rec in db.session.execute(
+            select(SalesRecord.id, SalesRecord.day, SalesRecord.item, SalesRecord.qty, SalesRecord.revenue)
+            .where(SalesRecord.user_id == user_id, SalesRecord.day >= min(days), SalesRecord.day <= max(days))
+        )
+    }
+
+    now = datetime.utcnow()
+    inserts, updates, changed_days = [], [], set()
+    for (day, item), (category, qty, revenue) in totals.items():
+        rec = existing.get((day, item))
+        if rec is None:
+            inserts.append({"user_id": user_id, "day": day, "item": item, "category": category,
+                            "qty": qty, "revenue": revenue, "updated_at": now})
+        elif not (_same(rec.qty, qty) and _same(rec.revenue, revenue)):
+            updates.append({"id": rec.id, "category": category, "qty": qty, "revenue": revenue, "updated_at": now})
+        else:
+            continue
+        changed_days.add(day)
+    return inserts, updates, changed_days
+
+
+def merge_upload(user_id: int, totals: dict) -> set:
+    """Зливає підсумки аплоаду з історією (без коміту); повертає дні з новими або зміненими даними."""
+    inserts, updates, changed_days = _diff(user_id, totals)
+    # Пакетні INSERT/UPDATE замість ORM-об'єкта на кожен рядок
+    if inserts:
+        db.session.execute(insert(SalesRecord), inserts)
+    if updates:
+        db.session.execute(update(SalesRecord), updates)
+    return changed_days
+
+
+def apply(user_id: int, history_plan: HistoryPlan) -> set:
+    """Записує аплоад плану в історію (без коміту); викликати безпосередньо перед комітом звіту.
+
+    Різниця рахується заново: між plan() і apply() історію міг змінити інший аплоад.
+    """
+    return merge_upload(user_id, history_plan.totals)
+
+
+def _aggregate(user_id: int, day_from=None, day_to=None, overlay=None) -> digest.SalesAggregator:
+    """Агрегат історії за період; overlay — ще не записані підсумки аплоаду, які мають пріоритет."""
+    query = select(SalesRecord.day, SalesRecord.item, SalesRecord.category, SalesRecord.qty, SalesRecord.revenue) \
+        .where(SalesRecord.user_id == user_id)
+    if day_from is not None:
+        query = query.where(SalesRecord.day >= day_from)
+    if day_to is not None:
+        query = query.where(SalesRecord.day <= day_to)
+    agg = digest.SalesAggregator(digest.SALES_COLUMNS)
+    overlay = overlay or {}
+    for day, item, category, qty, revenue in db.session.execute(query):
+        if (day, item) not in overlay:
+            agg.add_total(day, item, category, qty, revenue)
+    for (day, item), (category, qty, revenue) in overlay.items():
+        if (day_from is None or day >= day_from) and (day_to is None or day <= day_to):
+            agg.add_total(day, item, category, qty, revenue)
+    return agg
+
+
+def plan(user_id: int, header, rows) -> HistoryPlan:
+    """Дані для промпту без запису в БД: новий період (історія + аплоад) і контекст раніших днів."""
+    totals = daily_totals(header, rows)
+    _, _, changed = _diff(user_id, totals)
+    if not changed:
+        # Той самий експорт повторно — аналізуємо весь аплоад як є (відповіді, найімовірніше, з кешу)
+        changed = {day for day, _ in totals}
+    if not changed:
+        return None
+
+    new_start, new_end = min(changed), max(max(changed), max(day for day, _ in totals))
+    new = _aggregate(user_id, new_start, new_end, overlay=totals)
+
+    # Дні аплоаду до new_start не змінились — історії в БД для них досить
+    history = _aggregate(user_id, day_to=new_start - timedelta(days=1))
+    history_days = sorted(history.by_day)
+    snapshot = db.session.get(SalesSnapshot, user_id)
+    return HistoryPlan(
+        new_start, new_end, new.render(),
+        history_start=history_days[0] if history_days else None,
+        history_end=history_days[-1] if history_days else None,
+        history_brief=history.render_brief(),
+        previous_summary=(snapshot.summary or "") if snapshot and history_days else "",
+        totals=totals,
+    )
+
+
+def save_snapshot(user_id: int, period: tuple, report_html: str):
+    """Запам'ятовує період і стислий текст основної секції звіту (без коміту)."""
+    text = re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", report_html or "")).strip()
+    snapshot = db.session.get(SalesSnapshot, user_id) or SalesSnapshot(user_id=user_id)
+    snapshot.period_start, snapshot.period_end = period
+    snapshot.summary = text[:SUMMARY_CHARS]
+    snapshot.updated_at = datetime.utcnow()
+    db.session.add(snapshot)
@@ -0,0 +1,173 @@
+// static/js/dashboard.js
+(function() {
+  function getCookie(name){const m=document.cookie.match(new RegExp('(^| )'+name+'=([^;]+)'));return m?decodeURIComponent(m[2]):null;}
+  function clearCookie(name){document.cookie=name+'=; Max-Age=0; path=/; samesite=Lax';}
+  function show(id){const el=document.getElementById(id); if(el){el.classList.add('show'); setTimeout(()=>el.classList.remove('show'),3500);}}
+
+  // success
+  if (getCookie('rg_generated')==='1'){ show('rg-toast-ok'); clearCookie('rg_generated'); }
+  if (getCookie('rg_upgraded')==='1'){ show('rg-toast-upgraded'); clearCookie('rg_upgraded'); }
+  if (getCookie('rg_confirm_sent')==='1'){ show('rg-toast-confirm-sent'); clearCookie('rg_confirm_sent'); }
+  if (getCookie('rg_auto_verified')==='1'){ show('rg-toast-auto-verified'); clearCookie('rg_auto_verified'); }
+  if (getCookie('rg_confirm_already')==='1'){ show('rg-toast-confirm-already'); clearCookie('rg_confirm_already'); }
+
+  // errors
+  const errs=[
+    ['rg_error','rg-toast-err'],
+    ['rg_err_size','rg-toast-err-size'],
+    ['rg_err_auth','rg-toast-err-auth'],
+    ['rg_err_rate','rg-toast-err-rate'],
+    ['rg_err_timeout','rg-toast-err-timeout'],
+    ['rg_err_no_file','rg-toast-err-nofile'],
+    ['rg_err_type','rg-toast-err-nofile'],
+    ['rg_err_empty','rg-toast-err'],
+    ['rg_err_limit','rg-toast-err-limit'],
+    ['rg_err_busy','rg-toast-err-busy'],
+    ['rg_err_unavailable','rg-toast-err-unavailable'],
+    ['rg_err_batch','rg-toast-err-batch'],
+    ['rg_err_encoding','rg-toast-err-encoding'],
+    ['rg_err_csv','rg-toast-err-csv'],
+    ['rg_err_schema','rg-toast-err-schema'],
+    ['rg_confirm_err','rg-toast-confirm-err']
+  ];
+  errs.forEach(([c,id])=>{ if(getCookie(c)==='1'){ show(id); clearCookie(c);} });
+
+  // Потоковий звіт: fetch + SSE з /analyze/stream; без підтримки — звичайний submit форми
+  const form = document.getElementById('rg-upload');
+  const streamUrl = form && form.dataset.streamUrl;
+  if (!streamUrl || !window.ReadableStream || !window.TextDecoder) return;
+
+  function fail(code){
+    const hit = errs.find(([c])=>c===code);
+    show(hit ? hit[1] : 'rg-toast-err');
+    document.getElementById('rg-live-state').textContent = '';
+    form.querySelector('button').disabled = false;
+  }
+
+  form.addEventListener('submit', function(ev){
+    ev.preventDefault();
+    const live = document.getElementById('rg-live');
+    const state = document.getElementById('rg-live-state');
+    const text = {};
+    live.querySelectorAll('.live-section').forEach(el=>{ el.innerHTML=''; });
+    document.getElementById('rg-live-actions').classList.remove('show');
+    state.textContent = 'Analyzing your sales data…';
+    live.classList.add('show');
+    form.querySelector('button').disabled = true;
+
+    function onEvent(name, data){
+      const el = data.section && live.querySelector('[data-section="'+data.section+'"]');
+      if (name === 'delta'){ text[data.section] = (text[data.section]||'') + data.text; el.innerHTML = text[data.section]; }
+      else if (name === 'section'){ el.innerHTML = data.html; }
+      else if (name === 'status'){
+        // Звіт із черги: стрім закінчився раніше за задачу — далі сторінка задачі
+        if (data.stage === 'detached'){ window.location = data.job_url; return; }
+        state.textContent = data.stage === 'queued' ? 'Queued (#' + data.position + ')…'
+          : data.stage === 'running' ? 'Analyzing your sales data…' : 'Preparing PDF…';
+      }
+      else if (name === 'done'){
+        state.textContent = '✅ Report ready.';
+        document.getElementById('rg-live-download').href = data.download_url;
+        document.getElementById('rg-live-preview').href = data.preview_url;
+        document.getElementById('rg-live-actions').classList.add('show');
+        form.querySelector('button').disabled = false;
+        show('rg-toast-ok');
+      }
+      else if (name === 'error'){ fail(data.code); }
+    }
+
+    fetch(streamUrl, {method:'POST', body:new FormData(form), credentials:'same-origin'})
+      .then(async res => {
+        // 413 та інші редіректи з toast-кукі — просто показуємо дашборд
+        if (res.redirected){ window.location = res.url; return; }
+        if (!res.ok){
+          const body = await res.json().catch(()=>({}));
+          return fail(body.error || (res.status === 413 ? 'rg_err_size' : 'rg_error'));
+        }
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buf = '';
+        for (;;){
+          const {value, done} = await reader.read();
+          if (done) break;
+          buf += decoder.decode(value, {stream:true});
+          let idx;
+          while ((idx = buf.indexOf('\n\n')) >= 0){
+            const raw = buf.slice(0, idx); buf = buf.slice(idx + 2);
+            let name = 'message', data = '';
+            raw.split('\n').forEach(line=>{
+              if (line.startsWith('event: ')) name = line.slice(7);
+              else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (data) onEvent(name, JSON.parse(data));
+          }
+        }
+      })
+      .catch(()=>fail('rg_error'));
+  });
+})();
+
+// === Тренди продажів: SVG-стовпчики без сторонніх бібліотек ===
+(function(){
+  const card = document.getElementById('rg-trends');
+  if (!card) return;
+  const opts = {granularity:'day', metric:'revenue'};
+  let data = null;
+  const fmt = v => v >= 1000 ? (v/1000).toFixed(1) + 'k' : String(Math.round(v));
+
+  function draw(){
+    const svg = document.getElementById('rg-trends-chart');
+    const pts = data.points;
+    const W = svg.clientWidth || 600, H = svg.clientHeight || 220, pad = 24;
+    svg.setAttribute('viewBox', `0 0 ${W} ${H}`);
+    const max = Math.max(1, ...pts.map(p=>p[opts.metric]));
+    const bw = (W - pad) / Math.max(1, pts.length);
+    const ns = 'http://www.w3.org/2000/svg';
+    svg.textContent = '';
+    pts.forEach((p, i)=>{
+      const h = (H - pad) * p[opts.metric] / max;
+      const r = document.createElementNS(ns, 'rect');
+      r.setAttribute('class', 'bar');
+      r.setAttribute('x', pad + i*bw + bw*0.1); r.setAttribute('width', Math.max(1, bw*0.8));
+      r.setAttribute('y', H - pad - h); r.setAttribute('height', h);
+      const t = document.createElementNS(ns, 'title');
+      t.textContent = `${p.date}: ${p[opts.metric]}`;
+      r.appendChild(t); svg.appendChild(r);
+    });
+    [[max, 12], [0, H - pad]].forEach(([v, y])=>{
+      const t = document.createElementNS(ns, 'text');
+      t.setAttribute('class', 'axis'); t.setAttribute('x', 0); t.setAttribute('y', y);
+      t.textContent = fmt(v); svg.appendChild(t);
+    });
+    document.getElementById('rg-trends-range').textContent = data.from ? `${data.from} — ${data.to}` : '';
+    const cats = document.getElementById('rg-trends-cats');
+    cats.textContent = '';
+    data.categories.slice(0, 8).forEach(c=>{
+      const el = document.createElement('span');
+      el.className = 'pill';
+      el.textContent = `${c.name}: ${fmt(c[opts.metric])}` + (c.share != null ? ` (${Math.round(c.share*100)}%)` : '');
+      cats.appendChild(el);
+    });
+  }
+
+  function load(){
+    fetch(`${card.dataset.url}?granularity=${opts.granularity}`, {credentials:'same-origin'})
+      .then(r=>r.ok ? r.json() : null)
+      .then(d=>{
+        if (!d || !d.points.length) return;
+        data = d; card.hidden = false; draw();
+      })
+      .catch(()=>{});
+  }
+
+  card.querySelectorAll('.seg').forEach(seg=>{
+    seg.addEventListener('click', e=>{
+      const b = e.target.closest('button');
+      if (!b) return;
+      seg.querySelectorAll('button').forEach(x=>x.classList.toggle('on', x === b));
+      opts[seg.dataset.key] = b.dataset.v;
+      if (seg.dataset.key === 'granularity') load(); else if (data) draw();
+    });
+  });
+  load();
+})();
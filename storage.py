@@ -0,0 +1,229 @@
+"""Сховище файлів звітів: адресація за вмістом, шардовані директорії, gzip для HTML.
+
+Ключ звіту (Report.filename) — `ab/cd/<sha256>.pdf` або `ab/cd/<sha256>.html.gz`: імена не
+колізують між користувачами і запусками в одну секунду, а в одній директорії не буває
+більше кількох сотень файлів. Однаковий вміст зберігається один раз. Старі звіти з плоскими
+іменами (`report_<timestamp>.pdf` у корені REPORTS_DIR) читаються як раніше.
+
+sweep() прибирає звіти старші за REPORT_RETENTION_DAYS, найстаріші звіти користувача понад
+REPORT_USER_QUOTA_MB і файли-сироти без рядка Report. Запускається у worker.py (report-sweeper).
+"""
+import gzip
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from models import db, Report, ReportJob
+
+REPORTS_DIR = os.getenv("REPORTS_DIR", "reports")
+REPORT_GZIP = os.getenv("REPORT_GZIP", "1") == "1"
+# 0 — без обмеження
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "0"))
+REPORT_USER_QUOTA_MB = float(os.getenv("REPORT_USER_QUOTA_MB", "0"))
+REPORT_SWEEP_SECONDS = float(os.getenv("REPORT_SWEEP_SECONDS", "3600"))
+# Файл без рядка Report молодший за це — ще може чекати коміту транзакції
+ORPHAN_GRACE_SECONDS = 3600
+
+_TMP_DIR = "tmp"
+
+
+class StoredFile:
+    """Куди дивитись на диску і як віддавати: шлях, gzip-кодування, ETag за вмістом."""
+
+    def __init__(self, path: str, gzipped: bool, etag: str = None):
+        self.path = path
+        self.gzipped = gzipped
+        self.etag = etag
+
+    @property
+    def immutable(self) -> bool:
+        # Вміст за хеш-ключем ніколи не змінюється — браузер може не перепитувати
+        return self.etag is not None
+
+    def read_decoded(self) -> bytes:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        return gzip.decompress(data) if self.gzipped else data
+
+
+def _key(digest: str, ext: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def _full_path(key: str) -> str:
+    return os.path.join(REPORTS_DIR, *key.split("/"))
+
+
+def temp_path(ext: str) -> str:
+    """Тимчасовий шлях у межах REPORTS_DIR (та сама ФС — put_file переносить його через rename)."""
+    tmp_dir = os.path.join(REPORTS_DIR, _TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{uuid.uuid4().hex}.{ext}")
+
+
+def _reuse(path: str) -> bool:
+    """Такий самий вміст уже збережено? Свіжий mtime не дає sweep() прийняти його за сироту,
+    поки новий рядок Report ще не закомічено."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _place(src: str, key: str) -> str:
+    dest = _full_path(key)
+    if _reuse(dest):
+        os.remove(src)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src, dest)
+    return key
+
+
+def put_file(src: str, ext: str) -> str:
+    """Переносить готовий файл (temp_path) у сховище → ключ."""
+    digest = hashlib.sha256()
+    with open(src, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return _place(src, _key(digest.hexdigest(), ext))
+
+
+def put_html(html: str) -> str:
+    """Зберігає HTML-звіт (стиснутий при REPORT_GZIP) → ключ. Хеш рахується від нестиснутого вмісту."""
+    data = html.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    ext = "html.gz" if REPORT_GZIP else "html"
+    if _reuse(_full_path(_key(digest, ext))):
+        return _key(digest, ext)
+    tmp = temp_path(ext)
+    with open(tmp, "wb") as f:
+        # mtime=0: той самий HTML дає байт-у-байт той самий .gz
+        f.write(gzip.compress(data, compresslevel=6, mtime=0) if REPORT_GZIP else data)
+    return _place(tmp, _key(digest, ext))
+
+
+def locate(key: str):
+    """Ключ Report.filename → StoredFile або None, якщо файлу немає чи ключ поза сховищем."""
+    root = os.path.abspath(REPORTS_DIR)
+    path = os.path.abspath(_full_path(key))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    name = os.path.basename(key)
+    stem = name.split(".", 1)[0]
+    hashed = "/" in key and len(stem) == 64
+    return StoredFile(path, gzipped=name.endswith(".gz"), etag=stem if hashed else None)
+
+
+def _remove(key: str):
+    path = _full_path(key)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    # Порожні шарди не лишаємо
+    for parent in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+        if os.path.abspath(parent) == os.path.abspath(REPORTS_DIR):
+            break
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+
+
+def _size(key: str) -> int:
+    try:
+        return os.path.getsize(_full_path(key))
+    except OSError:
+        return 0
+
+
+def sweep(now: datetime = None) -> dict:
+    """Один прохід прибирання; комітить сам. → лічильники і користувачі, чиї звіти видалено."""
+    now = now or datetime.utcnow()
+    doomed = []
+
+    if REPORT_RETENTION_DAYS > 0:
+        cutoff = now - timedelta(days=REPORT_RETENTION_DAYS)
+        doomed += db.session.execute(
+            select(Report.id, Report.user_id, Report.filename).where(Report.created_at < cutoff)
+        ).all()
+
+    if REPORT_USER_QUOTA_MB > 0:
+        quota = int(REPORT_USER_QUOTA_MB * 1024 * 1024)
+        seen = {row.id for row in doomed}
+        used, user_id = 0, None
+        rows = db.session.execute(
+            select(Report.id, Report.user_id, Report.filename)
+            .order_by(Report.user_id, Report.created_at.desc(), Report.id.desc())
+        )
+        for row in rows:
+            newest = row.user_id != user_id
+            if newest:
+                used, user_id = 0, row.user_id
+            used += _size(row.filename)
+            # Найновіший звіт лишаємо завжди, навіть якщо сам він більший за квоту
+            if used > quota and not newest and row.id not in seen:
+                doomed.append(row)
+                seen.add(row.id)
+
+    removed_users = set()
+    if doomed:
+        ids = [row.id for row in doomed]
+        db.session.execute(update(ReportJob).where(ReportJob.report_id.in_(ids)).values(report_id=None))
+        db.session.execute(Report.__table__.delete().where(Report.id.in_(ids)))
+        db.session.commit()
+        removed_users = {row.user_id for row in doomed}
+
+    # Файли, на які більше не посилається жоден звіт (спільний вміст, сироти після відкату)
+    referenced = set(db.session.execute(select(Report.filename)).scalars())
+    files = 0
+    grace = now.timestamp() - ORPHAN_GRACE_SECONDS
+    for dirpath, _dirs, names in os.walk(REPORTS_DIR):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, REPORTS_DIR).replace(os.sep, "/")
+            if key in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) > grace:
+                    continue
+            except OSError:
+                continue
+            _remove(key)
+            files += 1
+
+    return {"reports": len(doomed), "files": files, "users": removed_users}
+
+
+def run_sweeper(app, on_removed=None, stop_event=None):
+    """Цикл прибирання раз на REPORT_SWEEP_SECONDS; on_removed(user_id) — скинути кеш стану."""
+    stop_event = stop_event or threading.Event()
+    app.logger.info("[REPORT] sweeper started pid=%s retention_days=%s quota_mb=%s",
+                    os.getpid(), REPORT_RETENTION_DAYS, REPORT_USER_QUOTA_MB)
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                result = sweep()
+                for user_id in result["users"]:
+                    if on_removed:
+                        on_removed(user_id)
+            if result["reports"] or result["files"]:
+                app.logger.info("[REPORT] swept reports=%s files=%s", result["reports"], result["files"])
+        except Exception:
+            app.logger.exception("[REPORT] sweep failed")
+        stop_event.wait(REPORT_SWEEP_SECONDS)
+
+
+def start_thread_sweeper(app, on_removed=None) -> threading.Event:
+    """Вбудований sweeper у потоці — для локального `python app.py`."""
+    stop_event = threading.Event()
+    threading.Thread(target=run_sweeper, args=(app, on_removed, stop_event), daemon=True,
+                     name="report-sweeper").start()
+    return stop_event
+
@@ -0,0 +1,122 @@
+"""Map-reduce для великих CSV поза схемою продажів (RAW_CSV_FALLBACK).
+
+Сирі рядки, що не влазять в один промпт, ріжемо на шматки за бюджетом токенів (заголовок
+повторюється в кожному), паралельно підсумовуємо кожен шматок (map) і зводимо часткові
+підсумки в один (reduce; за потреби в кілька рівнів). Результат іде в промпти звіту замість
+сирого CSV, тож звіт враховує весь файл, а не перші рядки. Файли за схемою сюди не потрапляють:
+їх уже повністю згортає digest.py.
+"""
+import os
+
+import llm
+
+# Бюджет токенів на один шматок і поріг, до якого сирий CSV шлемо в промпт як є
+CHUNK_TOKENS = int(os.getenv("CSV_CHUNK_TOKENS", "6000"))
+DIRECT_TOKENS = int(os.getenv("CSV_DIRECT_TOKENS", "8000"))
+# Таймаут однієї хвилі map/reduce (включно з очікуванням у лімітері)
+MAP_TIMEOUT = float(os.getenv("CSV_MAP_TIMEOUT", "90"))
+# Скільки шматків одного аплоаду йде в OpenAI одночасно (решту пулу лишаємо іншим звітам)
+MAP_CONCURRENCY = int(os.getenv("CSV_MAP_CONCURRENCY", "4"))
+
+MAP_PROMPT = (
+    "You are analyzing one slice ({part}) of a restaurant sales export. "
+    "Summarize ONLY this slice as a plain-text bullet list, under 200 words: totals and counts, "
+    "the period covered, the strongest and weakest items or segments, notable patterns and anomalies. "
+    "Keep every number exact; do not speculate beyond the data. English only.\n\n"
+    "CSV SLICE:\n{data}"
+)
+REDUCE_PROMPT = (
+    "Merge these partial summaries of consecutive slices of ONE restaurant sales export into a single "
+    "plain-text bullet list, under 400 words. Combine totals across slices, keep the overall period, "
+    "rank the strongest and weakest items or segments across the whole file, and keep notable anomalies. "
+    "Keep numbers exact where given. English only.\n\n{data}"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # Та сама груба оцінка, що й у ratelimit.estimate_tokens (без очікуваної відповіді)
+    return len(text) // 4
+
+
+def needs_map_reduce(upload) -> bool:
+    """Чи більший сирий CSV за поріг прямого промпту (без побудови всього тексту)."""
+    used = estimate_tokens(", ".join(upload.header))
+    for row in upload.rows:
+        used += estimate_tokens(", ".join(row)) + 1
+        if used > DIRECT_TOKENS:
+            return True
+    return False
+
+
+def chunk_rows(header, rows, budget: int = CHUNK_TOKENS) -> list:
+    """Рядки → текстові шматки CSV до budget токенів кожен, з заголовком у кожному."""
+    head = ", ".join(header)
+    chunks, lines, used = [], [head], estimate_tokens(head)
+    for row in rows:
+        line = ", ".join(row)
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget and len(lines) > 1:
+            chunks.append("\n".join(lines))
+            lines, used = [head], estimate_tokens(head)
+        lines.append(line)
+        used += cost
+    if len(lines) > 1:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
+def _group(texts, budget: int = CHUNK_TOKENS) -> list:
+    """Склеює часткові підсумки в групи, що влазять у бюджет одного reduce-промпту."""
+    groups, current, used = [], [], 0
+    for text in texts:
+        cost = estimate_tokens(text)
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(text)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _run(client, prompts: dict, lane: str, timeout: float) -> list:
+    """Виконує промпти хвилями по MAP_CONCURRENCY; будь-який збій валить весь аплоад."""
+    names = list(prompts)
+    results = {}
+    for start in range(0, len(names), MAP_CONCURRENCY):
+        wave = {name: prompts[name] for name in names[start:start + MAP_CONCURRENCY]}
+        done, errors = llm.run_sections(client, wave, timeout=timeout, lane=lane)
+        if errors:
+            # Підсумок без частини файлу мовчки спотворить звіт — краще чесна помилка
+            raise next(iter(errors.values()))
+        results.update(done)
+    return [results[name] for name in names]
+
+
+def map_reduce(client, upload, lane: str = "free") -> str:
+    """Підсумок усього аплоаду: map по шматках, далі reduce, поки не лишиться один текст."""
+    chunks = chunk_rows(upload.header, upload.rows)
+    total = len(chunks)
+    prompts = {
+        f"chunk_{i}": MAP_PROMPT.format(part=f"part {i + 1} of {total}", data=chunk)
+        for i, chunk in enumerate(chunks)
+    }
+    summaries = _run(client, prompts, lane, MAP_TIMEOUT)
+    llm.log.info("[MAPREDUCE] rows=%s chunks=%s", len(upload.rows), total)
+
+    level = 0
+    while len(summaries) > 1:
+        level += 1
+        groups = _group(summaries)
+        if len(groups) == len(summaries):
+            # Кожен підсумок сам по собі більший за бюджет — зводимо хоча б попарно
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        prompts = {
+            f"reduce_{level}_{i}": REDUCE_PROMPT.format(data="\n\n".join(
+                f"PART {j + 1}:\n{text}" for j, text in enumerate(group)
+            ))
+            for i, group in enumerate(groups)
+        }
+        summaries = _run(client, prompts, lane, MAP_TIMEOUT)
+    return summaries[0]
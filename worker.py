@@ -0,0 +1,138 @@
+"""Пул процесів-воркерів черги звітів (jobs.py).
+
+Запуск поруч із gunicorn:  python worker.py
+Кількість процесів — REPORT_WORKERS (за замовчуванням 2). Процеси, що впали, перезапускаються;
+їхні незавершені задачі повертає в чергу jobs.recover_stale() за heartbeat-таймаутом.
+Окремими процесами тут же працюють sender outbox-листів (outbox.py), якщо пошта налаштована,
+прибирання старих звітів (storage.sweep) і health-prober OpenAI (breaker.py).
+"""
+import logging
+import multiprocessing as mp
+import os
+import signal
+import threading
+import time
+
+import metrics
+
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+OUTBOX_SENDER = os.getenv("OUTBOX_SENDER", "1") == "1"
+REPORT_SWEEPER = os.getenv("REPORT_SWEEPER", "1") == "1"
+OPENAI_PROBER = os.getenv("OPENAI_PROBER", "1") == "1"
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("WORKER_SHUTDOWN_GRACE_SECONDS", "90"))
+
+log = logging.getLogger("restgenius.worker")
+
+
+def _app():
+    # Застосунок збираємо вже в дочірньому процесі: власні з'єднання з БД і HTTP-пул OpenAI
+    from app import create_app, ensure_schema
+
+    app = create_app()
+    with app.app_context():
+        ensure_schema()
+    return app
+
+
+def _worker_main():
+    from app import process_report_job
+    import jobs
+    import llm
+
+    app = _app()
+
+    stop = threading.Event()
+    # SIGTERM/SIGINT: доробити поточну задачу і вийти
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    jobs.run_worker(app, process_report_job, stop, paused=llm.breaker.is_open)
+
+
+def _sender_main():
+    from app import mail, MAIL_ENABLED
+    import outbox
+
+    if not MAIL_ENABLED:
+        return
+    app = _app()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    outbox.run_sender(app, mail, stop)
+
+
+def _sweeper_main():
+    from app import invalidate_user
+    import storage
+
+    app = _app()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    storage.run_sweeper(app, on_removed=invalidate_user, stop_event=stop)
+
+
+def _prober_main():
+    import breaker
+    import llm
+
+    app = _app()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    breaker.run_prober(app, llm.breaker, llm.get_client(), llm.OPENAI_MODEL, stop)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s")
+    ctx = mp.get_context("spawn")
+    procs = {}
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    # Схема — тут, до spawn: інакше всі процеси разом змагаються за CREATE TABLE на свіжій БД
+    from app import prepare_schema
+
+    prepare_schema()
+
+    slots = {f"report-worker-{i}": _worker_main for i in range(REPORT_WORKERS)}
+    if OUTBOX_SENDER:
+        slots["outbox-sender"] = _sender_main
+    if REPORT_SWEEPER:
+        slots["report-sweeper"] = _sweeper_main
+    if OPENAI_PROBER:
+        slots["openai-prober"] = _prober_main
+
+    log.info("starting %s report workers, outbox sender=%s, report sweeper=%s, openai prober=%s",
+             REPORT_WORKERS, OUTBOX_SENDER, REPORT_SWEEPER, OPENAI_PROBER)
+    while not stopping.is_set():
+        for name, target in slots.items():
+            proc = procs.get(name)
+            if proc is not None and proc.is_alive():
+                continue
+            if proc is not None:
+                # Sender без налаштованої пошти виходить з кодом 0 — його не перезапускаємо
+                if name == "outbox-sender" and proc.exitcode == 0:
+                    continue
+                log.warning("worker %s exited code=%s; restarting", proc.name, proc.exitcode)
+                metrics.mark_process_dead(proc.pid)
+            proc = ctx.Process(target=target, name=name)
+            proc.start()
+            procs[name] = proc
+        stopping.wait(1)
+
+    log.info("stopping workers")
+    for proc in procs.values():
+        proc.terminate()
+    deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+    for proc in procs.values():
+        proc.join(timeout=max(0.0, deadline - time.monotonic()))
+        if proc.is_alive():
+            proc.kill()
+
+
+if __name__ == "__main__":
+    main()